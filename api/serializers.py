@@ -6,11 +6,21 @@ from apps.advertisements.models import CarAd, FavoriteAd as Favorite, City, CarP
 from apps.catalog.models import CarBrand, CarModel
 from apps.chat.models import ChatMessage as Message
 from apps.reviews.models import Review
+from apps.core.image_resize import srcset
+
+
+class SrcsetField(serializers.ReadOnlyField):
+    """srcset уменьшенных копий изображения для разных ширин экрана"""
+
+    def to_representation(self, value):
+        return srcset(value)
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_srcset = SrcsetField(source='avatar')
+
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name',
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'avatar_srcset',
                   'date_joined', 'last_login', 'is_staff']
         read_only_fields = ['date_joined', 'last_login', 'is_staff']
 
@@ -37,32 +47,41 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
 class CarBrandSerializer(serializers.ModelSerializer):
     models_count = serializers.IntegerField(read_only=True)
+    logo_srcset = SrcsetField(source='logo')
 
     class Meta:
         model = CarBrand
         fields = ['id', 'name', 'slug', 'country', 'description',
-                  'logo', 'is_active', 'models_count', 'created_at']
-        read_only_fields = ['slug', 'created_at']
+                  'logo', 'logo_srcset', 'is_active', 'models_count', 'ads_count', 'created_at']
+        read_only_fields = ['slug', 'ads_count', 'created_at']
 
 
 class CarModelSerializer(serializers.ModelSerializer):
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     brand_slug = serializers.CharField(source='brand.slug', read_only=True)
+    image_srcset = SrcsetField(source='image')
 
     class Meta:
         model = CarModel
         fields = ['id', 'name', 'slug', 'brand', 'brand_name', 'brand_slug',
                   'body_type', 'year_start', 'year_end', 'description',
-                  'image', 'is_active', 'created_at']
+                  'image', 'image_srcset', 'is_active', 'created_at']
         read_only_fields = ['slug', 'created_at']
 
 
 class AdPhotoSerializer(serializers.ModelSerializer):
+    renditions = serializers.SerializerMethodField()
+    image_srcset = SrcsetField(source='image')
+
     class Meta:
         model = AdPhoto  # Теперь это алиас для CarPhoto
-        fields = ['id', 'image', 'thumbnail', 'is_main', 'position', 'alt_text', 'created_at']  # ИСПРАВЛЕНО поля
+        fields = ['id', 'image', 'thumbnail', 'renditions', 'image_srcset', 'is_main', 'position', 'alt_text', 'created_at']  # ИСПРАВЛЕНО поля
         read_only_fields = ['created_at']
 
+    def get_renditions(self, obj):
+        """Варианты card, gallery и retina (пусто, пока фото обрабатывается)"""
+        return obj.rendition_urls()
+
 
 class CarAdSerializer(serializers.ModelSerializer):
     brand_name = serializers.CharField(source='model.brand.name', read_only=True)
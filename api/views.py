@@ -12,9 +12,18 @@ from django.contrib.auth import authenticate
 from django.shortcuts import get_object_or_404
 from django.db.models import Q, Count, Avg, Min, Max
 from django.http import JsonResponse
-from django.core.cache import cache
 
-from apps.advertisements.models import CarAd, FavoriteAd as Favorite, City
+from apps.advertisements.counters import (
+    ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS, get_counts, price_stats
+)
+from apps.advertisements.models import AdSearchIndex, CarAd, FavoriteAd as Favorite, City
+from apps.advertisements.facets import get_facets
+from apps.advertisements.filters import AD_COLUMNS, parse_listing_filters
+from apps.advertisements.search import search_ads
+from apps.advertisements.search_index import load_ads
+from apps.advertisements.view_counters import merge_pending_views
+from apps.core.pagination import KeysetPagination
+from apps.core.tagged_cache import ADS, CATALOG, USERS, get_or_compute
 from apps.catalog.models import CarBrand, CarModel
 
 from .serializers import (
@@ -40,6 +49,36 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class AdResultsSetPagination(KeysetPagination):
+    """Первые страницы по номеру, дальше по курсору (без COUNT)"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class AdSearchPagination(AdResultsSetPagination):
+    """
+    Ответ поиска в прежнем формате: next/previous - флаги, page, page_size.
+    Ссылки на соседние страницы (в том числе по курсору) - в next_url/previous_url,
+    в режиме курсора count и page равны null.
+    """
+
+    def get_paginated_response(self, data):
+        links = super().get_paginated_response(data).data
+        keyset = self.keyset_page is not None
+        return Response({
+            'count': links.get('count'),
+            'count_approximate': links.get('count_approximate', False),
+            'next': links['next'] is not None,
+            'previous': links['previous'] is not None,
+            'page': None if keyset else self.page.number,
+            'page_size': self.get_page_size(self.request),
+            'next_url': links['next'],
+            'previous_url': links['previous'],
+            'results': data,
+        })
+
+
 # ============================================================================
 # USER VIEWSETS
 # ============================================================================
@@ -111,7 +150,7 @@ class BrandViewSet(viewsets.ModelViewSet):
     pagination_class = StandardResultsSetPagination
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description', 'country']
-    ordering_fields = ['name', 'created_at', 'models_count']
+    ordering_fields = ['name', 'created_at', 'models_count', 'ads_count']
     ordering = ['name']
 
     def get_queryset(self):
@@ -251,9 +290,9 @@ class AdViewSet(viewsets.ModelViewSet):
     """
     queryset = CarAd.objects.filter(is_active=True)
     serializer_class = CarAdSerializer
-    pagination_class = StandardResultsSetPagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['title', 'description', 'model__name', 'model__brand__name']
+    pagination_class = AdResultsSetPagination
+    # ?search= обрабатывает спецификация фильтров (полнотекстовый поиск)
+    filter_backends = [filters.OrderingFilter]
     ordering_fields = ['price', 'year', 'mileage', 'created_at', 'views']
     ordering = ['-created_at']
 
@@ -271,7 +310,7 @@ class AdViewSet(viewsets.ModelViewSet):
         """
         Разрешения в зависимости от действия.
         """
-        if self.action in ['list', 'retrieve', 'search']:
+        if self.action in ['list', 'retrieve', 'search', 'facets']:
             permission_classes = [AllowAny]
         elif self.action == 'create':
             permission_classes = [IsAuthenticated]
@@ -284,41 +323,27 @@ class AdViewSet(viewsets.ModelViewSet):
             'owner', 'model', 'brand', 'city'
         ).prefetch_related('photos')
 
-        # Фильтры
-        brand_id = self.request.query_params.get('brand', None)
-        if brand_id:
-            queryset = queryset.filter(model__brand_id=brand_id)
-
-        model_id = self.request.query_params.get('model', None)
-        if model_id:
-            queryset = queryset.filter(model_id=model_id)
-
-        min_price = self.request.query_params.get('min_price', None)
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-
-        max_price = self.request.query_params.get('max_price', None)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-
-        min_year = self.request.query_params.get('min_year', None)
-        if min_year:
-            queryset = queryset.filter(year__gte=min_year)
-
-        max_year = self.request.query_params.get('max_year', None)
-        if max_year:
-            queryset = queryset.filter(year__lte=max_year)
-
-        city_id = self.request.query_params.get('city', None)
-        if city_id:
-            queryset = queryset.filter(city_id=city_id)
+        # Общие фильтры списков (та же спецификация, что и у HTML-списка)
+        self.listing_filters = parse_listing_filters(self.request.query_params, columns=AD_COLUMNS)
+        # В search результаты сортируются по релевантности в самом действии
+        queryset = self.listing_filters.apply(queryset, search=self.action != 'search')
 
         status = self.request.query_params.get('status', None)
-        if status:
+        if status == 'active':
+            # Опубликованные объявления (условие частичных индексов car_ads_act_*)
+            queryset = queryset.filter(status='active', is_active=True)
+        elif status:
             queryset = queryset.filter(status=status)
 
         return queryset
 
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        # Просмотры, еще не перенесенные из Redis в БД
+        merge_pending_views([instance])
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
         """
         При создании объявления устанавливаем владельца.
@@ -332,14 +357,14 @@ class AdViewSet(viewsets.ModelViewSet):
         """
         queryset = self.filter_queryset(self.get_queryset())
 
-        # Дополнительные фильтры для поиска
-        query = request.query_params.get('q', None)
+        # Текст поиска (?q= или ?search=) уже нормализован спецификацией фильтров
+        query = self.listing_filters.search
         if query:
-            queryset = queryset.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query) |
-                Q(model__name__icontains=query) |
-                Q(model__brand__name__icontains=query)
+            # Явная сортировка (?ordering=) важнее релевантности
+            queryset = search_ads(
+                query,
+                queryset,
+                order_by_rank='ordering' not in request.query_params
             )
 
         page = self.paginate_queryset(queryset)
@@ -350,15 +375,23 @@ class AdViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Фасеты фильтров: значения и количества объявлений при текущих фильтрах.
+        Параметры те же, что у HTML-списка объявлений.
+        """
+        facets = get_facets(parse_listing_filters(request.query_params))
+        return Response(facets.as_dict())
+
     @action(detail=True, methods=['post'])
     def increment_views(self, request, pk=None):
         """
         Увеличение счетчика просмотров.
         """
         ad = self.get_object()
-        ad.views += 1
-        ad.save()
-        return Response({'views': ad.views})
+        ad.increment_views()
+        return Response({'views': ad.views_count})
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def toggle_favorite(self, request, pk=None):
@@ -427,72 +460,28 @@ class AdSearchView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
-        query = request.query_params.get('q', '')
-        brand_id = request.query_params.get('brand_id')
-        model_id = request.query_params.get('model_id')
-        min_price = request.query_params.get('min_price')
-        max_price = request.query_params.get('max_price')
-        min_year = request.query_params.get('min_year')
-        max_year = request.query_params.get('max_year')
-        city_id = request.query_params.get('city_id')
-        body_type = request.query_params.get('body_type')
-
-        queryset = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).select_related('owner', 'model', 'brand', 'city')
-
-        if query:
-            queryset = queryset.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query) |
-                Q(model__name__icontains=query) |
-                Q(model__brand__name__icontains=query)
-            )
-
-        if brand_id:
-            queryset = queryset.filter(model__brand_id=brand_id)
-
-        if model_id:
-            queryset = queryset.filter(model_id=model_id)
+        # brand_id, model_id, city_id, q - синонимы параметров HTML-списка
+        listing_filters = parse_listing_filters(request.query_params)
+        query = listing_filters.search
 
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
+        # Фильтры по плоской таблице ad_search_index (только активные объявления)
+        index = listing_filters.apply(AdSearchIndex.objects.all(), search=False)
 
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-
-        if min_year:
-            queryset = queryset.filter(year__gte=min_year)
-
-        if max_year:
-            queryset = queryset.filter(year__lte=max_year)
+        # Пагинация: по номеру для первых страниц, дальше по курсору
+        paginator = AdSearchPagination()
 
-        if city_id:
-            queryset = queryset.filter(city_id=city_id)
-
-        if body_type:
-            queryset = queryset.filter(model__body_type=body_type)
-
-        # Пагинация
-        page_size = int(request.query_params.get('page_size', 20))
-        page = int(request.query_params.get('page', 1))
-        start = (page - 1) * page_size
-        end = start + page_size
-
-        total_count = queryset.count()
-        ads = queryset[start:end]
+        if query:
+            # Поиск сортируется по релевантности
+            queryset = search_ads(
+                query,
+                CarAd.objects.filter(pk__in=index.values('ad_id'))
+            ).select_related('owner', 'model', 'brand', 'city')
+            ads = paginator.paginate_queryset(queryset, request, view=self)
+        else:
+            ads = load_ads(paginator.paginate_queryset(index, request, view=self))
 
         serializer = CarAdSerializer(ads, many=True)
-
-        return Response({
-            'count': total_count,
-            'next': end < total_count,
-            'previous': page > 1,
-            'page': page,
-            'page_size': page_size,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
 
 
 class ModelsByBrandView(APIView):
@@ -529,54 +518,45 @@ class StatsView(APIView):
     """
     permission_classes = [AllowAny]
 
+    # Последние объявления содержат счетчики просмотров
+    cache_timeout = 60 * 60
+
     def get(self, request):
-        cache_key = 'api_stats'
-        stats = cache.get(cache_key)
-
-        if not stats:
-            # Общая статистика
-            total_ads = CarAd.objects.filter(is_active=True, status='active').count()
-            total_brands = CarBrand.objects.filter(is_active=True).count()
-            total_models = CarModel.objects.filter(is_active=True).count()
-            total_users = User.objects.filter(is_active=True).count()
-
-            # Статистика цен
-            price_stats = CarAd.objects.filter(
-                is_active=True,
-                status='active',
-                price__isnull=False
-            ).aggregate(
-                avg_price=Avg('price'),
-                min_price=Min('price'),
-                max_price=Max('price')
-            )
+        return Response(self.cached_stats())
+
+    def cached_stats(self):
+        return get_or_compute('api_stats', [ADS, CATALOG, USERS], self.get_stats, self.cache_timeout)
 
-            # Популярные марки
-            popular_brands = CarBrand.objects.filter(
-                is_active=True
-            ).annotate(
-                ads_count=Count('models__ads')
-            ).order_by('-ads_count')[:5]
-
-            # Последние объявления
-            recent_ads = CarAd.objects.filter(
-                is_active=True,
-                status='active'
-            ).order_by('-created_at')[:5]
-
-            stats = {
-                'total_ads': total_ads,
-                'total_brands': total_brands,
-                'total_models': total_models,
-                'total_users': total_users,
-                'price_stats': price_stats,
-                'popular_brands': CarBrandSerializer(popular_brands, many=True).data,
-                'recent_ads': CarAdSerializer(recent_ads, many=True).data,
-            }
-
-            cache.set(cache_key, stats, 300)  # Кэшируем на 5 минут
-
-        return Response(stats)
+    def get_stats(self):
+        # Общая статистика (счетчики сайта)
+        counts = get_counts(ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS)
+
+        # Статистика цен
+        prices = price_stats()
+
+        # Популярные марки
+        popular_brands = CarBrand.objects.filter(
+            is_active=True
+        ).annotate(
+            models_count=Count('models')
+        ).order_by('-ads_count')[:5]
+
+        # Последние объявления
+        recent_ads = CarAd.objects.filter(
+            is_active=True,
+            status='active'
+        ).order_by('-created_at')[:5]
+
+        return {
+            'total_ads': counts[ACTIVE_ADS],
+            'total_brands': counts[ACTIVE_BRANDS],
+            'total_models': counts[ACTIVE_MODELS],
+            'total_users': counts[ACTIVE_USERS],
+            'price_stats': prices,
+            # Обычные list/dict: в кэше они хранятся компактнее (см. cache_serializer)
+            'popular_brands': [dict(row) for row in CarBrandSerializer(popular_brands, many=True).data],
+            'recent_ads': [dict(row) for row in CarAdSerializer(recent_ads, many=True).data],
+        }
 
 
 class CustomAuthToken(ObtainAuthToken):
@@ -1,6 +1,6 @@
 # apps/advertisements/admin.py
 from django.contrib import admin
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.contrib.admin import SimpleListFilter
@@ -11,6 +11,10 @@ from datetime import timedelta
 from pyexpat.errors import messages
 
 from .models import CarAd, CarPhoto, CarAdFeature, FavoriteAd, SearchHistory, CarView
+from .photo_storage import duplicate_ads
+from .listing_cache import ad_tags, invalidate_listings
+from .search_index import refresh_ad_index_for
+from apps.core.counting import CountingPaginator
 
 
 # ==============================
@@ -147,10 +151,28 @@ class CarAdFeatureInline(admin.TabularInline):
 # ДЕЙСТВИЯ АДМИНКИ
 # ==============================
 
+def _update_ads(queryset, **fields):
+    """
+    queryset.update() для действий админки.
+
+    id берутся до обновления: queryset действия сохраняет фильтры списка
+    (например, status=pending) и после обновления уже не находит эти
+    объявления. update() не вызывает сигналы, поэтому индекс и кэш
+    страниц списка обновляются здесь.
+    """
+    rows = list(queryset.values_list('pk', 'brand_id', 'model_id', 'city_id'))
+    ad_ids = [row[0] for row in rows]
+    updated = CarAd.objects.filter(pk__in=ad_ids).update(**fields)
+    refresh_ad_index_for(CarAd.objects.filter(pk__in=ad_ids))
+    invalidate_listings(*(ad_tags(*row[1:]) for row in {row[1:] for row in rows}))
+    return updated
+
+
 @admin.action(description=_('Активировать выбранные объявления'))
 def activate_ads(modeladmin, request, queryset):
     """Активация объявлений"""
-    updated = queryset.update(
+    updated = _update_ads(
+        queryset,
         status='active',
         is_active=True,
         moderated_at=timezone.now(),
@@ -165,7 +187,7 @@ def activate_ads(modeladmin, request, queryset):
 @admin.action(description=_('Отправить на модерацию'))
 def send_for_moderation(modeladmin, request, queryset):
     """Отправка на модерацию"""
-    updated = queryset.update(status='pending')
+    updated = _update_ads(queryset, status='pending')
     modeladmin.message_user(
         request,
         _('{} объявлений отправлено на модерацию').format(updated)
@@ -175,7 +197,7 @@ def send_for_moderation(modeladmin, request, queryset):
 @admin.action(description=_('Пометить как проданные'))
 def mark_as_sold(modeladmin, request, queryset):
     """Пометка как проданных"""
-    updated = queryset.update(status='sold', is_active=False)
+    updated = _update_ads(queryset, status='sold', is_active=False)
     modeladmin.message_user(
         request,
         _('{} объявлений помечено как проданные').format(updated)
@@ -185,7 +207,8 @@ def mark_as_sold(modeladmin, request, queryset):
 @admin.action(description=_('Заблокировать объявления'))
 def ban_ads(modeladmin, request, queryset):
     """Блокировка объявлений"""
-    updated = queryset.update(
+    updated = _update_ads(
+        queryset,
         status='banned',
         is_active=False,
         moderated_at=timezone.now(),
@@ -197,45 +220,19 @@ def ban_ads(modeladmin, request, queryset):
     )
 
 
-@admin.action(description=_('Удалить старые фотографии без миниатюр'))
+@admin.action(description=_('Создать варианты изображений'))
 def generate_thumbnails(modeladmin, request, queryset):
-    """Генерация миниатюр для фотографий"""
-    from django.core.files.base import ContentFile
-    from PIL import Image
-    import io
+    """Поставить фотографии в очередь на создание вариантов (миниатюр)"""
+    from .tasks import render_photo_task
 
     count = 0
-    for photo in queryset.filter(thumbnail__isnull=True):
-        try:
-            # Открываем изображение
-            img = Image.open(photo.image)
-
-            # Создаем миниатюру
-            img.thumbnail((300, 300))
-
-            # Сохраняем в буфер
-            thumb_io = io.BytesIO()
-            img.save(thumb_io, format=img.format or 'JPEG')
-
-            # Сохраняем в поле thumbnail
-            thumb_file = ContentFile(thumb_io.getvalue())
-            photo.thumbnail.save(
-                f'thumb_{photo.image.name}',
-                thumb_file,
-                save=False
-            )
-            photo.save()
-            count += 1
-        except Exception as e:
-            modeladmin.message_user(
-                request,
-                _('Ошибка при обработке фото {}: {}').format(photo.id, str(e)),
-                level='error'
-            )
+    for photo_id in queryset.exclude(image='').values_list('pk', flat=True):
+        render_photo_task.delay(photo_id)
+        count += 1
 
     modeladmin.message_user(
         request,
-        _('Создано {} миниатюр').format(count)
+        _('В очередь поставлено {} фотографий').format(count)
     )
 
 
@@ -265,6 +262,9 @@ class CarAdAdmin(admin.ModelAdmin):
     list_display_links = ['id', 'title_with_link']
     list_per_page = 25
     list_max_show_all = 100
+    # Количество строк без полного COUNT(*) по таблице
+    paginator = CountingPaginator
+    show_full_result_count = False
 
     # Фильтры
     list_filter = [
@@ -414,6 +414,11 @@ class CarAdAdmin(admin.ModelAdmin):
             ),
             'classes': ('collapse',),
         }),
+        (_('Модерация'), {
+            'fields': (
+                'duplicate_photos',
+            ),
+        }),
     )
 
     # Только для чтения
@@ -424,6 +429,7 @@ class CarAdAdmin(admin.ModelAdmin):
         'is_new',
         'created_at',
         'moderator',
+        'duplicate_photos',
     ]
 
     # Автозаполнение
@@ -437,6 +443,24 @@ class CarAdAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
     # Кастомные методы для list_display
+    def duplicate_photos(self, obj):
+        """Другие объявления с теми же или почти теми же фото"""
+        if not obj.pk:
+            return '-'
+        ads = duplicate_ads(obj).select_related('owner')[:20]
+        if not ads:
+            return _('Совпадений нет')
+        return format_html_join(
+            format_html('<br>'),
+            '<a href="{}">#{} {}</a> ({})',
+            (
+                (reverse('admin:advertisements_carad_change', args=[ad.pk]), ad.pk, ad.title, ad.owner)
+                for ad in ads
+            ),
+        )
+
+    duplicate_photos.short_description = _('Совпадающие фото')
+
     def title_with_link(self, obj):
         """Заголовок с ссылкой на сайт"""
         url = reverse('advertisements:ad_detail', kwargs={'slug': obj.slug})
@@ -574,6 +598,9 @@ class CarAdAdmin(admin.ModelAdmin):
 class CarPhotoAdmin(admin.ModelAdmin):
     """Админка для фотографий автомобилей"""
 
+    paginator = CountingPaginator
+    show_full_result_count = False
+
     list_display = [
         'id',
         'car_ad_link',
@@ -677,13 +704,6 @@ class CarPhotoAdmin(admin.ModelAdmin):
 
     thumbnail_preview.short_description = _('Превью миниатюры')
 
-    def save_model(self, request, obj, form, change):
-        # Автоматически создаем миниатюру при загрузке
-        if not obj.thumbnail and obj.image:
-            # Можно добавить автоматическое создание миниатюр
-            pass
-        super().save_model(request, obj, form, change)
-
 
 @admin.register(CarAdFeature)
 class CarAdFeatureAdmin(admin.ModelAdmin):
@@ -775,6 +795,9 @@ class CarAdFeatureAdmin(admin.ModelAdmin):
 class SearchHistoryAdmin(admin.ModelAdmin):
     """Админка для истории поиска"""
 
+    paginator = CountingPaginator
+    show_full_result_count = False
+
     list_display = [
         'id',
         'user_link',
@@ -847,6 +870,9 @@ class SearchHistoryAdmin(admin.ModelAdmin):
 class CarViewAdmin(admin.ModelAdmin):
     """Админка для истории просмотров"""
 
+    paginator = CountingPaginator
+    show_full_result_count = False
+
     list_display = [
         'id',
         'user_link',
@@ -0,0 +1,271 @@
+# apps/advertisements/autocomplete.py
+"""
+Автодополнение поиска по таблице предрассчитанных подсказок.
+
+Подсказки (марки, модели, «марка + модель» и популярные запросы) строятся
+заранее; на каждое нажатие клавиши выполняется один запрос по индексам
+search_suggestions (префиксный btree + триграммный GIN). Поля ответа,
+которых нет в тексте подсказки (slug, марка, логотип), хранятся в
+SearchSuggestion.data, поэтому формат ответа прежний. Объявления
+(ads_limit) добавляются в тот же запрос через UNION ALL и ищутся по
+индексу search_vector.
+"""
+import re
+from urllib.parse import urlencode
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import JSONObject, Lower, Trim
+from django.urls import reverse
+
+from apps.catalog.models import CarBrand, CarModel
+from .models import SearchSuggestion
+from .search import search_ads
+
+MIN_QUERY_LENGTH = 2
+DEFAULT_LIMIT = 10
+AD_SUGGESTIONS_LIMIT = 5
+AD_KIND = 'ad'
+
+# Колонки выдачи (общие для подсказок и объявлений в UNION)
+SUGGESTION_COLUMNS = ('section', 'kind', 'text', 'url', 'object_id', 'data', 'is_prefix', 'weight')
+
+# Сколько популярных запросов из аналитики держать в подсказках
+POPULAR_QUERIES_LIMIT = 500
+POPULAR_QUERY_MIN_COUNT = 3
+
+_SPACES_RE = re.compile(r'\s+')
+
+KIND_LABELS = {
+    SearchSuggestion.KindType.BRAND: 'марка',
+    SearchSuggestion.KindType.MODEL: 'модель',
+    SearchSuggestion.KindType.BRAND_MODEL: 'модель',
+    SearchSuggestion.KindType.QUERY: 'запрос',
+}
+
+
+def normalize(text):
+    """Нормализация строки для сравнения: регистр, ё, пробелы"""
+    text = (text or '').lower().replace('ё', 'е')
+    return _SPACES_RE.sub(' ', text).strip()[:200]
+
+
+def _suggestion(row):
+    """Элемент ответа API в прежнем формате (type, id, name, slug, brand, logo, display, url)"""
+    kind, data = row['kind'], row['data'] or {}
+    if kind == AD_KIND:
+        return {
+            'type': AD_KIND,
+            'id': row['object_id'],
+            'title': row['text'],
+            'slug': data.get('slug'),
+            'display': f"{row['text'][:50]}... (объявление)",
+            'url': reverse('advertisements:ad_detail', kwargs={'slug': data.get('slug')}),
+        }
+    item = {
+        # «Марка + модель» - та же модель, найденная по полному названию
+        'type': SearchSuggestion.KindType.MODEL if kind == SearchSuggestion.KindType.BRAND_MODEL else kind,
+        'id': row['object_id'],
+        'name': data.get('name', row['text']),
+        'display': f"{row['text']} ({KIND_LABELS.get(kind, '')})",
+        'url': row['url'],
+    }
+    if kind == SearchSuggestion.KindType.BRAND:
+        item.update(slug=data.get('slug'), logo=data.get('logo'))
+    elif kind != SearchSuggestion.KindType.QUERY:
+        item.update(slug=data.get('slug'), brand=data.get('brand'))
+    return item
+
+
+def _ad_matches(query, limit):
+    """Объявления с подходящим текстом в колонках подсказок (GIN-индекс search_vector)"""
+    return search_ads(query, order_by_rank=False).annotate(
+        section=Value(1),
+        kind=Value(AD_KIND, output_field=CharField()),
+        text=F('title'),
+        url=Value('', output_field=CharField()),
+        object_id=F('id'),
+        data=JSONObject(slug=F('slug')),
+        is_prefix=Value(False),
+        weight=Value(0),
+    ).values(*SUGGESTION_COLUMNS)[:limit]
+
+
+def suggest(query, limit=DEFAULT_LIMIT, ads_limit=0):
+    """
+    Подсказки для строки запроса одним SQL-запросом.
+
+    ads_limit - сколько объявлений добавить после подсказок (в том же
+    запросе через UNION ALL).
+    """
+    normalized = normalize(query)
+    if len(normalized) < MIN_QUERY_LENGTH:
+        return []
+
+    rows = SearchSuggestion.objects.filter(
+        Q(normalized__startswith=normalized) |
+        Q(normalized__trigram_similar=normalized)
+    ).annotate(
+        section=Value(0),
+        is_prefix=Case(
+            When(normalized__startswith=normalized, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        )
+    ).order_by('-is_prefix', '-weight', 'text').values(*SUGGESTION_COLUMNS)[:limit * 2]
+    if ads_limit:
+        rows = rows.union(_ad_matches(query, ads_limit), all=True).order_by(
+            'section', '-is_prefix', '-weight', 'text'
+        )
+
+    # Модель могла найтись и по названию, и по «марка + модель»
+    items, seen, suggestions = [], set(), 0
+    for row in rows:
+        item = _suggestion(row)
+        key = (item['type'], item['id'] if item['id'] is not None else item['name'])
+        if key in seen or (row['section'] == 0 and suggestions >= limit):
+            continue
+        seen.add(key)
+        items.append(item)
+        suggestions += row['section'] == 0
+    return items
+
+
+# ============================================================================
+# ПОСТРОЕНИЕ ПОДСКАЗОК
+# ============================================================================
+
+def _brand_rows(brands):
+    for brand in brands:
+        yield SearchSuggestion(
+            kind=SearchSuggestion.KindType.BRAND,
+            text=brand.name,
+            normalized=normalize(brand.name),
+            url=f'/catalog/brands/{brand.slug}/',
+            object_id=brand.id,
+            weight=brand.active_ads,
+            data={'slug': brand.slug, 'logo': brand.logo.url if brand.logo else None},
+        )
+
+
+def _model_rows(car_models):
+    for car_model in car_models:
+        url = f'/catalog/models/{car_model.slug}/'
+        full_name = f'{car_model.brand.name} {car_model.name}'
+        data = {'name': car_model.name, 'slug': car_model.slug, 'brand': car_model.brand.name}
+        yield SearchSuggestion(
+            kind=SearchSuggestion.KindType.MODEL,
+            text=full_name,
+            normalized=normalize(car_model.name),
+            url=url,
+            object_id=car_model.id,
+            weight=car_model.active_ads,
+            data=data,
+        )
+        yield SearchSuggestion(
+            kind=SearchSuggestion.KindType.BRAND_MODEL,
+            text=full_name,
+            normalized=normalize(full_name),
+            url=url,
+            object_id=car_model.id,
+            weight=car_model.active_ads,
+            data=data,
+        )
+
+
+def _annotated_brands():
+    return CarBrand.objects.filter(is_active=True).annotate(
+        active_ads=Count(
+            'models__advertisements',
+            filter=Q(
+                models__advertisements__status='active',
+                models__advertisements__is_active=True
+            )
+        )
+    )
+
+
+def _annotated_models():
+    return CarModel.objects.filter(
+        is_active=True, brand__is_active=True
+    ).select_related('brand').annotate(
+        active_ads=Count(
+            'advertisements',
+            filter=Q(advertisements__status='active', advertisements__is_active=True)
+        )
+    )
+
+
+def _popular_query_rows():
+    """Популярные запросы из аналитики поиска"""
+    from apps.analytics.models import SearchAnalytics
+
+    popular = SearchAnalytics.objects.filter(has_results=True).annotate(
+        normalized=Lower(Trim('query'))
+    ).values('normalized').annotate(
+        total=Count('id')
+    ).filter(
+        total__gte=POPULAR_QUERY_MIN_COUNT
+    ).order_by('-total')[:POPULAR_QUERIES_LIMIT]
+
+    seen = set()
+    for row in popular:
+        normalized = normalize(row['normalized'])
+        if len(normalized) < MIN_QUERY_LENGTH or normalized in seen:
+            continue
+        seen.add(normalized)
+        yield SearchSuggestion(
+            kind=SearchSuggestion.KindType.QUERY,
+            text=normalized,
+            normalized=normalized,
+            url=f"/search/?{urlencode({'q': normalized})}",
+            weight=row['total'],
+        )
+
+
+def _dedupe(rows):
+    """Убрать дубликаты, оставив вариант с большим весом"""
+    unique = {}
+    for row in rows:
+        key = (row.kind, row.object_id, row.normalized)
+        if key not in unique or unique[key].weight < row.weight:
+            unique[key] = row
+    return list(unique.values())
+
+
+def rebuild_suggestions():
+    """Полная перестройка таблицы подсказок"""
+    rows = []
+    rows.extend(_brand_rows(_annotated_brands()))
+    rows.extend(_model_rows(_annotated_models()))
+    rows.extend(_popular_query_rows())
+    rows = _dedupe(rows)
+
+    with transaction.atomic():
+        SearchSuggestion.objects.all().delete()
+        SearchSuggestion.objects.bulk_create(rows, batch_size=1000)
+
+    return len(rows)
+
+
+def refresh_brand_suggestions(brand_id):
+    """Обновить подсказки одной марки и всех ее моделей"""
+    brand_kinds = [SearchSuggestion.KindType.BRAND]
+    model_kinds = [SearchSuggestion.KindType.MODEL, SearchSuggestion.KindType.BRAND_MODEL]
+    model_ids = list(CarModel.objects.filter(brand_id=brand_id).values_list('id', flat=True))
+
+    with transaction.atomic():
+        SearchSuggestion.objects.filter(kind__in=brand_kinds, object_id=brand_id).delete()
+        SearchSuggestion.objects.filter(kind__in=model_kinds, object_id__in=model_ids).delete()
+
+        rows = list(_brand_rows(_annotated_brands().filter(id=brand_id)))
+        rows.extend(_model_rows(_annotated_models().filter(brand_id=brand_id)))
+        SearchSuggestion.objects.bulk_create(_dedupe(rows))
+
+
+def refresh_model_suggestions(model_id):
+    """Обновить подсказки одной модели (счетчик объявлений - только по ней)"""
+    model_kinds = [SearchSuggestion.KindType.MODEL, SearchSuggestion.KindType.BRAND_MODEL]
+    with transaction.atomic():
+        SearchSuggestion.objects.filter(kind__in=model_kinds, object_id=model_id).delete()
+        SearchSuggestion.objects.bulk_create(_dedupe(_model_rows(_annotated_models().filter(pk=model_id))))
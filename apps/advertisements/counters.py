@@ -0,0 +1,284 @@
+# apps/advertisements/counters.py
+"""
+Счетчики сайта в таблице site_counters.
+
+Вместо COUNT(*) и SUM по таблицам статистика читает готовые значения:
+активные объявления (всего и по регионам), сумму их цен (для средней),
+пользователей, активные марки и модели. Количество активных объявлений
+марки, модели и города хранится в колонке ads_count их строк (с
+индексом), поэтому «топ» - это просмотр индекса.
+
+Каждая запись вносит в счетчики свой вклад (COUNTED_MODELS). При
+сохранении сигнал берет вклад до и после изменения и применяет разницу
+одним INSERT ... ON CONFLICT DO UPDATE value = value + delta (и
+UPDATE ads_count = ads_count + delta для марки, модели и города) в той
+же транзакции, что и сохранение (если она есть). Массовые update() и
+delete() по queryset сигналы не вызывают: такие расхождения, как и
+потерянные приращения, исправляет reconcile_counters (команда и
+периодическая задача).
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+
+from apps.catalog.models import CarBrand, CarModel
+from apps.users.models import User
+
+from .models import AdSearchIndex, CarAd, City, SiteCounter
+from .search import active_ads
+
+ALL_ADS = 'ads:all'
+ACTIVE_ADS = 'ads:active'
+# Сумма цен активных объявлений: средняя = сумма / количество
+ACTIVE_PRICE_SUM = 'ads:active:price_sum'
+ALL_USERS = 'users:all'
+ACTIVE_USERS = 'users:active'
+ACTIVE_BRANDS = 'brands:active'
+ACTIVE_MODELS = 'models:active'
+REGION_ADS_PREFIX = 'ads:region:'
+# Счетчиков в одной транзакции исправления (reconcile_counters)
+RECONCILE_BATCH_SIZE = 200
+
+# Счетчики в колонке ads_count: префикс имени -> модель
+COLUMN_COUNTERS = {
+    'ads:brand:': CarBrand,
+    'ads:model:': CarModel,
+    'ads:city:': City,
+}
+
+
+def brand_ads(brand_id):
+    return f'ads:brand:{brand_id}'
+
+
+def model_ads(model_id):
+    return f'ads:model:{model_id}'
+
+
+def city_ads(city_id):
+    return f'ads:city:{city_id}'
+
+
+def region_ads(region):
+    return f'{REGION_ADS_PREFIX}{region}'
+
+
+def region_price_sum(region):
+    return f'ads:region_price:{region}'
+
+
+def _column_counter(name):
+    """(модель, pk) для счетчика в колонке ads_count или None"""
+    for prefix, model in COLUMN_COUNTERS.items():
+        if name.startswith(prefix):
+            return model, int(name[len(prefix):])
+    return None
+
+
+def _ad_counts(state):
+    counts = {ALL_ADS: 1}
+    if state['status'] != 'active' or not state['is_active']:
+        return counts
+    counts[ACTIVE_ADS] = 1
+    counts[ACTIVE_PRICE_SUM] = state['price'] or 0
+    for name, value in (('brand', brand_ads), ('model', model_ads), ('city', city_ads)):
+        if state[name] is not None:
+            counts[value(state[name])] = 1
+    if state['region']:
+        counts[region_ads(state['region'])] = 1
+        counts[region_price_sum(state['region'])] = state['price'] or 0
+    return counts
+
+
+def _user_counts(state):
+    counts = {ALL_USERS: 1}
+    if state['is_active']:
+        counts[ACTIVE_USERS] = 1
+    return counts
+
+
+def _brand_counts(state):
+    return {ACTIVE_BRANDS: 1} if state['is_active'] else {}
+
+
+def _model_counts(state):
+    return {ACTIVE_MODELS: 1} if state['is_active'] else {}
+
+
+# Модель -> (поля, от которых зависит вклад, вклад записи в счетчики)
+COUNTED_MODELS = {
+    CarAd: (('status', 'is_active', 'brand', 'model', 'city', 'region', 'price'), _ad_counts),
+    User: (('is_active',), _user_counts),
+    CarBrand: (('is_active',), _brand_counts),
+    CarModel: (('is_active',), _model_counts),
+}
+
+
+def affects_counters(sender, update_fields=None):
+    """Сохранение с update_fields может изменить счетчики"""
+    if update_fields is None:
+        return True
+    fields, _ = COUNTED_MODELS[sender]
+    return bool(set(fields).intersection(update_fields))
+
+
+def current_state(instance):
+    """Значения учитываемых полей объекта"""
+    fields, _ = COUNTED_MODELS[type(instance)]
+    meta = instance._meta
+    return {name: getattr(instance, meta.get_field(name).attname) for name in fields}
+
+
+def stored_state(instance):
+    """Значения учитываемых полей в БД (None для новой записи)"""
+    if instance._state.adding or instance.pk is None:
+        return None
+    fields, _ = COUNTED_MODELS[type(instance)]
+    return type(instance)._base_manager.filter(pk=instance.pk).values(*fields).first()
+
+
+def count_changes(sender, old_state, new_state):
+    """Приращения счетчиков при переходе записи из old_state в new_state"""
+    _, counts = COUNTED_MODELS[sender]
+    deltas = Counter(counts(new_state) if new_state is not None else {})
+    deltas.subtract(counts(old_state) if old_state is not None else {})
+    return {name: delta for name, delta in deltas.items() if delta}
+
+
+def add_counts(deltas):
+    """
+    Прибавить приращения {счетчик: delta}: один запрос к site_counters и
+    по одному UPDATE на строку марки, модели и города.
+    """
+    # Порядок по имени: параллельные транзакции блокируют строки в одном порядке
+    items = []
+    for name, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        column = _column_counter(name)
+        if column is None:
+            items.append((name, delta))
+        else:
+            model, pk = column
+            model.objects.filter(pk=pk).update(ads_count=F('ads_count') + delta)
+    if not items:
+        return
+    table = connection.ops.quote_name(SiteCounter._meta.db_table)
+    values = ', '.join(['(%s, %s)'] * len(items))
+    params = [value for item in items for value in item]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} AS counter (name, value) VALUES {values} '
+            f'ON CONFLICT (name) DO UPDATE SET value = counter.value + EXCLUDED.value',
+            params,
+        )
+
+
+def get_counts(*names):
+    """{счетчик: значение} из site_counters одним запросом; отсутствующие равны 0"""
+    values = dict(SiteCounter.objects.filter(name__in=names).values_list('name', 'value'))
+    return {name: values.get(name, 0) for name in names}
+
+
+def price_stats():
+    """
+    Средняя, минимальная и максимальная цена активных объявлений.
+
+    Средняя - из счетчиков, границы - первые строки индекса по цене
+    (ad_index_price_idx), без просмотра таблицы.
+    """
+    counts = get_counts(ACTIVE_ADS, ACTIVE_PRICE_SUM)
+    prices = AdSearchIndex.objects.values_list('price', flat=True)
+    return {
+        'avg_price': counts[ACTIVE_PRICE_SUM] / counts[ACTIVE_ADS] if counts[ACTIVE_ADS] else None,
+        'min_price': prices.order_by('price').first(),
+        'max_price': prices.order_by('-price').first(),
+    }
+
+
+def top_regions(limit):
+    """[(регион, количество активных объявлений)] по убыванию"""
+    rows = SiteCounter.objects.filter(
+        name__startswith=REGION_ADS_PREFIX, value__gt=0
+    ).order_by('-value', 'name').values_list('name', 'value')[:limit]
+    return [(name[len(REGION_ADS_PREFIX):], value) for name, value in rows]
+
+
+def actual_counts():
+    """Значения всех счетчиков, посчитанные по таблицам"""
+    counts = Counter()
+    counts[ALL_ADS] = CarAd.objects.count()
+
+    active = active_ads().order_by()
+    totals = active.aggregate(count=Count('pk'), price_sum=Sum('price'))
+    counts[ACTIVE_ADS] = totals['count']
+    counts[ACTIVE_PRICE_SUM] = totals['price_sum'] or 0
+    for column, name in (('brand', brand_ads), ('model', model_ads), ('city', city_ads)):
+        for value, count in active.values_list(column).annotate(count=Count('pk')):
+            if value is not None:
+                counts[name(value)] = count
+    for region, count, price_sum in active.exclude(region='').values_list('region').annotate(
+        count=Count('pk'), price_sum=Sum('price')
+    ):
+        counts[region_ads(region)] = count
+        counts[region_price_sum(region)] = price_sum or 0
+
+    counts[ALL_USERS] = User.objects.count()
+    counts[ACTIVE_USERS] = User.objects.filter(is_active=True).count()
+    counts[ACTIVE_BRANDS] = CarBrand.objects.filter(is_active=True).count()
+    counts[ACTIVE_MODELS] = CarModel.objects.filter(is_active=True).count()
+    return counts
+
+
+def _counter_snapshot():
+    """
+    Сохраненные и фактические значения счетчиков из одного снимка БД.
+
+    Чтение без блокировок: сохранение объявлений и правка справочников
+    во время подсчета не ждут.
+    """
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost and connection.vendor == 'postgresql':
+            # Оба чтения видят одно и то же состояние таблиц
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        stored = dict(SiteCounter.objects.values_list('name', 'value'))
+        for prefix, model in COLUMN_COUNTERS.items():
+            stored.update(
+                (f'{prefix}{pk}', value) for pk, value in model.objects.values_list('pk', 'ads_count')
+            )
+        return stored, actual_counts()
+
+
+def reconcile_counters(fix=True):
+    """
+    Сверить счетчики с таблицами.
+
+    Возвращает расхождения {счетчик: (сохранено, на самом деле)}; при
+    fix=True исправляет их. Исправление - приращение (на самом деле -
+    сохранено) по снимку, а не запись значения: изменения, сделанные
+    после снимка, не теряются. Приращения применяются короткими
+    транзакциями по RECONCILE_BATCH_SIZE счетчиков.
+    """
+    stored, actual = _counter_snapshot()
+    drift = {
+        name: (stored.get(name, 0), actual.get(name, 0))
+        for name in stored.keys() | actual.keys()
+        if stored.get(name, 0) != actual.get(name, 0)
+    }
+    if fix and drift:
+        names = sorted(drift)
+        for start in range(0, len(names), RECONCILE_BATCH_SIZE):
+            with transaction.atomic():
+                add_counts({
+                    name: drift[name][1] - drift[name][0]
+                    for name in names[start:start + RECONCILE_BATCH_SIZE]
+                })
+        # Обнулившиеся счетчики (регионы без объявлений), если их не изменили снова
+        SiteCounter.objects.filter(
+            name__in=[name for name in names if not drift[name][1] and _column_counter(name) is None],
+            value=0,
+        ).delete()
+    return drift
@@ -0,0 +1,262 @@
+# apps/advertisements/facets.py
+"""
+Фасеты боковой панели фильтров списка объявлений.
+
+Все фасеты считаются одним SQL-запросом с GROUPING SETS: для каждого
+фасета количество объявлений вычисляется при всех текущих фильтрах,
+кроме фильтра самого фасета (COUNT(*) FILTER (WHERE ...)). Диапазоны
+(цена, год, пробег, двигатель) считаются в той же выборке. Запрос идет
+по таблице ad_search_index без JOIN.
+"""
+from dataclasses import asdict, dataclass, field
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import BooleanField, ExpressionWrapper, F, Value
+
+from apps.core.tagged_cache import get_or_compute
+from .filters import ListingFilters
+from .listing_cache import listing_tags
+from .models import AdSearchIndex, CarAd
+
+FACETS_CACHE_TIMEOUT = 60 * 60
+
+# Фасеты-списки: имя -> (заголовок, поле значения, поле slug, поле названия)
+TERMS_FACETS = {
+    'brand': ('Марка', 'brand_id', 'brand_slug', 'brand_name'),
+    'model': ('Модель', 'model_id', 'model_slug', 'model_name'),
+    'body_type': ('Тип кузова', 'body_type', None, None),
+    'fuel_type': ('Топливо', 'fuel_type', None, None),
+    'transmission_type': ('Коробка передач', 'transmission_type', None, None),
+    'drive_type': ('Привод', 'drive_type', None, None),
+    'condition': ('Состояние', 'condition', None, None),
+    'color_exterior': ('Цвет кузова', 'color_exterior', None, None),
+    'color_interior': ('Цвет салона', 'color_interior', None, None),
+    'owner_type': ('Тип владельца', 'owner_type', None, None),
+    'steering_wheel': ('Руль', 'steering_wheel', None, None),
+    'city': ('Город', 'city_id', 'city_slug', 'city_name'),
+    'region': ('Регион', 'region', None, None),
+    'doors': ('Двери', 'doors', None, None),
+    'seats': ('Места', 'seats', None, None),
+}
+
+# Фасеты-диапазоны: имя -> (заголовок, поле)
+RANGE_FACETS = {
+    'price': ('Цена', 'price'),
+    'year': ('Год выпуска', 'year'),
+    'mileage': ('Пробег', 'mileage'),
+    'engine_volume': ('Объем двигателя', 'engine_volume'),
+    'engine_power': ('Мощность', 'engine_power'),
+}
+
+# Флаг строки, прошедшей все фильтры (для общего количества)
+_ALL = 'all'
+
+
+@dataclass(frozen=True)
+class FacetValue:
+    value: object
+    label: str
+    count: int
+    slug: str = ''
+    selected: bool = False
+
+
+@dataclass(frozen=True)
+class TermsFacet:
+    name: str
+    title: str
+    values: tuple = ()
+
+
+@dataclass(frozen=True)
+class RangeFacet:
+    name: str
+    title: str
+    min: object = None
+    max: object = None
+    selected_min: object = None
+    selected_max: object = None
+
+
+@dataclass(frozen=True)
+class FacetResult:
+    total: int
+    terms: dict = field(default_factory=dict)
+    ranges: dict = field(default_factory=dict)
+
+    def as_dict(self):
+        return asdict(self)
+
+
+# ============================================================================
+# SQL
+# ============================================================================
+
+def _flag(filters, name):
+    """Прошла ли строка все фильтры, кроме фильтра фасета name"""
+    condition = filters.facet_q(exclude=name)
+    if not condition:
+        return Value(True)
+    return ExpressionWrapper(condition, output_field=BooleanField())
+
+
+def _facet_rows(filters, queryset):
+    """
+    Строки GROUPING SETS по всем фасетам одним запросом.
+
+    Возвращает (имена колонок, строки списками) - в таком виде они
+    компактно хранятся в кэше.
+    """
+    annotations = {}
+    for name, (_, key, slug, label) in TERMS_FACETS.items():
+        annotations[f'{name}_key'] = F(key)
+        if slug:
+            annotations[f'{name}_slug'] = F(slug)
+        if label:
+            annotations[f'{name}_label'] = F(label)
+    for name, (_, column) in RANGE_FACETS.items():
+        annotations[f'{name}_value'] = F(column)
+
+    flags = {}
+    for name in [*TERMS_FACETS, *RANGE_FACETS]:
+        flags[f'{name}_in'] = _flag(filters, name)
+    flags[f'{_ALL}_in'] = _flag(filters, None)
+
+    inner = filters.base_queryset(queryset).order_by().annotate(
+        **annotations, **flags
+    ).values(*annotations, *flags)
+    inner_sql, params = inner.query.sql_with_params()
+
+    connection = connections[inner.db]
+    qn = connection.ops.quote_name
+
+    select, grouping_sets = [], []
+    for name, (_, _, slug, label) in TERMS_FACETS.items():
+        columns = [f'{name}_key'] + ([f'{name}_slug'] if slug else []) + ([f'{name}_label'] if label else [])
+        select.extend(qn(column) for column in columns)
+        select.append(f'GROUPING({qn(f"{name}_key")}) AS {qn(f"{name}_grp")}')
+        select.append(f'COUNT(*) FILTER (WHERE {qn(f"{name}_in")}) AS {qn(f"{name}_count")}')
+        grouping_sets.append('(' + ', '.join(qn(column) for column in columns) + ')')
+
+    for name in RANGE_FACETS:
+        value, flag = qn(f'{name}_value'), qn(f'{name}_in')
+        select.append(f'MIN({value}) FILTER (WHERE {flag}) AS {qn(f"{name}_min")}')
+        select.append(f'MAX({value}) FILTER (WHERE {flag}) AS {qn(f"{name}_max")}')
+
+    select.append(f'COUNT(*) FILTER (WHERE {qn(f"{_ALL}_in")}) AS {qn("total")}')
+    grouping_sets.append('()')
+
+    # Строка, не прошедшая ни один из наборов фильтров, ни на что не влияет
+    where = ' OR '.join(qn(flag) for flag in flags)
+
+    sql = (
+        f'SELECT {", ".join(select)} FROM ({inner_sql}) AS facet_ads '
+        f'WHERE {where} GROUP BY GROUPING SETS ({", ".join(grouping_sets)})'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return columns, [list(row) for row in cursor.fetchall()]
+
+
+def _row_dicts(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+# ============================================================================
+# СБОРКА РЕЗУЛЬТАТА
+# ============================================================================
+
+def _choice_labels(column):
+    """Подписи choices одноименного поля CarAd (пусто, если поля нет)"""
+    try:
+        model_field = CarAd._meta.get_field(column)
+    except FieldDoesNotExist:
+        return {}
+    return {str(key): str(label) for key, label in model_field.flatchoices}
+
+
+def _is_selected(selected, value, slug):
+    if selected is None:
+        return False
+    # Текстовые фильтры (регион) в ключе фильтров хранятся в нижнем регистре
+    selected = str(selected).lower()
+    return selected == str(value).lower() or (bool(slug) and selected == slug)
+
+
+def _sort_key(facet_value):
+    if isinstance(facet_value.value, (int, float)) and not facet_value.slug:
+        return (0, facet_value.value, '')
+    return (1, 0, facet_value.label.lower())
+
+
+def build_facets(filters, rows):
+    """FacetResult из строк GROUPING SETS"""
+    values = {name: [] for name in TERMS_FACETS}
+    total_row = {}
+
+    for row in rows:
+        name = next((n for n in TERMS_FACETS if row[f'{n}_grp'] == 0), None)
+        if name is None:
+            total_row = row
+            continue
+
+        key, count = row[f'{name}_key'], row[f'{name}_count']
+        if key in (None, '') or not count:
+            continue
+
+        column = TERMS_FACETS[name][1]
+        slug = row.get(f'{name}_slug') or ''
+        label = row.get(f'{name}_label') or _choice_labels(column).get(str(key), str(key))
+        values[name].append(FacetValue(
+            value=key,
+            label=label,
+            count=count,
+            slug=slug,
+            selected=_is_selected(filters.selected.get(name), key, slug),
+        ))
+
+    terms = {
+        name: TermsFacet(name=name, title=title, values=tuple(sorted(values[name], key=_sort_key)))
+        for name, (title, *_) in TERMS_FACETS.items()
+    }
+
+    ranges = {}
+    for name, (title, _) in RANGE_FACETS.items():
+        selected_min, selected_max = filters.selected.get(name, (None, None))
+        ranges[name] = RangeFacet(
+            name=name,
+            title=title,
+            min=total_row.get(f'{name}_min'),
+            max=total_row.get(f'{name}_max'),
+            selected_min=selected_min,
+            selected_max=selected_max,
+        )
+
+    return FacetResult(total=total_row.get('total') or 0, terms=terms, ranges=ranges)
+
+
+def compute_facets(filters, queryset=None):
+    """Фасеты для текущих фильтров (один SQL-запрос)"""
+    if queryset is None:
+        queryset = AdSearchIndex.objects.all()
+    return build_facets(filters, _row_dicts(*_facet_rows(filters, queryset)))
+
+
+def get_facets(filters: ListingFilters):
+    """
+    Фасеты активных объявлений с кэшированием по набору фильтров.
+
+    Запись сбрасывается теми же тегами, что и страница списка с этими
+    фильтрами (они учитывают, что фасет считается без своего фильтра).
+    В кэше лежат строки запроса, результат собирается из них.
+    """
+    columns, rows = get_or_compute(
+        f'ad_facets_{filters.cache_key()}',
+        listing_tags(filters),
+        lambda: _facet_rows(filters, AdSearchIndex.objects.all()),
+        FACETS_CACHE_TIMEOUT,
+        metric='ad_facets',
+    )
+    return build_facets(filters, _row_dicts(columns, rows))
@@ -0,0 +1,446 @@
+# apps/advertisements/filters.py
+"""
+Единая спецификация фильтров объявлений для HTML-списков и API.
+
+Разбор идет в два шага:
+
+1. normalize_filters(params) приводит GET-параметры к каноническому
+   неизменяемому ключу FilterKey: синонимы параметров (brand/brand_id,
+   search/q...) сводятся к одному имени, slug марки, модели и города
+   заменяются на id по кэшированному справочнику (без запросов к БД),
+   некорректные и ничего не ограничивающие значения отбрасываются.
+   Одинаковые поиски, записанные по-разному, дают один и тот же ключ,
+   поэтому кэш количеств, фасетов и страниц у них общий.
+
+2. compile_filters(key) превращает ключ в условия Q по колонкам плоской
+   таблицы ad_search_index (или CarAd для API). Фильтры по полям фасетов
+   хранятся по имени фасета отдельно: движок фасетов считает значения
+   фасета при всех фильтрах, кроме его собственного.
+"""
+import hashlib
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+
+from apps.catalog.models import CarBrand, CarModel
+from apps.core.tagged_cache import CATALOG, get_or_compute
+from .models import AdSearchIndex, CarAd, City
+from .search import active_ads, search_ads
+
+FILTER_REFS_CACHE_KEY = 'ad_filter_refs'
+FILTER_REFS_CACHE_TIMEOUT = 60 * 60
+
+# Значения «Все варианты» в выпадающих списках
+ALL_VALUES = {'', 'all'}
+TRUE_VALUES = {'true', '1', 'on', 'yes'}
+
+
+@dataclass(frozen=True)
+class FilterField:
+    """Описание одного фильтра"""
+    name: str
+    kind: str  # ref, choice, text, number, range, flag, search
+    params: tuple
+    column: str = ''
+    cast: type = int
+    bounds: tuple = (None, None)
+    facet: bool = True
+
+
+FILTER_SPEC = (
+    FilterField('brand', 'ref', ('brand', 'brand_id')),
+    FilterField('model', 'ref', ('model', 'model_id')),
+    FilterField('city', 'ref', ('city', 'city_id')),
+    FilterField('region', 'text', ('region',), 'region'),
+
+    FilterField('body_type', 'choice', ('body_type',), 'body_type'),
+    FilterField('fuel_type', 'choice', ('fuel_type',), 'fuel_type'),
+    FilterField('transmission_type', 'choice', ('transmission_type',), 'transmission_type'),
+    FilterField('drive_type', 'choice', ('drive_type',), 'drive_type'),
+    FilterField('condition', 'choice', ('condition',), 'condition'),
+    FilterField('color_exterior', 'choice', ('color_exterior',), 'color_exterior'),
+    FilterField('color_interior', 'choice', ('color_interior',), 'color_interior'),
+    FilterField('owner_type', 'choice', ('owner_type',), 'owner_type'),
+    FilterField('steering_wheel', 'choice', ('steering_wheel',), 'steering_wheel'),
+
+    # Диапазоны: параметры «от» и «до», допустимые границы значения
+    FilterField('price', 'range', ('min_price', 'max_price'), 'price', int, (0, None)),
+    FilterField('year', 'range', ('min_year', 'max_year'), 'year', int, (1900, 2100)),
+    FilterField('mileage', 'range', ('min_mileage', 'max_mileage'), 'mileage', int, (0, None)),
+    FilterField(
+        'engine_volume', 'range', ('min_engine_volume', 'max_engine_volume'),
+        'engine_volume', float, (0, None)
+    ),
+    FilterField(
+        'engine_power', 'range', ('min_engine_power', 'max_engine_power'),
+        'engine_power', int, (0, None)
+    ),
+
+    FilterField('doors', 'number', ('doors',), 'doors', int, (1, None)),
+    FilterField('seats', 'number', ('seats',), 'seats', int, (1, None)),
+
+    FilterField('service_history', 'flag', ('has_service_history', 'service_history'), 'service_history', facet=False),
+    FilterField('has_tuning', 'flag', ('has_tuning',), 'has_tuning', facet=False),
+
+    FilterField('search', 'search', ('search', 'q'), facet=False),
+)
+
+FILTER_FIELDS = {field.name: field for field in FILTER_SPEC}
+
+# Колонки ad_search_index -> поля CarAd (для фильтрации car_ads в API)
+AD_COLUMNS = {
+    'brand_slug': 'brand__slug',
+    'model_slug': 'model__slug',
+    'city_slug': 'city__slug',
+    'city_name': 'city__name',
+    'body_type': 'model__body_type',
+}
+
+
+# ============================================================================
+# СПРАВОЧНИК SLUG -> ID
+# ============================================================================
+
+class FilterRefs:
+    """Соответствие slug -> id для марок, моделей и городов"""
+
+    def __init__(self, brands=None, models=None, cities=None):
+        # slug марки -> id
+        self.brands = brands or {}
+        # slug модели -> [id, id марки]; id модели -> id марки
+        self.models = models or {}
+        # slug или название города в нижнем регистре -> id
+        self.cities = cities or {}
+
+    # Сначала slug: у моделей бывают числовые slug (500, 911), их не путаем с id.
+    # by_id - значение пришло из параметра *_id и всегда является id.
+
+    def brand(self, raw, by_id=False):
+        if not by_id and raw in self.brands:
+            return self.brands[raw]
+        return int(raw) if raw.isdigit() else raw
+
+    def model(self, raw, by_id=False):
+        """(id или slug модели, id марки или None)"""
+        if not by_id and raw in self.models:
+            return tuple(self.models[raw])
+        if raw.isdigit():
+            return int(raw), self.models.get(int(raw))
+        return raw, None
+
+    def city(self, raw, by_id=False):
+        if not by_id:
+            city_id = self.cities.get(raw, self.cities.get(raw.lower()))
+            if city_id is not None:
+                return city_id
+        return int(raw) if raw.isdigit() else raw
+
+
+def load_filter_refs():
+    """Справочник из БД (три запроса)"""
+    brands = dict(CarBrand.objects.values_list('slug', 'id'))
+    models = {}
+    for model_id, slug, brand_id in CarModel.objects.values_list('id', 'slug', 'brand_id'):
+        # Список, а не кортеж: msgpack кодирует его без расширения (cache_serializer)
+        models[slug] = [model_id, brand_id]
+        models[model_id] = brand_id
+    cities = {}
+    for city_id, slug, name in City.objects.order_by('id').values_list('id', 'slug', 'name'):
+        cities.setdefault(name.lower(), city_id)
+        cities[slug] = city_id
+    return FilterRefs(brands, models, cities)
+
+
+def get_filter_refs():
+    """Кэшированный справочник slug -> id (сбрасывается с пространством catalog)"""
+    data = get_or_compute(
+        FILTER_REFS_CACHE_KEY, [CATALOG], lambda: vars(load_filter_refs()), FILTER_REFS_CACHE_TIMEOUT
+    )
+    return FilterRefs(**data)
+
+
+def invalidate_filter_refs():
+    cache.delete(FILTER_REFS_CACHE_KEY)
+
+
+# ============================================================================
+# НОРМАЛИЗАЦИЯ
+# ============================================================================
+
+@dataclass(frozen=True)
+class FilterKey:
+    """Канонический набор фильтров: кортеж пар (имя, значение), отсортированный по имени"""
+    items: tuple = ()
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __contains__(self, name):
+        return any(item_name == name for item_name, _ in self.items)
+
+    def get(self, name, default=None):
+        return dict(self.items).get(name, default)
+
+    def as_dict(self):
+        return dict(self.items)
+
+    def digest(self):
+        """Короткий хэш для ключей кэша"""
+        return hashlib.md5(repr(self.items).encode()).hexdigest()
+
+
+def _param(params, field):
+    """Первое непустое значение среди синонимов параметра"""
+    for name in field.params:
+        value = params.get(name)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def _ref_by_id(params, field):
+    """Значение ссылки взято из параметра *_id (последний синоним)"""
+    for name in field.params:
+        value = params.get(name)
+        if value is not None and str(value).strip():
+            return name == field.params[-1]
+    return False
+
+
+def _number(raw, field):
+    """Число в допустимых границах или None"""
+    if raw is None:
+        return None
+    try:
+        value = field.cast(raw)
+    except (ValueError, TypeError):
+        return None
+    if value != value:  # NaN
+        return None
+    low, high = field.bounds
+    if (low is not None and value < low) or (high is not None and value > high):
+        return None
+    return value
+
+
+def _range(params, field):
+    """(от, до) или None, если диапазон ничего не ограничивает"""
+    min_param, max_param = field.params
+    min_value = _number(params.get(min_param), field)
+    max_value = _number(params.get(max_param), field)
+
+    low, high = field.bounds
+    # Граница, совпадающая с допустимым пределом, ничего не ограничивает
+    if min_value is not None and low is not None and min_value <= low:
+        min_value = None
+    if max_value is not None and high is not None and max_value >= high:
+        max_value = None
+
+    if min_value is not None and max_value is not None and min_value > max_value:
+        min_value, max_value = max_value, min_value
+    if min_value is None and max_value is None:
+        return None
+    return (min_value, max_value)
+
+
+def _choice_values(column):
+    """Допустимые значения поля CarAd с choices (None - любые)"""
+    try:
+        choices = CarAd._meta.get_field(column).flatchoices
+    except FieldDoesNotExist:
+        return None
+    return {str(key) for key, _ in choices} or None
+
+
+def normalize_filters(params, refs=None):
+    """
+    Канонический ключ фильтров из GET-параметров.
+
+    refs - справочник slug -> id; по умолчанию берется из кэша.
+    """
+    if refs is None:
+        refs = get_filter_refs()
+    values = {}
+    by_id = {}
+
+    for field in FILTER_SPEC:
+        if field.kind == 'range':
+            value = _range(params, field)
+        else:
+            raw = _param(params, field)
+            if raw is None:
+                continue
+            if field.kind == 'ref':
+                value = raw
+                by_id[field.name] = _ref_by_id(params, field)
+            elif field.kind == 'choice':
+                allowed = _choice_values(field.column)
+                value = None if raw in ALL_VALUES or (allowed and raw not in allowed) else raw
+            elif field.kind == 'text':
+                value = raw.lower()
+            elif field.kind == 'number':
+                value = _number(raw, field)
+            elif field.kind == 'flag':
+                value = True if raw.lower() in TRUE_VALUES else None
+            elif field.kind == 'search':
+                value = ' '.join(raw.lower().split()) or None
+            else:
+                value = None
+        if value is not None:
+            values[field.name] = value
+
+    # Марка, модель и город: slug -> id
+    if 'brand' in values:
+        values['brand'] = refs.brand(values['brand'], by_id['brand'])
+
+    if 'model' in values:
+        model, model_brand = refs.model(values.pop('model'), by_id['model'])
+        brand = values.get('brand')
+        if model_brand is None:
+            # Неизвестная модель имеет смысл только вместе с маркой
+            if brand is not None:
+                values['model'] = model
+        elif brand is None or brand == model_brand:
+            # Модель однозначно задает марку
+            values['brand'] = model_brand
+            values['model'] = model
+        # Модель другой марки (осталась от прошлого выбора) игнорируем
+
+    if 'city' in values:
+        values['city'] = refs.city(values['city'], by_id['city'])
+
+    return FilterKey(tuple(sorted(values.items())))
+
+
+def canonical_params(key):
+    """
+    GET-параметры, которые normalize_filters превратит в тот же ключ.
+
+    Нужны для ссылок в кэшированных страницах: страница, отрендеренная для
+    одного написания фильтров, отдается и остальным.
+    """
+    params = {}
+    for name, value in key.items:
+        field = FILTER_FIELDS[name]
+        if field.kind == 'range':
+            for param, bound in zip(field.params, value):
+                if bound is not None:
+                    params[param] = str(bound)
+        elif field.kind == 'flag':
+            params[field.params[0]] = 'true'
+        elif field.kind == 'ref' and isinstance(value, int):
+            # id - через параметр *_id, чтобы не совпасть с числовым slug
+            params[field.params[-1]] = str(value)
+        else:
+            params[field.params[0]] = str(value)
+    return params
+
+
+# ============================================================================
+# КОМПИЛЯЦИЯ В QUERYSET
+# ============================================================================
+
+class ListingFilters:
+    """Скомпилированные фильтры списка объявлений"""
+
+    def __init__(self, key=None, columns=None):
+        self.key = key or FilterKey()
+        # Переименование колонок индекса в поля другой модели (CarAd)
+        self.columns = columns or {}
+        # Фильтры по фасетам: имя фасета -> Q
+        self.facets = {}
+        # Выбранные значения фасетов (для отметки в боковой панели)
+        self.selected = {}
+        # Фильтры, не связанные с фасетами
+        self.extra = []
+        self.search = ''
+
+    def column(self, name):
+        return self.columns.get(name, name)
+
+    def cache_key(self):
+        """Строка, однозначно описывающая набор фильтров"""
+        return self.key.digest()
+
+    def facet_q(self, exclude=None):
+        """Условие всех фасетных фильтров, кроме exclude"""
+        condition = Q()
+        for name, q in self.facets.items():
+            if name != exclude:
+                condition &= q
+        return condition
+
+    def base_queryset(self, queryset, search=True):
+        """queryset с нефасетными фильтрами (поиск, флаги)"""
+        if self.extra:
+            queryset = queryset.filter(*self.extra)
+        if search and self.search:
+            if queryset.model is AdSearchIndex:
+                # Полнотекстовый поиск идет по GIN-индексу car_ads
+                found = search_ads(self.search, active_ads(), order_by_rank=False)
+                queryset = queryset.filter(ad_id__in=found.values('pk'))
+            else:
+                queryset = search_ads(self.search, queryset, order_by_rank=False)
+        return queryset
+
+    def apply(self, queryset, search=True):
+        """
+        queryset со всеми фильтрами.
+
+        search=False - без полнотекстового поиска (если вызывающий
+        сортирует по релевантности сам).
+        """
+        return self.base_queryset(queryset, search=search).filter(self.facet_q())
+
+
+def _ref_q(filters, name, value):
+    if name == 'city' and isinstance(value, str):
+        return Q(**{filters.column('city_slug'): value}) | Q(**{f'{filters.column("city_name")}__iexact': value})
+    suffix = 'id' if isinstance(value, int) else 'slug'
+    return Q(**{filters.column(f'{name}_{suffix}'): value})
+
+
+def compile_filters(key, columns=None):
+    """ListingFilters по каноническому ключу"""
+    filters = ListingFilters(key, columns)
+
+    for name, value in key.items:
+        field = FILTER_FIELDS[name]
+        column = filters.column(field.column)
+
+        if field.kind == 'ref':
+            condition = _ref_q(filters, name, value)
+        elif field.kind == 'range':
+            min_value, max_value = value
+            condition = Q()
+            if min_value is not None:
+                condition &= Q(**{f'{column}__gte': min_value})
+            if max_value is not None:
+                condition &= Q(**{f'{column}__lte': max_value})
+        elif field.kind == 'text':
+            condition = Q(**{f'{column}__icontains': value})
+        elif field.kind == 'search':
+            filters.search = value
+            continue
+        else:
+            condition = Q(**{column: value})
+
+        if field.facet:
+            filters.facets[name] = condition
+            filters.selected[name] = value
+        else:
+            filters.extra.append(condition)
+
+    return filters
+
+
+def parse_listing_filters(params, refs=None, columns=None):
+    """
+    Разбор параметров списка объявлений.
+
+    Марка, модель и город принимаются как id или slug; некорректные
+    значения игнорируются. columns=AD_COLUMNS - условия по полям CarAd.
+    """
+    return compile_filters(normalize_filters(params, refs), columns)
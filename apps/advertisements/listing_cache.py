@@ -0,0 +1,135 @@
+# apps/advertisements/listing_cache.py
+"""
+Кэш страниц списка объявлений.
+
+Кэшируется отрендеренный блок списка (фильтры, фасеты, карточки,
+пагинация) по каноническому набору фильтров, сортировке и странице.
+Пользовательские части страницы (шапка, кнопка «Добавить», избранное)
+рендерятся отдельно при каждом запросе, поэтому один и тот же блок
+отдается и анонимам, и авторизованным.
+
+Теги записи описывают, какие объявления могут на нее попасть:
+model:<id> или brand:<id> и city:<id> по фильтрам; страницы без этих
+фильтров получают тег ads. Фасет марки, модели или города считается без
+своего фильтра, поэтому к тегам добавляются теги фильтров без каждого из
+них (у страницы только с маркой это ads: фасет марок считает объявления
+всех марок). Изменение объявления увеличивает теги его
+марки, модели, города и пространство имен ads; изменение справочников -
+пространство catalog, которое есть у всех страниц (см. tagged_cache).
+"""
+import hashlib
+
+from apps.core.tagged_cache import (
+    ADS, CATALOG, bump_tags, get_tagged_or_stale, release_refresh, set_tagged
+)
+
+LISTING_CACHE_PREFIX = 'ad_listing_'
+# Инвалидация по тегам; таймаут ограничивает устаревание просмотров и «N дней назад»
+LISTING_CACHE_TIMEOUT = 10 * 60
+
+ALL_ADS_TAG = ADS
+CATALOG_TAG = CATALOG
+
+# Параметры сортировки и страницы, входящие в ключ
+SORT_VALUES = {'price', 'year', 'created_at', 'mileage', 'views_count'}
+ORDER_VALUES = {'asc', 'desc'}
+MAX_CURSOR_LENGTH = 512
+
+
+# Фильтры, у которых есть теги; модель точнее марки
+TAGGED_FILTERS = ('model', 'brand', 'city')
+
+
+def _filter_tags(key, exclude=None):
+    """Теги объявлений, проходящих фильтры key, кроме фильтра exclude"""
+    tags = []
+    for name in TAGGED_FILTERS:
+        value = key.get(name)
+        if name == exclude or not isinstance(value, int):
+            continue
+        if name == 'brand' and 'model' in key and exclude != 'model':
+            continue
+        tags.append(f'{name}:{value}')
+    return tags or [ALL_ADS_TAG]
+
+
+def listing_tags(filters):
+    """Теги страницы с фильтрами filters (ListingFilters): карточки и фасеты"""
+    key = filters.key
+    tags = [CATALOG_TAG]
+    for exclude in (None, *(name for name in TAGGED_FILTERS if name in key)):
+        tags.extend(tag for tag in _filter_tags(key, exclude) if tag not in tags)
+    return tags
+
+
+def ad_tags(brand_id, model_id, city_id):
+    """Теги, которые затрагивает объявление"""
+    tags = [ALL_ADS_TAG]
+    for name, value in (('brand', brand_id), ('model', model_id), ('city', city_id)):
+        if value is not None:
+            tags.append(f'{name}:{value}')
+    return tags
+
+
+def page_params(params, page_kwarg='page', cursor_param='cursor'):
+    """
+    Сортировка и страница из GET-параметров или None.
+
+    None - параметры нестандартные, страницу не кэшируем (чтобы
+    произвольные значения не размножали записи).
+    """
+    result = {}
+    sort = params.get('sort')
+    if sort:
+        if sort.lstrip('-') not in SORT_VALUES:
+            return None
+        result['sort'] = sort
+
+    order = params.get('order')
+    if order:
+        if order not in ORDER_VALUES:
+            return None
+        result['order'] = order
+
+    page = params.get(page_kwarg)
+    if page:
+        if not (page.isdigit() or page == 'last'):
+            return None
+        result[page_kwarg] = page
+
+    cursor = params.get(cursor_param)
+    if cursor:
+        if len(cursor) > MAX_CURSOR_LENGTH:
+            return None
+        result[cursor_param] = cursor
+    return result
+
+
+def listing_cache_key(prefix, filters, page):
+    raw = repr((prefix, filters.cache_key(), sorted(page.items())))
+    return LISTING_CACHE_PREFIX + hashlib.md5(raw.encode()).hexdigest()
+
+
+def get_listing(key, tags):
+    """
+    (запись или None, версии тегов, locked); запись - {'html', 'ad_ids'}.
+
+    Пока страницу рендерит другой процесс, отдается устаревшая запись.
+    """
+    return get_tagged_or_stale(key, tags, metric='ad_listing')
+
+
+def store_listing(key, versions, html, ad_ids):
+    listing = {'html': html, 'ad_ids': list(ad_ids)}
+    set_tagged(key, listing, versions, LISTING_CACHE_TIMEOUT)
+    return listing
+
+
+def release_listing(key):
+    """Снять блокировку рендера (после store_listing или ошибки)"""
+    release_refresh(key)
+
+
+def invalidate_listings(*tag_groups):
+    """Сбросить страницы по группам тегов (ad_tags(...) или [CATALOG_TAG])"""
+    bump_tags(tag for tags in tag_groups for tag in tags)
@@ -0,0 +1,57 @@
+# apps/advertisements/management/commands/dedupe_photos.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.photo_renditions import DEFAULT_WORKERS, backfill_renditions
+from apps.advertisements.photo_storage import (
+    content_stats, delete_legacy_renditions, move_legacy_photos, reconcile_refs
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит фотографии в хранилище по содержимому (одинаковые файлы '
+        'хранятся один раз), создает варианты и сверяет счетчики ссылок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Количество фотографий в одном пакете',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=DEFAULT_WORKERS,
+            help='Количество процессов для создания вариантов',
+        )
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f'Обработано {done} из {total}')
+
+        moved, failed, duplicate_bytes, legacy_files = move_legacy_photos(
+            batch_size=options['batch_size'], progress=progress
+        )
+        self.stdout.write(
+            f'Перенесено {moved} фотографий, повторы занимали {duplicate_bytes / 1024 / 1024:.1f} МБ'
+        )
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Не удалось прочитать {failed} фотографий'))
+
+        # Варианты создаются один раз на файл, остальные фото берут готовые
+        done, render_failed = backfill_renditions(
+            workers=options['workers'], batch_size=options['batch_size'], progress=progress
+        )
+        self.stdout.write(f'Варианты созданы для {done} фотографий')
+        if render_failed:
+            self.stdout.write(self.style.WARNING(f'Не удалось обработать {render_failed} фотографий'))
+
+        deleted = delete_legacy_renditions(legacy_files)
+        fixed = reconcile_refs()
+        stats = content_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено {deleted} старых миниатюр, исправлено {fixed} счетчиков ссылок; '
+            f'{stats["references"]} фотографий используют {stats["files"]} файлов'
+        ))
@@ -0,0 +1,24 @@
+# apps/advertisements/management/commands/rebuild_ad_index.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.search_index import DEFAULT_BATCH_SIZE, rebuild_ad_index
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает таблицу ad_search_index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Количество объявлений в одном INSERT',
+        )
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f'Обработано {done} из {total}')
+
+        updated = rebuild_ad_index(batch_size=options['batch_size'], progress=progress)
+
+        self.stdout.write(self.style.SUCCESS(f'В индексе {updated} активных объявлений'))
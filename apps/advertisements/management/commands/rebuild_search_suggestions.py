@@ -0,0 +1,12 @@
+# apps/advertisements/management/commands/rebuild_search_suggestions.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.autocomplete import rebuild_suggestions
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает таблицу подсказок автодополнения поиска'
+
+    def handle(self, *args, **options):
+        count = rebuild_suggestions()
+        self.stdout.write(self.style.SUCCESS(f'Создано {count} подсказок'))
@@ -0,0 +1,29 @@
+# apps/advertisements/management/commands/rebuild_search_vectors.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.models import CarAd
+from apps.advertisements.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые векторы объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество объявлений в одном UPDATE',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(CarAd.objects.order_by('id').values_list('id', flat=True))
+
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            updated += update_search_vectors(CarAd.objects.filter(id__in=batch))
+            self.stdout.write(f'Обработано {updated} из {len(ids)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Обновлено {updated} поисковых векторов'))
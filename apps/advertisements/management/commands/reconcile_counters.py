@@ -0,0 +1,30 @@
+# apps/advertisements/management/commands/reconcile_counters.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счетчики сайта (site_counters) с таблицами и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, не исправляя их',
+        )
+
+    def handle(self, *args, **options):
+        drift = reconcile_counters(fix=not options['dry_run'])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Счетчики совпадают с таблицами'))
+            return
+
+        for name in sorted(drift):
+            stored, actual = drift[name]
+            self.stdout.write(f'{name}: {stored} -> {actual} ({actual - stored:+d})')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Расхождений: {len(drift)} (не исправлены)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено счетчиков: {len(drift)}'))
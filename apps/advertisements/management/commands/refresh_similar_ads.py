@@ -0,0 +1,50 @@
+# apps/advertisements/management/commands/refresh_similar_ads.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.similarity import (
+    DEFAULT_BATCH_SIZE,
+    SIMILAR_ADS_COUNT,
+    refresh_similar_ads,
+    stale_ad_ids,
+)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих объявлений ad_similar'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать все активные объявления, а не только измененные',
+        )
+        parser.add_argument(
+            '--neighbors',
+            type=int,
+            default=SIMILAR_ADS_COUNT,
+            help='Количество похожих объявлений на одно объявление',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Количество объявлений в одном пакете расчета',
+        )
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f'Обработано {done} из {total}')
+
+        ad_ids = None if options['full'] else stale_ad_ids()
+        if ad_ids is not None and not ad_ids:
+            self.stdout.write(self.style.SUCCESS('Списки похожих объявлений актуальны'))
+            return
+
+        updated = refresh_similar_ads(
+            ad_ids,
+            k=options['neighbors'],
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны похожие объявления для {updated} объявлений'))
@@ -0,0 +1,42 @@
+# apps/advertisements/management/commands/render_photo_renditions.py
+from django.core.management.base import BaseCommand
+
+from apps.advertisements.photo_renditions import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, backfill_renditions
+
+
+class Command(BaseCommand):
+    help = 'Создает варианты изображений (card, gallery, retina) для загруженных фотографий'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=DEFAULT_WORKERS,
+            help='Количество процессов для кодирования',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Количество фотографий в одном пакете',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать варианты всех фотографий, а не только необработанных',
+        )
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f'Обработано {done} из {total}')
+
+        done, failed = backfill_renditions(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            force=options['force'],
+            progress=progress,
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'Созданы варианты для {done} фотографий'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Не удалось обработать {failed} фотографий'))
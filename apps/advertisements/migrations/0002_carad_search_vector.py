@@ -0,0 +1,40 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="carad",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="carad",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="car_ads_search_vector_gin"
+            ),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE car_ads AS a
+                SET search_vector =
+                    setweight(to_tsvector('russian', coalesce(b.name, '')), 'A') ||
+                    setweight(to_tsvector('russian', coalesce(m.name, '')), 'A') ||
+                    setweight(to_tsvector('russian', coalesce(a.title, '')), 'B') ||
+                    setweight(to_tsvector('russian', coalesce(a.description, '')), 'C')
+                FROM car_models AS m
+                JOIN car_brands AS b ON b.id = m.brand_id
+                WHERE m.id = a.model_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
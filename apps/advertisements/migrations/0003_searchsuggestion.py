@@ -0,0 +1,87 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0002_carad_search_vector"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name="SearchSuggestion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создано"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Обновлено"),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("brand", "Марка"),
+                            ("model", "Модель"),
+                            ("brand_model", "Марка и модель"),
+                            ("query", "Популярный запрос"),
+                        ],
+                        max_length=20,
+                        verbose_name="Тип",
+                    ),
+                ),
+                ("text", models.CharField(max_length=200, verbose_name="Текст")),
+                (
+                    "normalized",
+                    models.CharField(
+                        max_length=200, verbose_name="Нормализованный текст"
+                    ),
+                ),
+                (
+                    "url",
+                    models.CharField(blank=True, max_length=300, verbose_name="URL"),
+                ),
+                (
+                    "object_id",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="ID объекта"
+                    ),
+                ),
+                ("weight", models.IntegerField(default=0, verbose_name="Вес")),
+            ],
+            options={
+                "verbose_name": "Поисковая подсказка",
+                "verbose_name_plural": "Поисковые подсказки",
+                "db_table": "search_suggestions",
+                "ordering": ["-weight"],
+                "indexes": [
+                    models.Index(
+                        django.contrib.postgres.indexes.OpClass(
+                            "normalized", name="varchar_pattern_ops"
+                        ),
+                        name="search_sugg_prefix_idx",
+                    ),
+                    django.contrib.postgres.indexes.GinIndex(
+                        django.contrib.postgres.indexes.OpClass(
+                            "normalized", name="gin_trgm_ops"
+                        ),
+                        name="search_sugg_trgm_gin",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,222 @@
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0003_searchsuggestion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdSearchIndex",
+            fields=[
+                (
+                    "ad",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search_index",
+                        serialize=False,
+                        to="advertisements.carad",
+                        verbose_name="Объявление",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(verbose_name="Создано")),
+                (
+                    "brand_id",
+                    models.BigIntegerField(null=True, verbose_name="ID марки"),
+                ),
+                (
+                    "brand_slug",
+                    models.CharField(
+                        blank=True, max_length=120, verbose_name="Slug марки"
+                    ),
+                ),
+                (
+                    "brand_name",
+                    models.CharField(blank=True, max_length=100, verbose_name="Марка"),
+                ),
+                (
+                    "model_id",
+                    models.BigIntegerField(null=True, verbose_name="ID модели"),
+                ),
+                (
+                    "model_slug",
+                    models.CharField(
+                        blank=True, max_length=120, verbose_name="Slug модели"
+                    ),
+                ),
+                (
+                    "model_name",
+                    models.CharField(blank=True, max_length=100, verbose_name="Модель"),
+                ),
+                (
+                    "body_type",
+                    models.CharField(
+                        blank=True, max_length=50, verbose_name="Тип кузова"
+                    ),
+                ),
+                (
+                    "city_id",
+                    models.BigIntegerField(null=True, verbose_name="ID города"),
+                ),
+                (
+                    "city_slug",
+                    models.CharField(
+                        blank=True, max_length=120, verbose_name="Slug города"
+                    ),
+                ),
+                (
+                    "city_name",
+                    models.CharField(blank=True, max_length=100, verbose_name="Город"),
+                ),
+                (
+                    "region",
+                    models.CharField(blank=True, max_length=100, verbose_name="Регион"),
+                ),
+                ("price", models.IntegerField(verbose_name="Цена")),
+                ("year", models.IntegerField(verbose_name="Год выпуска")),
+                ("mileage", models.IntegerField(verbose_name="Пробег")),
+                (
+                    "engine_volume",
+                    models.DecimalField(
+                        decimal_places=1,
+                        max_digits=3,
+                        null=True,
+                        verbose_name="Объем двигателя",
+                    ),
+                ),
+                (
+                    "engine_power",
+                    models.IntegerField(null=True, verbose_name="Мощность (л.с.)"),
+                ),
+                (
+                    "fuel_type",
+                    models.CharField(blank=True, max_length=20, verbose_name="Топливо"),
+                ),
+                (
+                    "transmission_type",
+                    models.CharField(
+                        blank=True, max_length=20, verbose_name="Коробка передач"
+                    ),
+                ),
+                (
+                    "drive_type",
+                    models.CharField(blank=True, max_length=20, verbose_name="Привод"),
+                ),
+                (
+                    "condition",
+                    models.CharField(
+                        blank=True, max_length=20, verbose_name="Состояние"
+                    ),
+                ),
+                (
+                    "color_exterior",
+                    models.CharField(
+                        blank=True, max_length=50, verbose_name="Цвет кузова"
+                    ),
+                ),
+                (
+                    "color_interior",
+                    models.CharField(
+                        blank=True, max_length=50, verbose_name="Цвет салона"
+                    ),
+                ),
+                (
+                    "owner_type",
+                    models.CharField(
+                        blank=True, max_length=10, verbose_name="Тип владельца"
+                    ),
+                ),
+                (
+                    "steering_wheel",
+                    models.CharField(
+                        blank=True, max_length=10, verbose_name="Расположение руля"
+                    ),
+                ),
+                (
+                    "doors",
+                    models.PositiveSmallIntegerField(
+                        null=True, verbose_name="Количество дверей"
+                    ),
+                ),
+                (
+                    "seats",
+                    models.PositiveSmallIntegerField(
+                        null=True, verbose_name="Количество мест"
+                    ),
+                ),
+                (
+                    "has_tuning",
+                    models.BooleanField(default=False, verbose_name="Есть тюнинг"),
+                ),
+                (
+                    "service_history",
+                    models.BooleanField(
+                        default=False, verbose_name="Есть сервисная история"
+                    ),
+                ),
+                (
+                    "views_count",
+                    models.IntegerField(default=0, verbose_name="Просмотры"),
+                ),
+                (
+                    "main_photo_url",
+                    models.CharField(
+                        blank=True,
+                        max_length=300,
+                        verbose_name="Миниатюра главного фото",
+                    ),
+                ),
+                (
+                    "feature_ids",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.BigIntegerField(),
+                        blank=True,
+                        default=list,
+                        size=None,
+                        verbose_name="Характеристики",
+                    ),
+                ),
+                (
+                    "indexed_at",
+                    models.DateTimeField(
+                        auto_now=True, verbose_name="Обновлено в индексе"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Индекс объявления",
+                "verbose_name_plural": "Индекс объявлений",
+                "db_table": "ad_search_index",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["created_at", "ad"], name="ad_index_created_idx"
+                    ),
+                    models.Index(fields=["price", "ad"], name="ad_index_price_idx"),
+                    models.Index(fields=["year", "ad"], name="ad_index_year_idx"),
+                    models.Index(fields=["mileage", "ad"], name="ad_index_mileage_idx"),
+                    models.Index(
+                        fields=["views_count", "ad"], name="ad_index_views_idx"
+                    ),
+                    models.Index(
+                        fields=["brand_id", "model_id"], name="ad_index_brand_model_idx"
+                    ),
+                    models.Index(
+                        fields=["brand_slug", "model_slug"],
+                        name="ad_index_brand_slug_idx",
+                    ),
+                    models.Index(fields=["city_id"], name="ad_index_city_idx"),
+                    models.Index(fields=["body_type"], name="ad_index_body_type_idx"),
+                    django.contrib.postgres.indexes.GinIndex(
+                        fields=["feature_ids"], name="ad_index_features_gin"
+                    ),
+                ],
+            },
+        ),
+    ]
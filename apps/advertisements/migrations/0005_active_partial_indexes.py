@@ -0,0 +1,120 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+ACTIVE_AD = models.Q(("is_active", True), ("status", "active"))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("advertisements", "0004_adsearchindex"),
+    ]
+
+    operations = [
+        # brand_id объявлений должен совпадать с маркой модели
+        migrations.RunSQL(
+            sql=(
+                "UPDATE car_ads SET brand_id = car_models.brand_id "
+                "FROM car_models WHERE car_models.id = car_ads.model_id "
+                "AND car_ads.brand_id IS DISTINCT FROM car_models.brand_id"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["created_at", "id"],
+                name="car_ads_act_created_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["price", "id"],
+                name="car_ads_act_price_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["year", "id"],
+                name="car_ads_act_year_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["mileage", "id"],
+                name="car_ads_act_mileage_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["views", "id"],
+                name="car_ads_act_views_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["views_count", "id"],
+                name="car_ads_act_views_cnt_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["brand", "price"],
+                name="car_ads_act_brand_price_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["model", "price"],
+                name="car_ads_act_model_price_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["model", "year"],
+                name="car_ads_act_model_year_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["fuel_type", "transmission_type", "price"],
+                name="car_ads_act_fuel_trans_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carad",
+            index=models.Index(
+                condition=ACTIVE_AD,
+                fields=["city", "created_at"],
+                name="car_ads_act_city_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="adsearchindex",
+            index=models.Index(
+                fields=["fuel_type", "transmission_type"],
+                name="ad_index_fuel_trans_idx",
+            ),
+        ),
+    ]
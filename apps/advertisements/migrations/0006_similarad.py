@@ -0,0 +1,62 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0005_active_partial_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SimilarAd",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ad",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="similar_links",
+                        to="advertisements.carad",
+                        verbose_name="Объявление",
+                    ),
+                ),
+                (
+                    "similar",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="similar_to",
+                        to="advertisements.carad",
+                        verbose_name="Похожее объявление",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField(verbose_name="Позиция")),
+                ("distance", models.FloatField(verbose_name="Расстояние")),
+                (
+                    "computed_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Рассчитано"),
+                ),
+            ],
+            options={
+                "verbose_name": "Похожее объявление",
+                "verbose_name_plural": "Похожие объявления",
+                "db_table": "ad_similar",
+                "ordering": ["ad", "rank"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ad", "rank"), name="ad_similar_ad_rank_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
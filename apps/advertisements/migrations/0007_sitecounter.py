@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0006_similarad"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiteCounter",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        max_length=150,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Счетчик",
+                    ),
+                ),
+                ("value", models.BigIntegerField(default=0, verbose_name="Значение")),
+            ],
+            options={
+                "verbose_name": "Счетчик сайта",
+                "verbose_name_plural": "Счетчики сайта",
+                "db_table": "site_counters",
+            },
+        ),
+    ]
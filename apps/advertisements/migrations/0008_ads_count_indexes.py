@@ -0,0 +1,28 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("advertisements", "0007_sitecounter"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="city",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["-ads_count"],
+                name="cities_ads_count_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="adsearchindex",
+            index=models.Index(
+                fields=["region", "year"], name="ad_index_region_year_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,77 @@
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("advertisements", "0009_carphoto_renditions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PhotoFile",
+            fields=[
+                (
+                    "sha256",
+                    models.CharField(
+                        max_length=64,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="SHA-256",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, verbose_name="Файл")),
+                (
+                    "phash",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="Перцептивный хэш"
+                    ),
+                ),
+                ("phash_0", models.IntegerField(blank=True, null=True)),
+                ("phash_1", models.IntegerField(blank=True, null=True)),
+                ("phash_2", models.IntegerField(blank=True, null=True)),
+                ("phash_3", models.IntegerField(blank=True, null=True)),
+                (
+                    "ref_count",
+                    models.IntegerField(default=0, verbose_name="Количество ссылок"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создан"),
+                ),
+            ],
+            options={
+                "verbose_name": "Файл фотографии",
+                "verbose_name_plural": "Файлы фотографий",
+                "db_table": "photo_files",
+                "indexes": [
+                    models.Index(fields=["phash_0"], name="photo_files_phash_0_idx"),
+                    models.Index(fields=["phash_1"], name="photo_files_phash_1_idx"),
+                    models.Index(fields=["phash_2"], name="photo_files_phash_2_idx"),
+                    models.Index(fields=["phash_3"], name="photo_files_phash_3_idx"),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="carphoto",
+            name="content",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="photos",
+                to="advertisements.photofile",
+                verbose_name="Файл",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="carphoto",
+            index=models.Index(fields=["content"], name="car_photos_content_idx"),
+        ),
+    ]
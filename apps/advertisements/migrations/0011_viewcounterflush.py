@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0010_photofile"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ViewCounterFlush",
+            fields=[
+                (
+                    "flush_id",
+                    models.CharField(
+                        max_length=32,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Перенос",
+                    ),
+                ),
+                ("applied_at", models.DateTimeField(auto_now_add=True, verbose_name="Применен")),
+            ],
+            options={
+                "verbose_name": "Перенос просмотров",
+                "verbose_name_plural": "Переносы просмотров",
+                "db_table": "view_counter_flushes",
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0011_viewcounterflush"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchsuggestion",
+            name="data",
+            field=models.JSONField(blank=True, default=dict, verbose_name="Данные"),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def fill_ad_search_index(apps, schema_editor):
+    # Код индекса работает с текущими моделями, поэтому заполнение идет
+    # после всех изменений схемы, а не в 0004_adsearchindex
+    from apps.advertisements.search_index import rebuild_ad_index
+
+    rebuild_ad_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0012_searchsuggestion_data"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_ad_search_index, migrations.RunPython.noop, elidable=True),
+    ]
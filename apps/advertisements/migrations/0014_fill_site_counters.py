@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def fill_site_counters(apps, schema_editor):
+    # Счетчики и колонки ads_count заполняются сразу, а не первой сверкой
+    # по расписанию (через час после запуска beat)
+    from apps.advertisements.counters import reconcile_counters
+
+    reconcile_counters()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0013_backfill_ad_search_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_site_counters, migrations.RunPython.noop, elidable=True),
+    ]
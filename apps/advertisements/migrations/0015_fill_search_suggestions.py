@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def fill_search_suggestions(apps, schema_editor):
+    # После 0012_searchsuggestion_data: подсказки хранят поля ответа в data
+    from apps.advertisements.autocomplete import rebuild_suggestions
+
+    rebuild_suggestions()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0014_fill_site_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_suggestions, migrations.RunPython.noop, elidable=True),
+    ]
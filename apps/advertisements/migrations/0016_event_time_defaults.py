@@ -0,0 +1,30 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0015_fill_search_suggestions"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="carview",
+            name="viewed_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="Время просмотра",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="searchhistory",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="Создано",
+            ),
+        ),
+    ]
@@ -1,9 +1,13 @@
 # apps/advertisements/models.py
 import os
 import datetime
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
@@ -19,6 +23,10 @@ def car_photo_path(instance, filename):
     return os.path.join('cars', 'photos', str(instance.car_ad.id), filename)
 
 
+# Условие частичных индексов: объявление опубликовано и видно в списках
+ACTIVE_AD = models.Q(status='active', is_active=True)
+
+
 def current_year_plus_one():
     """Текущий год + 1 для валидатора"""
     return datetime.datetime.now().year + 1
@@ -36,6 +44,8 @@ class City(TimeStampedModel):
             models.Index(fields=['name', 'region']),
             models.Index(fields=['is_active']),
             models.Index(fields=['slug']),
+            # Популярные города - просмотр индекса
+            models.Index(fields=['-ads_count'], name='cities_ads_count_idx', condition=models.Q(is_active=True)),
         ]
 
     name = models.CharField(_('Название города'), max_length=100)
@@ -66,6 +76,7 @@ class City(TimeStampedModel):
 
     # Системные поля
     is_active = models.BooleanField(_('Активен'), default=True)
+    # Активные объявления; поддерживается приращениями (counters.py)
     ads_count = models.IntegerField(_('Количество объявлений'), default=0)
 
     def __str__(self):
@@ -97,7 +108,12 @@ class City(TimeStampedModel):
         return reverse('advertisements:filter_by_city', kwargs={'city_slug': self.slug})
 
     def update_ads_count(self):
-        """Обновить количество объявлений в городе"""
+        """
+        Пересчитать количество объявлений в городе.
+
+        Обычно не нужен: ads_count поддерживается сигналами объявлений,
+        а расхождения исправляет reconcile_counters.
+        """
         from .models import CarAd
         count = CarAd.objects.filter(city=self, is_active=True, status='active').count()
         self.ads_count = count
@@ -171,6 +187,23 @@ class CarAd(TimeStampedModel):
             models.Index(fields=['price']),
             models.Index(fields=['created_at']),
             models.Index(fields=['slug']),
+            GinIndex(fields=['search_vector'], name='car_ads_search_vector_gin'),
+            # Частичные индексы под реальные выборки активных объявлений
+            models.Index(fields=['created_at', 'id'], name='car_ads_act_created_idx', condition=ACTIVE_AD),
+            models.Index(fields=['price', 'id'], name='car_ads_act_price_idx', condition=ACTIVE_AD),
+            models.Index(fields=['year', 'id'], name='car_ads_act_year_idx', condition=ACTIVE_AD),
+            models.Index(fields=['mileage', 'id'], name='car_ads_act_mileage_idx', condition=ACTIVE_AD),
+            models.Index(fields=['views', 'id'], name='car_ads_act_views_idx', condition=ACTIVE_AD),
+            models.Index(fields=['views_count', 'id'], name='car_ads_act_views_cnt_idx', condition=ACTIVE_AD),
+            models.Index(fields=['brand', 'price'], name='car_ads_act_brand_price_idx', condition=ACTIVE_AD),
+            models.Index(fields=['model', 'price'], name='car_ads_act_model_price_idx', condition=ACTIVE_AD),
+            models.Index(fields=['model', 'year'], name='car_ads_act_model_year_idx', condition=ACTIVE_AD),
+            models.Index(
+                fields=['fuel_type', 'transmission_type', 'price'],
+                name='car_ads_act_fuel_trans_idx',
+                condition=ACTIVE_AD
+            ),
+            models.Index(fields=['city', 'created_at'], name='car_ads_act_city_idx', condition=ACTIVE_AD),
         ]
 
     # === Основная информация (из обеих моделей) ===
@@ -373,6 +406,10 @@ class CarAd(TimeStampedModel):
         blank=True
     )
 
+    # === Полнотекстовый поиск ===
+    # Обновляется сигналами (см. apps.advertisements.search.update_search_vectors)
+    search_vector = SearchVectorField(_('Поисковый вектор'), null=True, editable=False)
+
     def __str__(self):
         return f'{self.title} - {self.price:,} {self.price_currency}'
 
@@ -437,9 +474,9 @@ class CarAd(TimeStampedModel):
                 self.slug = f"{original_slug}-{counter}"
                 counter += 1
 
-        # Автоматическое заполнение brand из model.brand
-        if not self.brand and self.model:
-            self.brand = self.model.brand
+        # brand всегда совпадает с маркой модели (по brand_id фильтруют индексы)
+        if self.model_id and self.brand_id != self.model.brand_id:
+            self.brand_id = self.model.brand_id
 
         # Автоматическое обновление цветовых полей
         if self.color and not self.color_exterior:
@@ -496,10 +533,16 @@ class CarAd(TimeStampedModel):
         return self.status in ['active', 'published']
 
     def increment_views(self):
-        """Увеличить счетчик просмотров"""
-        self.views += 1
-        self.views_count += 1
-        self.save(update_fields=['views', 'views_count'])
+        """
+        Учесть просмотр.
+
+        Счетчик копится в Redis и переносится в БД пакетно
+        (см. view_counters.py); в объекте - значение с учетом незаписанных.
+        """
+        from .view_counters import record_view
+        pending = record_view(self.pk)
+        self.views += pending
+        self.views_count += pending
 
     def publish(self):
         """Опубликовать объявление"""
@@ -527,6 +570,41 @@ class CarAd(TimeStampedModel):
         return status_colors.get(self.status, 'secondary')
 
 
+class PhotoFile(models.Model):
+    """
+    Файл фотографии в хранилище по содержимому (photo_storage).
+
+    Одинаковые загрузки хранятся один раз: ключ - SHA-256 содержимого,
+    ref_count - сколько CarPhoto ссылается на файл. phash - разностный
+    перцептивный хэш (64 бита), phash_0..phash_3 - его 16-битные части
+    для поиска почти одинаковых снимков по индексу.
+    """
+
+    class Meta:
+        db_table = 'photo_files'
+        verbose_name = _('Файл фотографии')
+        verbose_name_plural = _('Файлы фотографий')
+        indexes = [
+            models.Index(fields=['phash_0'], name='photo_files_phash_0_idx'),
+            models.Index(fields=['phash_1'], name='photo_files_phash_1_idx'),
+            models.Index(fields=['phash_2'], name='photo_files_phash_2_idx'),
+            models.Index(fields=['phash_3'], name='photo_files_phash_3_idx'),
+        ]
+
+    sha256 = models.CharField(_('SHA-256'), max_length=64, primary_key=True)
+    name = models.CharField(_('Файл'), max_length=255)
+    phash = models.BigIntegerField(_('Перцептивный хэш'), null=True, blank=True)
+    phash_0 = models.IntegerField(null=True, blank=True)
+    phash_1 = models.IntegerField(null=True, blank=True)
+    phash_2 = models.IntegerField(null=True, blank=True)
+    phash_3 = models.IntegerField(null=True, blank=True)
+    ref_count = models.IntegerField(_('Количество ссылок'), default=0)
+    created_at = models.DateTimeField(_('Создан'), auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
 class CarPhoto(TimeStampedModel):
     """Фотографии автомобилей в объявлениях"""
 
@@ -535,6 +613,9 @@ class CarPhoto(TimeStampedModel):
         verbose_name = _('Фотография автомобиля')
         verbose_name_plural = _('Фотографии автомобилей')
         ordering = ['position']
+        indexes = [
+            models.Index(fields=['content'], name='car_photos_content_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['car_ad', 'is_main'],
@@ -556,6 +637,20 @@ class CarPhoto(TimeStampedModel):
         null=True,
         blank=True
     )
+    # Файл оригинала в хранилище по содержимому (пусто для еще не перенесенных)
+    content = models.ForeignKey(
+        PhotoFile,
+        on_delete=models.PROTECT,
+        related_name='photos',
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,  # car_photos_content_idx
+        verbose_name=_('Файл')
+    )
+    # {'source': оригинал, 'sizes': {размер: {'width', 'height', 'webp', 'jpeg'}}},
+    # заполняет photo_renditions
+    renditions = models.JSONField(_('Варианты изображения'), default=dict, blank=True, editable=False)
     is_main = models.BooleanField(_('Главное фото'), default=False)
     position = models.IntegerField(_('Позиция'), default=0)
     alt_text = models.CharField(_('Alt текст'), max_length=200, blank=True)
@@ -563,6 +658,17 @@ class CarPhoto(TimeStampedModel):
     def __str__(self):
         return f'Фото {self.position} для {self.car_ad}'
 
+    def rendition_urls(self):
+        """{размер: {'width', 'height', 'webp', 'jpeg'}} с URL файлов"""
+        storage = self._meta.get_field('image').storage
+        return {
+            size: {
+                key: storage.url(value) if key in ('webp', 'jpeg') else value
+                for key, value in entry.items()
+            }
+            for size, entry in (self.renditions or {}).get('sizes', {}).items()
+        }
+
     def save(self, *args, **kwargs):
         # Если это первое фото для объявления, сделать его главным
         if not self.pk and not CarPhoto.objects.filter(car_ad=self.car_ad).exists():
@@ -643,6 +749,9 @@ class SearchHistory(TimeStampedModel):
         verbose_name_plural = _('История поиска')
         ordering = ['-created_at']
 
+    # Время поиска: задается при записи события (apps.analytics.events)
+    created_at = models.DateTimeField(_('Создано'), default=timezone.now, editable=False)
+
     # Используем строковую ссылку
     user = models.ForeignKey(
         'users.User',
@@ -694,7 +803,210 @@ class CarView(TimeStampedModel):
         blank=True
     )
     user_agent = models.TextField(_('User Agent'), blank=True)
-    viewed_at = models.DateTimeField(_('Время просмотра'), auto_now_add=True)
+    viewed_at = models.DateTimeField(_('Время просмотра'), default=timezone.now, editable=False)
+
+    def __str__(self):
+        return f'Просмотр {self.car_ad} в {self.viewed_at}'
+
+
+class SearchSuggestion(TimeStampedModel):
+    """Предрассчитанные подсказки для автодополнения поиска"""
+
+    class KindType(models.TextChoices):
+        BRAND = 'brand', _('Марка')
+        MODEL = 'model', _('Модель')
+        BRAND_MODEL = 'brand_model', _('Марка и модель')
+        QUERY = 'query', _('Популярный запрос')
+
+    class Meta:
+        db_table = 'search_suggestions'
+        verbose_name = _('Поисковая подсказка')
+        verbose_name_plural = _('Поисковые подсказки')
+        ordering = ['-weight']
+        indexes = [
+            # Префиксный поиск (LIKE 'abc%')
+            models.Index(
+                OpClass('normalized', name='varchar_pattern_ops'),
+                name='search_sugg_prefix_idx'
+            ),
+            # Нечеткий поиск по триграммам (pg_trgm)
+            GinIndex(
+                OpClass('normalized', name='gin_trgm_ops'),
+                name='search_sugg_trgm_gin'
+            ),
+        ]
+
+    kind = models.CharField(_('Тип'), max_length=20, choices=KindType.choices)
+    text = models.CharField(_('Текст'), max_length=200)
+    normalized = models.CharField(_('Нормализованный текст'), max_length=200)
+    url = models.CharField(_('URL'), max_length=300, blank=True)
+    object_id = models.BigIntegerField(_('ID объекта'), null=True, blank=True)
+    weight = models.IntegerField(_('Вес'), default=0)
+    # Поля ответа API, которые нельзя получить из text (slug, марка, логотип)
+    data = models.JSONField(_('Данные'), default=dict, blank=True)
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.text}'
+
+
+class AdSearchIndex(models.Model):
+    """
+    Плоская таблица для списков и фильтров: одна строка на активное объявление.
+
+    Поля марки, модели и города скопированы из связанных таблиц, поэтому
+    выборки не делают JOIN. Поддерживается сигналами (см. search_index.py).
+    """
+
+    class Meta:
+        db_table = 'ad_search_index'
+        verbose_name = _('Индекс объявления')
+        verbose_name_plural = _('Индекс объявлений')
+        ordering = ['-created_at']
+        indexes = [
+            # Сортировки списка (id - уникальный ключ keyset-пагинации)
+            models.Index(fields=['created_at', 'ad'], name='ad_index_created_idx'),
+            models.Index(fields=['price', 'ad'], name='ad_index_price_idx'),
+            models.Index(fields=['year', 'ad'], name='ad_index_year_idx'),
+            models.Index(fields=['mileage', 'ad'], name='ad_index_mileage_idx'),
+            models.Index(fields=['views_count', 'ad'], name='ad_index_views_idx'),
+            # Фильтры
+            models.Index(fields=['brand_id', 'model_id'], name='ad_index_brand_model_idx'),
+            models.Index(fields=['brand_slug', 'model_slug'], name='ad_index_brand_slug_idx'),
+            models.Index(fields=['city_id'], name='ad_index_city_idx'),
+            models.Index(fields=['region', 'year'], name='ad_index_region_year_idx'),
+            models.Index(fields=['body_type'], name='ad_index_body_type_idx'),
+            models.Index(fields=['fuel_type', 'transmission_type'], name='ad_index_fuel_trans_idx'),
+            GinIndex(fields=['feature_ids'], name='ad_index_features_gin'),
+        ]
+
+    ad = models.OneToOneField(
+        CarAd,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_index',
+        verbose_name=_('Объявление')
+    )
+    created_at = models.DateTimeField(_('Создано'))
+
+    # Марка, модель, город (копии из справочников)
+    brand_id = models.BigIntegerField(_('ID марки'), null=True)
+    brand_slug = models.CharField(_('Slug марки'), max_length=120, blank=True)
+    brand_name = models.CharField(_('Марка'), max_length=100, blank=True)
+    model_id = models.BigIntegerField(_('ID модели'), null=True)
+    model_slug = models.CharField(_('Slug модели'), max_length=120, blank=True)
+    model_name = models.CharField(_('Модель'), max_length=100, blank=True)
+    body_type = models.CharField(_('Тип кузова'), max_length=50, blank=True)
+    city_id = models.BigIntegerField(_('ID города'), null=True)
+    city_slug = models.CharField(_('Slug города'), max_length=120, blank=True)
+    city_name = models.CharField(_('Город'), max_length=100, blank=True)
+    region = models.CharField(_('Регион'), max_length=100, blank=True)
+
+    # Характеристики для фильтров и сортировок
+    price = models.IntegerField(_('Цена'))
+    year = models.IntegerField(_('Год выпуска'))
+    mileage = models.IntegerField(_('Пробег'))
+    engine_volume = models.DecimalField(_('Объем двигателя'), max_digits=3, decimal_places=1, null=True)
+    engine_power = models.IntegerField(_('Мощность (л.с.)'), null=True)
+    fuel_type = models.CharField(_('Топливо'), max_length=20, blank=True)
+    transmission_type = models.CharField(_('Коробка передач'), max_length=20, blank=True)
+    drive_type = models.CharField(_('Привод'), max_length=20, blank=True)
+    condition = models.CharField(_('Состояние'), max_length=20, blank=True)
+    color_exterior = models.CharField(_('Цвет кузова'), max_length=50, blank=True)
+    color_interior = models.CharField(_('Цвет салона'), max_length=50, blank=True)
+    owner_type = models.CharField(_('Тип владельца'), max_length=10, blank=True)
+    steering_wheel = models.CharField(_('Расположение руля'), max_length=10, blank=True)
+    doors = models.PositiveSmallIntegerField(_('Количество дверей'), null=True)
+    seats = models.PositiveSmallIntegerField(_('Количество мест'), null=True)
+    has_tuning = models.BooleanField(_('Есть тюнинг'), default=False)
+    service_history = models.BooleanField(_('Есть сервисная история'), default=False)
+    views_count = models.IntegerField(_('Просмотры'), default=0)
+
+    # Для карточки и фильтра по опциям
+    main_photo_url = models.CharField(_('Миниатюра главного фото'), max_length=300, blank=True)
+    feature_ids = ArrayField(models.BigIntegerField(), verbose_name=_('Характеристики'), default=list, blank=True)
+
+    indexed_at = models.DateTimeField(_('Обновлено в индексе'), auto_now=True)
+
+    def __str__(self):
+        return f'Индекс объявления {self.ad_id}'
+
+
+class SimilarAd(models.Model):
+    """
+    Похожие объявления: k ближайших соседей активного объявления.
+
+    Пересчитываются пакетно (apps.advertisements.similarity), страница
+    объявления читает готовый список по индексу (ad, rank).
+    """
+
+    class Meta:
+        db_table = 'ad_similar'
+        verbose_name = _('Похожее объявление')
+        verbose_name_plural = _('Похожие объявления')
+        ordering = ['ad', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['ad', 'rank'], name='ad_similar_ad_rank_uniq'),
+        ]
+
+    ad = models.ForeignKey(
+        CarAd,
+        on_delete=models.CASCADE,
+        related_name='similar_links',
+        db_index=False,  # покрыт ad_similar_ad_rank_uniq
+        verbose_name=_('Объявление')
+    )
+    similar = models.ForeignKey(
+        CarAd,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name=_('Похожее объявление')
+    )
+    rank = models.PositiveSmallIntegerField(_('Позиция'))
+    distance = models.FloatField(_('Расстояние'))
+    computed_at = models.DateTimeField(_('Рассчитано'), auto_now=True)
+
+    def __str__(self):
+        return f'{self.ad_id} -> {self.similar_id} (#{self.rank})'
+
+
+class SiteCounter(models.Model):
+    """
+    Счетчики по сайту: активные объявления, объявления по маркам, моделям,
+    городам и регионам, пользователи.
+
+    Обновляются приращениями при сохранении и удалении записей (см.
+    counters.py), поэтому статистика читается одним запросом по ключу,
+    а не подсчетом по таблицам. Расхождения исправляет reconcile_counters.
+    """
+
+    class Meta:
+        db_table = 'site_counters'
+        verbose_name = _('Счетчик сайта')
+        verbose_name_plural = _('Счетчики сайта')
+
+    name = models.CharField(_('Счетчик'), max_length=150, primary_key=True)
+    value = models.BigIntegerField(_('Значение'), default=0)
+
+    def __str__(self):
+        return f'{self.name} = {self.value}'
+
+
+class ViewCounterFlush(models.Model):
+    """
+    Последний перенос просмотров из Redis, примененный к БД.
+
+    Строка пишется в одной транзакции с приращениями (view_counters.py):
+    если процесс упал после фиксации, но до удаления хэша в Redis,
+    повторный перенос того же хэша пропускается.
+    """
+
+    class Meta:
+        db_table = 'view_counter_flushes'
+        verbose_name = _('Перенос просмотров')
+        verbose_name_plural = _('Переносы просмотров')
+
+    flush_id = models.CharField(_('Перенос'), max_length=32, primary_key=True)
+    applied_at = models.DateTimeField(_('Применен'), auto_now_add=True)
 
     def __str__(self):
-        return f'Просмотр {self.car_ad} в {self.viewed_at}'
\ No newline at end of file
+        return self.flush_id
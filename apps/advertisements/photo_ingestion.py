@@ -0,0 +1,172 @@
+# apps/advertisements/photo_ingestion.py
+"""
+Загрузка фотографий объявления из формы.
+
+Все файлы проверяются, декодируются и приводятся к одному виду
+параллельно в пуле потоков (Pillow освобождает GIL при декодировании,
+масштабировании и кодировании): ориентация из EXIF применяется к
+пикселям, метаданные (в том числе геолокация) удаляются, большие снимки
+уменьшаются до MAX_DIMENSION, результат сохраняется в JPEG. Там же файлы
+записываются в хранилище по содержимому (photo_storage): повторно
+загруженное фото не занимает места.
+
+Строки создаются одним bulk_create, главное фото назначается один раз.
+Количество фото ограничено тарифом владельца (max_photos_per_ad).
+bulk_create не вызывает сигналы CarPhoto, поэтому индекс поиска, кэш
+списков и создание вариантов изображений (render_photo_task) обновляются
+здесь после фиксации транзакции.
+"""
+import io
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from apps.payments.models import SubscriptionPlan, UserSubscription
+
+from .listing_cache import ad_tags, invalidate_listings
+from .models import CarPhoto
+from .photo_storage import change_refs, register_contents, store_content
+from .search_index import refresh_ad_index
+from .tasks import render_photo_task
+
+INGEST_WORKERS = 8
+# Наибольшая сторона сохраняемого оригинала
+MAX_DIMENSION = 3840
+# Защита от «бомб» с огромным разрешением при небольшом размере файла
+MAX_SOURCE_PIXELS = 60_000_000
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+JPEG_QUALITY = 90
+# Без действующей подписки - лимит тарифа по умолчанию
+DEFAULT_MAX_PHOTOS = SubscriptionPlan._meta.get_field('max_photos_per_ad').default
+
+
+class PhotoRejected(Exception):
+    """Файл не является допустимым изображением"""
+
+
+@dataclass
+class IngestResult:
+    photos: list = field(default_factory=list)
+    # [(имя файла, причина)]
+    rejected: list = field(default_factory=list)
+    # Сколько файлов не принято сверх лимита тарифа
+    over_limit: int = 0
+
+
+def max_photos_for(user):
+    """Лимит фото на объявление по действующим подпискам пользователя"""
+    limit = UserSubscription.objects.filter(
+        user=user, is_active=True, end_date__gt=timezone.now()
+    ).aggregate(limit=Max('plan__max_photos_per_ad'))['limit']
+    return limit if limit is not None else DEFAULT_MAX_PHOTOS
+
+
+def normalize_image(data):
+    """Байты загруженного изображения -> JPEG без метаданных с примененной ориентацией"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > MAX_SOURCE_PIXELS:
+            raise PhotoRejected('Слишком большое разрешение')
+        # JPEG декодируется сразу в уменьшенном масштабе, не меньше итогового размера
+        scale = min(MAX_DIMENSION / image.width, MAX_DIMENSION / image.height, 1)
+        image.draft('RGB', (int(image.width * scale), int(image.height * scale)))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+    except PhotoRejected:
+        raise
+    except Exception:
+        raise PhotoRejected('Файл не является изображением')
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def _prepare(photo, upload):
+    """Нормализовать файл и записать в хранилище (выполняется в пуле)"""
+    if upload.size > MAX_UPLOAD_SIZE:
+        raise PhotoRejected(f'Файл больше {MAX_UPLOAD_SIZE // (1024 * 1024)} МБ')
+    content = store_content(normalize_image(upload.read()))
+    photo.image = content.name
+    photo.content_id = content.digest
+    return photo, content
+
+
+def ingest_photos(ad, uploads, user=None):
+    """
+    Добавить к объявлению ad загруженные файлы uploads.
+
+    Фото получают позиции после уже имеющихся; если главного фото нет,
+    им становится первое принятое. Лимит - по тарифу user (по умолчанию
+    владельца объявления).
+    """
+    result = IngestResult()
+    if not uploads:
+        return result
+
+    existing = ad.photos.aggregate(
+        count=Count('pk'),
+        last_position=Max('position'),
+        has_main=Count('pk', filter=Q(is_main=True)),
+    )
+    allowed = max(max_photos_for(user or ad.owner) - existing['count'], 0)
+    result.over_limit = max(len(uploads) - allowed, 0)
+    uploads = uploads[:allowed]
+
+    start = existing['last_position'] + 1 if existing['last_position'] is not None else 0
+    pending = [
+        (CarPhoto(car_ad=ad, position=start + i), upload)
+        for i, upload in enumerate(uploads)
+    ]
+    with ThreadPoolExecutor(max_workers=max(min(INGEST_WORKERS, len(pending)), 1)) as executor:
+        futures = [executor.submit(_prepare, photo, upload) for photo, upload in pending]
+
+    contents = []
+    for (_, upload), future in zip(pending, futures):
+        try:
+            photo, content = future.result()
+        except PhotoRejected as exc:
+            result.rejected.append((upload.name, str(exc)))
+            continue
+        result.photos.append(photo)
+        contents.append(content)
+    if not result.photos:
+        return result
+
+    if not existing['has_main']:
+        result.photos[0].is_main = True
+    # Файлы не удаляются при ошибке: они могут принадлежать другим фото
+    with transaction.atomic():
+        register_contents(contents)
+        CarPhoto.objects.bulk_create(result.photos)
+        change_refs(Counter(content.digest for content in contents))
+
+    _after_ingest(ad, [photo.pk for photo in result.photos])
+    return result
+
+
+def _after_ingest(ad, photo_ids):
+    """То, что для одиночного сохранения делают сигналы CarPhoto"""
+    ad_id = ad.pk
+    tags = ad_tags(ad.brand_id, ad.model_id, ad.city_id)
+
+    def on_commit():
+        refresh_ad_index([ad_id])
+        invalidate_listings(tags)
+        for photo_id in photo_ids:
+            render_photo_task.delay(photo_id)
+
+    transaction.on_commit(on_commit)
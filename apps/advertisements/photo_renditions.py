@@ -0,0 +1,249 @@
+# apps/advertisements/photo_renditions.py
+"""
+Варианты фотографий объявлений разных размеров.
+
+Из оригинала CarPhoto.image получаются варианты card (карточка в списке),
+gallery (галерея объявления) и retina (галерея на экранах высокой
+плотности), каждый в WebP и в JPEG для браузеров без WebP. Ориентация
+из EXIF применяется к пикселям, метаданные не сохраняются, изображение
+только уменьшается.
+
+Имена файлов детерминированы: SHA-256 оригинала, размер и формат.
+Фото с тем же оригиналом (photo_storage) используют те же файлы, а
+новый оригинал получает новые URL (старые можно кэшировать бессрочно).
+Файлы удаляются вместе с оригиналом, когда на него не остается ссылок.
+Состав вариантов хранится в CarPhoto.renditions, JPEG карточки - в
+CarPhoto.thumbnail (его показывает индекс поиска).
+
+render_image работает только с байтами, без Django: его выполняют и
+задача Celery (render_photo_task, после сохранения фото), и процессы
+команды render_photo_renditions для уже загруженных фото.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db.models import F, Q
+from django.db.models.fields.json import KT
+from PIL import Image, ImageOps
+
+from .listing_cache import ad_tags, invalidate_listings
+from .models import CarAd, CarPhoto
+from .search_index import refresh_ad_index
+
+logger = logging.getLogger(__name__)
+
+# Размер -> наибольшие (ширина, высота)
+RENDITION_SIZES = {
+    'card': (480, 360),
+    'gallery': (1280, 960),
+    'retina': (2560, 1920),
+}
+
+# Формат -> (расширение, формат PIL, параметры кодирования)
+RENDITION_FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+THUMBNAIL_RENDITION = ('card', 'jpeg')
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_BATCH_SIZE = 50
+
+
+def source_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def rendition_name(digest, size, fmt):
+    ext = RENDITION_FORMATS[fmt][0]
+    return f'cars/renditions/{digest[:2]}/{digest}_{size}.{ext}'
+
+
+def rendition_names(digest):
+    """Все файлы вариантов оригинала с хэшем digest"""
+    return [rendition_name(digest, size, fmt) for size in RENDITION_SIZES for fmt in RENDITION_FORMATS]
+
+
+def _flatten(image):
+    """RGB без прозрачности (фон белый)"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_image(data):
+    """
+    Варианты изображения из байтов оригинала.
+
+    Возвращает {размер: {'width', 'height', формат: байты}}.
+    """
+    image = Image.open(io.BytesIO(data))
+    # JPEG декодируется сразу в уменьшенном масштабе, если оригинал намного больше
+    image.draft('RGB', max(RENDITION_SIZES.values()))
+    image = _flatten(ImageOps.exif_transpose(image))
+
+    result = {}
+    for size, bounds in RENDITION_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(bounds, Image.Resampling.LANCZOS)
+        rendition = {'width': resized.width, 'height': resized.height}
+        for fmt, (_, pil_format, params) in RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, format=pil_format, **params)
+            rendition[fmt] = buffer.getvalue()
+        result[size] = rendition
+    return result
+
+
+def _render_task(data):
+    """render_image в процессе пула; ошибка возвращается, а не прерывает пакет"""
+    try:
+        return render_image(data), ''
+    except Exception as exc:
+        return None, str(exc) or type(exc).__name__
+
+
+def _read_source(photo):
+    with photo.image.open('rb') as source:
+        return source.read()
+
+
+def _save_renditions(photo, renditions):
+    """Записать варианты в фото; False, если оригинал заменили во время обработки"""
+    size, fmt = THUMBNAIL_RENDITION
+    # update() без сигналов: сохранение фото снова поставило бы его в обработку
+    return bool(CarPhoto.objects.filter(pk=photo.pk, image=photo.image.name).update(
+        renditions=renditions,
+        thumbnail=renditions['sizes'][size][fmt],
+    ))
+
+
+def store_renditions(photo, data, rendered, overwrite=False):
+    """
+    Сохранить файлы вариантов и записать их в фото.
+
+    Файлы, которые уже есть (тот же оригинал у другого фото), не
+    перезаписываются, если не указано overwrite.
+    """
+    storage = CarPhoto._meta.get_field('image').storage
+    digest = source_digest(data)
+    renditions = {'source': photo.image.name, 'sizes': {}}
+    for size, rendition in rendered.items():
+        entry = {'width': rendition['width'], 'height': rendition['height']}
+        for fmt in RENDITION_FORMATS:
+            name = rendition_name(digest, size, fmt)
+            if overwrite and storage.exists(name):
+                storage.delete(name)
+            if not storage.exists(name):
+                saved = storage.save(name, ContentFile(rendition[fmt]))
+                if saved != name:
+                    # Тот же вариант успел записать другой процесс
+                    storage.delete(saved)
+            entry[fmt] = name
+        renditions['sizes'][size] = entry
+    return _save_renditions(photo, renditions)
+
+
+def attach_renditions(photo):
+    """Взять готовые варианты у другого фото с тем же файлом; False, если таких нет"""
+    if photo.content_id is None:
+        return False
+    shared = CarPhoto.objects.filter(content_id=photo.content_id).exclude(pk=photo.pk).annotate(
+        rendered_source=KT('renditions__source')
+    ).filter(rendered_source=photo.image.name).values_list('renditions', flat=True).first()
+    return shared is not None and _save_renditions(photo, shared)
+
+
+def _refresh_ads(ad_ids):
+    """Миниатюра главного фото - в индексе поиска и кэше списков"""
+    refresh_ad_index(ad_ids)
+    for row in CarAd.objects.filter(pk__in=ad_ids).values_list('brand_id', 'model_id', 'city_id'):
+        invalidate_listings(ad_tags(*row))
+
+
+def render_photo(photo_id):
+    """Создать варианты фото photo_id (задача Celery)"""
+    photo = CarPhoto.objects.filter(pk=photo_id).first()
+    if photo is None or not photo.image:
+        return False
+    if not attach_renditions(photo):
+        data = _read_source(photo)
+        if not store_renditions(photo, data, render_image(data)):
+            return False
+    _refresh_ads([photo.car_ad_id])
+    return True
+
+
+def needs_renditions(photo):
+    """Варианты отсутствуют или сделаны из другого оригинала"""
+    return bool(photo.image) and (photo.renditions or {}).get('source') != photo.image.name
+
+
+def pending_photos(force=False):
+    """Фото без актуальных вариантов (при force=True - все с оригиналом)"""
+    photos = CarPhoto.objects.exclude(image='')
+    if force:
+        return photos
+    return photos.annotate(rendered_source=KT('renditions__source')).filter(
+        Q(rendered_source__isnull=True) | ~Q(rendered_source=F('image'))
+    )
+
+
+def backfill_renditions(workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, force=False, progress=None):
+    """
+    Создать варианты для уже загруженных фото.
+
+    Оригиналы читаются и результаты сохраняются в основном процессе,
+    кодирование выполняется в пуле процессов пакетами по batch_size фото.
+    Возвращает (обработано, ошибок).
+    """
+    photo_ids = list(pending_photos(force).order_by('pk').values_list('pk', flat=True))
+    done = failed = 0
+    # fork: процессам пула не нужно заново настраивать Django, а с БД они не работают
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=max(workers, 1), mp_context=context) as executor:
+        for start in range(0, len(photo_ids), batch_size):
+            photos = list(CarPhoto.objects.filter(pk__in=photo_ids[start:start + batch_size]).order_by('pk'))
+            ad_ids = set()
+            # Одинаковые оригиналы (хранилище по содержимому) кодируются один раз
+            groups = {}
+            for photo in photos:
+                if not force and attach_renditions(photo):
+                    ad_ids.add(photo.car_ad_id)
+                    done += 1
+                    continue
+                groups.setdefault(photo.image.name, []).append(photo)
+
+            sources = []
+            for group in groups.values():
+                try:
+                    sources.append((group, _read_source(group[0])))
+                except Exception:
+                    logger.exception('Не удалось прочитать оригинал фото %s', group[0].pk)
+                    failed += len(group)
+
+            results = executor.map(_render_task, [data for _, data in sources])
+            for (group, data), (rendered, error) in zip(sources, results):
+                if rendered is None:
+                    logger.error('Не удалось обработать фото %s: %s', group[0].pk, error)
+                    failed += len(group)
+                    continue
+                for photo in group:
+                    if store_renditions(photo, data, rendered, overwrite=force and photo is group[0]):
+                        ad_ids.add(photo.car_ad_id)
+                    done += 1
+
+            if ad_ids:
+                _refresh_ads(sorted(ad_ids))
+            if progress:
+                progress(done + failed, len(photo_ids))
+    return done, failed
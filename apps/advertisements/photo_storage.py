@@ -0,0 +1,304 @@
+# apps/advertisements/photo_storage.py
+"""
+Хранилище оригиналов фотографий по содержимому.
+
+Файл CarPhoto.image хранится под именем из SHA-256 содержимого
+(cars/photos/sha256/ab/cd/<sha256>.jpg), поэтому одинаковые фото,
+загруженные к разным объявлениям, записываются один раз. Варианты
+разных размеров (photo_renditions) тоже называются по SHA-256
+оригинала и создаются один раз на файл.
+
+Строка PhotoFile учитывает ссылки фотографий на файл (ref_count).
+Сигналы CarPhoto (и загрузка фото через bulk_create) меняют счетчик в
+транзакции сохранения. Когда ссылок не остается, строка удаляется, а
+файлы - после фиксации и только если файл за это время не понадобился
+снова. Регистрация файла и удаление файлов берут блокировку по sha256
+(до конца транзакции): удаление ждет фиксации новой ссылки, а файл,
+удаленный до регистрации, записывается заново. Счетчики сверяет
+reconcile_refs (команда dedupe_photos).
+
+Для поиска почти одинаковых снимков (другое сжатие или размер)
+хранится разностный перцептивный хэш. Снимки с расстоянием Хэмминга
+не больше NEAR_DUPLICATE_DISTANCE совпадают хотя бы в одной из четырех
+16-битных частей хэша, поэтому кандидаты ищутся по индексам частей.
+"""
+import hashlib
+import io
+import os
+from dataclasses import dataclass, field
+
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.fields.json import KT
+from django.db.models.functions import Coalesce
+from PIL import Image, ImageOps
+
+from .models import CarAd, CarPhoto, PhotoFile
+from .photo_renditions import rendition_names
+
+PHOTO_DIR = 'cars/photos/sha256'
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 16
+NEAR_DUPLICATE_DISTANCE = 3
+
+
+@dataclass
+class StoredContent:
+    digest: str
+    name: str
+    phash: int = None
+    # Файл записан сейчас, а не найден в хранилище
+    created: bool = False
+    # Содержимое - чтобы записать файл заново, если его успели удалить
+    data: bytes = field(default=None, repr=False)
+
+
+def _storage():
+    return CarPhoto._meta.get_field('image').storage
+
+
+def content_name(digest, ext='.jpg'):
+    return f'{PHOTO_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def perceptual_hash(data):
+    """Разностный хэш (dHash) 64 бита как знаковое целое; None, если не изображение"""
+    try:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        pixels = list(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    # bigint в PostgreSQL знаковый
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def phash_bands(phash):
+    unsigned = phash & ((1 << 64) - 1)
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(unsigned >> (PHASH_BAND_BITS * i)) & mask for i in range(PHASH_BANDS)]
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def _save_missing(storage, name, data):
+    """Записать файл, если его нет; True - если записан"""
+    if storage.exists(name):
+        return False
+    saved = storage.save(name, ContentFile(data))
+    if saved != name:
+        # Тот же файл успел записать параллельный запрос
+        storage.delete(saved)
+    return True
+
+
+def store_content(data, ext='.jpg'):
+    """
+    Записать содержимое в хранилище, если такого файла еще нет.
+
+    Найденный файл можно использовать только после register_contents:
+    до нее его может удалить delete_files.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    name = content_name(digest, ext)
+    created = _save_missing(_storage(), name, data)
+    return StoredContent(digest, name, perceptual_hash(data), created, data)
+
+
+def _lock_contents(digests):
+    """Блокировки по sha256 до конца транзакции (в одном порядке во всех процессах)"""
+    with connection.cursor() as cursor:
+        for digest in sorted(digests):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [int(digest[:15], 16)])
+
+
+def register_contents(contents):
+    """
+    Строки PhotoFile для записанных файлов (без изменения счетчиков).
+
+    Блокировка держится до фиксации внешней транзакции, поэтому
+    delete_files не удалит файл, пока на него не появится ссылка. Файл,
+    удаленный между store_content и блокировкой, записывается заново.
+    """
+    rows = {}
+    for content in contents:
+        fields = {}
+        if content.phash is not None:
+            fields = {f'phash_{i}': band for i, band in enumerate(phash_bands(content.phash))}
+        rows[content.digest] = PhotoFile(
+            sha256=content.digest, name=content.name, phash=content.phash, **fields
+        )
+    storage = _storage()
+    with transaction.atomic():
+        _lock_contents(rows)
+        PhotoFile.objects.bulk_create(
+            [rows[digest] for digest in sorted(rows)], ignore_conflicts=True
+        )
+        for content in contents:
+            if content.data is not None:
+                _save_missing(storage, content.name, content.data)
+
+
+def change_refs(deltas):
+    """
+    Изменить счетчики ссылок {sha256: delta}.
+
+    Файлы без ссылок удаляются после фиксации транзакции.
+    """
+    # Порядок по ключу: параллельные транзакции блокируют строки в одном порядке
+    items = sorted((digest, delta) for digest, delta in deltas.items() if digest and delta)
+    if not items:
+        return
+    for digest, delta in items:
+        PhotoFile.objects.filter(pk=digest).update(ref_count=F('ref_count') + delta)
+    _release(PhotoFile.objects.filter(pk__in=[digest for digest, _ in items], ref_count__lte=0))
+
+
+def _release(queryset):
+    # Строку, на которую все же ссылается фото (счетчик разошелся), не трогаем
+    released = dict(
+        queryset.filter(~Exists(CarPhoto.objects.filter(content=OuterRef('pk')))).values_list('pk', 'name')
+    )
+    if not released:
+        return
+    PhotoFile.objects.filter(pk__in=released).delete()
+    transaction.on_commit(lambda: delete_files(released))
+
+
+def delete_files(released):
+    """Удалить файлы {sha256: имя}, если они не загружены заново"""
+    storage = _storage()
+    with transaction.atomic():
+        # Ждем транзакции, которые регистрируют эти файлы заново
+        _lock_contents(released)
+        reused = set(PhotoFile.objects.filter(pk__in=released).values_list('pk', flat=True))
+        for digest, name in released.items():
+            if digest in reused:
+                continue
+            for file_name in (name, *rendition_names(digest)):
+                storage.delete(file_name)
+
+
+def near_duplicates(photo_file, distance=NEAR_DUPLICATE_DISTANCE):
+    """Другие файлы с похожим изображением: [(PhotoFile, расстояние)]"""
+    if photo_file.phash is None:
+        return []
+    condition = Q()
+    for i, band in enumerate(phash_bands(photo_file.phash)):
+        condition |= Q(**{f'phash_{i}': band})
+    candidates = PhotoFile.objects.filter(condition).exclude(pk=photo_file.pk)
+    result = []
+    for candidate in candidates:
+        candidate_distance = hamming_distance(candidate.phash, photo_file.phash)
+        if candidate_distance <= distance:
+            result.append((candidate, candidate_distance))
+    return sorted(result, key=lambda item: item[1])
+
+
+def duplicate_ads(ad):
+    """Другие объявления с теми же или почти теми же фотографиями (для модерации)"""
+    files = PhotoFile.objects.filter(photos__car_ad=ad).distinct()
+    digests = set()
+    for photo_file in files:
+        digests.add(photo_file.pk)
+        digests.update(candidate.pk for candidate, _ in near_duplicates(photo_file))
+    if not digests:
+        return CarAd.objects.none()
+    return CarAd.objects.filter(photos__content__in=digests).exclude(pk=ad.pk).distinct()
+
+
+def move_legacy_photos(batch_size=100, progress=None):
+    """
+    Перенести фото, загруженные до хранилища по содержимому.
+
+    Возвращает (перенесено, ошибок, байт в повторах, {id фото: старые
+    файлы миниатюр и вариантов}). Старые миниатюры и варианты остаются на
+    месте, пока фото не получат новые варианты (backfill_renditions),
+    затем их удаляет delete_legacy_renditions.
+    """
+    storage = _storage()
+    photo_ids = list(
+        CarPhoto.objects.filter(content__isnull=True).exclude(image='').order_by('pk').values_list('pk', flat=True)
+    )
+    moved = failed = saved_bytes = 0
+    legacy_files = {}
+    for start in range(0, len(photo_ids), batch_size):
+        for photo in CarPhoto.objects.filter(pk__in=photo_ids[start:start + batch_size]).order_by('pk'):
+            old_name = photo.image.name
+            try:
+                with photo.image.open('rb') as source:
+                    data = source.read()
+            except OSError:
+                failed += 1
+                continue
+
+            content = store_content(data, os.path.splitext(old_name)[1] or '.jpg')
+            with transaction.atomic():
+                register_contents([content])
+                updated = CarPhoto.objects.filter(pk=photo.pk, image=old_name, content__isnull=True).update(
+                    image=content.name, content=content.digest
+                )
+                if updated:
+                    change_refs({content.digest: 1})
+            if not updated:
+                continue
+
+            moved += 1
+            if not content.created:
+                saved_bytes += len(data)
+            if not CarPhoto.objects.filter(image=old_name).exists():
+                storage.delete(old_name)
+            legacy_files[photo.pk] = _photo_files(photo)
+        if progress:
+            progress(min(start + batch_size, len(photo_ids)), len(photo_ids))
+    return moved, failed, saved_bytes, legacy_files
+
+
+def _photo_files(photo):
+    names = {photo.thumbnail.name} if photo.thumbnail else set()
+    for entry in (photo.renditions or {}).get('sizes', {}).values():
+        names.update(entry.get(fmt) for fmt in ('webp', 'jpeg') if entry.get(fmt))
+    return names
+
+
+def delete_legacy_renditions(legacy_files):
+    """Удалить старые миниатюры и варианты фото, которые уже получили новые варианты"""
+    storage = _storage()
+    rendered = CarPhoto.objects.filter(pk__in=legacy_files).annotate(
+        rendered_source=KT('renditions__source')
+    ).filter(rendered_source=F('image')).values_list('pk', flat=True)
+    deleted = 0
+    for photo_id in rendered:
+        for name in legacy_files[photo_id]:
+            storage.delete(name)
+            deleted += 1
+    return deleted
+
+
+def reconcile_refs():
+    """Исправить счетчики ссылок по таблице фото; возвращает число исправленных"""
+    actual = CarPhoto.objects.filter(
+        content=OuterRef('pk')
+    ).order_by().values('content').annotate(count=Count('pk')).values('count')
+    with transaction.atomic():
+        drift = list(
+            PhotoFile.objects.select_for_update()
+            .annotate(actual=Coalesce(Subquery(actual), 0))
+            .exclude(ref_count=F('actual'))
+            .values_list('pk', 'actual')
+        )
+        for digest, count in drift:
+            PhotoFile.objects.filter(pk=digest).update(ref_count=count)
+        _release(PhotoFile.objects.filter(ref_count__lte=0))
+    return len(drift)
+
+
+def content_stats():
+    """Сколько файлов хранится и сколько фото на них ссылается"""
+    return PhotoFile.objects.aggregate(files=Count('pk'), references=Coalesce(Sum('ref_count'), 0))
@@ -0,0 +1,143 @@
+# apps/advertisements/search.py
+"""
+Полнотекстовый поиск по объявлениям, маркам и моделям.
+
+Все точки входа поиска (HTML-страницы, AJAX и REST API) используют
+функции этого модуля, а не собственные цепочки icontains.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, OuterRef, Subquery
+
+from apps.catalog.models import CarBrand, CarModel
+
+# Конфигурация словаря PostgreSQL для морфологии
+SEARCH_CONFIG = 'russian'
+
+# Слова запроса: буквы и цифры (пунктуация и операторы tsquery отбрасываются)
+_TERM_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+# VIN: 17 символов без I, O, Q
+_VIN_RE = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$', re.IGNORECASE)
+
+
+def build_raw_tsquery(text):
+    """Текст tsquery с префиксным поиском по каждому слову запроса"""
+    terms = _TERM_RE.findall((text or '').lower())
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def build_search_query(text):
+    """SearchQuery для пользовательского запроса (None, если искать нечего)"""
+    raw_query = build_raw_tsquery(text)
+    if not raw_query:
+        return None
+    return SearchQuery(raw_query, config=SEARCH_CONFIG, search_type='raw')
+
+
+def ad_search_vector():
+    """Выражение взвешенного вектора для CarAd (марка/модель > заголовок > описание)"""
+    car_model = CarModel.objects.filter(pk=OuterRef('model_id'))
+    brand_name = Subquery(car_model.values('brand__name')[:1])
+    model_name = Subquery(car_model.values('name')[:1])
+
+    return (
+        SearchVector(brand_name, weight='A', config=SEARCH_CONFIG) +
+        SearchVector(model_name, weight='A', config=SEARCH_CONFIG) +
+        SearchVector('title', weight='B', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(queryset):
+    """Пересчитать search_vector одним UPDATE для всех объявлений queryset"""
+    return queryset.order_by().update(search_vector=ad_search_vector())
+
+
+def active_ads():
+    """Базовый queryset активных объявлений"""
+    from .models import CarAd
+    return CarAd.objects.filter(status='active', is_active=True)
+
+
+def search_ads(text, queryset=None, order_by_rank=True):
+    """
+    Поиск объявлений по тексту.
+
+    Использует GIN-индекс по search_vector; VIN ищется точным совпадением
+    по уникальному индексу. Результаты упорядочены по релевантности.
+    """
+    if queryset is None:
+        queryset = active_ads()
+
+    text = (text or '').strip()
+    if _VIN_RE.match(text):
+        return queryset.filter(vin=text.upper())
+
+    search_query = build_search_query(text)
+    if search_query is None:
+        return queryset.none()
+
+    queryset = queryset.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)
+    )
+    if order_by_rank:
+        queryset = queryset.order_by('-rank', '-created_at', '-id')
+    return queryset
+
+
+def search_brands(text, limit=10):
+    """Поиск марок (справочник небольшой, вектор строится на лету)"""
+    search_query = build_search_query(text)
+    if search_query is None:
+        return []
+
+    vector = (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+    return list(
+        CarBrand.objects.filter(is_active=True).annotate(
+            search=vector
+        ).filter(search=search_query).annotate(
+            rank=SearchRank(vector, search_query)
+        ).order_by('-rank', 'name')[:limit]
+    )
+
+
+def search_models(text, limit=20):
+    """Поиск моделей с учетом названия марки"""
+    search_query = build_search_query(text)
+    if search_query is None:
+        return []
+
+    vector = (
+        SearchVector('brand__name', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('name', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+    return list(
+        CarModel.objects.filter(is_active=True).select_related('brand').annotate(
+            search=vector
+        ).filter(search=search_query).annotate(
+            rank=SearchRank(vector, search_query)
+        ).order_by('-rank', 'brand__name', 'name')[:limit]
+    )
+
+
+def search_all(text, ads_limit=20):
+    """Поиск по маркам, моделям и объявлениям для страниц поиска"""
+    brands = search_brands(text)
+    models = search_models(text)
+    ads = list(
+        search_ads(text).select_related(
+            'model__brand', 'owner'
+        ).prefetch_related('photos')[:ads_limit]
+    )
+    return {
+        'brands': brands,
+        'models': models,
+        'advertisements': ads,
+        'results_count': len(brands) + len(models) + len(ads),
+    }
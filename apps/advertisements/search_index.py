@@ -0,0 +1,167 @@
+# apps/advertisements/search_index.py
+"""
+Поддержка плоской таблицы ad_search_index.
+
+Строки пересчитываются по id объявлений одним SELECT и одним
+INSERT ... ON CONFLICT DO UPDATE; объявления, ставшие неактивными,
+удаляются из индекса. Списки выбирают страницу из индекса, а полные
+объекты CarAd загружают одним запросом только для этой страницы.
+"""
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import transaction
+from django.db.models import CharField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+
+from .models import AdSearchIndex, CarAd, CarAdFeature, CarPhoto
+from .search import active_ads
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Поле индекса -> поле CarAd
+INDEX_COLUMNS = {
+    'created_at': 'created_at',
+    'brand_id': 'model__brand_id',
+    'brand_slug': 'model__brand__slug',
+    'brand_name': 'model__brand__name',
+    'model_id': 'model_id',
+    'model_slug': 'model__slug',
+    'model_name': 'model__name',
+    'body_type': 'model__body_type',
+    'city_id': 'city_id',
+    'city_slug': 'city__slug',
+    'city_name': 'city__name',
+    'region': 'region',
+    'price': 'price',
+    'year': 'year',
+    'mileage': 'mileage',
+    'engine_volume': 'engine_volume',
+    'engine_power': 'engine_power',
+    'fuel_type': 'fuel_type',
+    'transmission_type': 'transmission_type',
+    'drive_type': 'drive_type',
+    'condition': 'condition',
+    'color_exterior': 'color_exterior',
+    'color_interior': 'color_interior',
+    'owner_type': 'owner_type',
+    'steering_wheel': 'steering_wheel',
+    'doors': 'doors',
+    'seats': 'seats',
+    'has_tuning': 'has_tuning',
+    'service_history': 'service_history',
+    'views_count': 'views_count',
+}
+
+# Строковые поля, которые в индексе не бывают NULL
+_TEXT_COLUMNS = {
+    'brand_slug', 'brand_name', 'model_slug', 'model_name',
+    'body_type', 'city_slug', 'city_name', 'region',
+}
+
+UPDATE_FIELDS = [*INDEX_COLUMNS, 'main_photo_url', 'feature_ids', 'indexed_at']
+
+
+def _source_rows(ad_ids):
+    """Данные активных объявлений для индекса (один запрос)"""
+    main_photo = CarPhoto.objects.filter(
+        car_ad=OuterRef('pk')
+    ).order_by('-is_main', 'position', 'id').annotate(
+        file=Coalesce(NullIf(F('thumbnail'), Value('')), F('image'), output_field=CharField())
+    ).values('file')[:1]
+
+    feature_ids = CarAdFeature.objects.filter(
+        car_ad=OuterRef('pk')
+    ).order_by('feature_id').values('feature_id')
+
+    return active_ads().filter(pk__in=ad_ids).order_by().annotate(
+        main_photo_file=Subquery(main_photo),
+        index_feature_ids=ArraySubquery(feature_ids),
+    ).values('pk', 'main_photo_file', 'index_feature_ids', *INDEX_COLUMNS.values())
+
+
+def _photo_url(name):
+    if not name:
+        return ''
+    return CarPhoto._meta.get_field('image').storage.url(name)
+
+
+def _index_row(row):
+    values = {field: row[column] for field, column in INDEX_COLUMNS.items()}
+    for field in _TEXT_COLUMNS:
+        values[field] = values[field] or ''
+    return AdSearchIndex(
+        ad_id=row['pk'],
+        main_photo_url=_photo_url(row['main_photo_file']),
+        feature_ids=row['index_feature_ids'] or [],
+        **values
+    )
+
+
+def refresh_ad_index(ad_ids):
+    """Пересчитать строки индекса для объявлений ad_ids"""
+    ad_ids = list(ad_ids)
+    if not ad_ids:
+        return 0
+
+    rows = [_index_row(row) for row in _source_rows(ad_ids)]
+    indexed_ids = [row.ad_id for row in rows]
+
+    with transaction.atomic():
+        # Неактивные и удаленные объявления убираем из индекса
+        AdSearchIndex.objects.filter(ad_id__in=ad_ids).exclude(ad_id__in=indexed_ids).delete()
+        AdSearchIndex.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['ad'],
+            update_fields=UPDATE_FIELDS,
+        )
+
+    return len(rows)
+
+
+def refresh_ad_index_for(queryset, batch_size=DEFAULT_BATCH_SIZE):
+    """Пересчитать индекс для всех объявлений queryset CarAd пачками"""
+    ad_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    updated = 0
+    for start in range(0, len(ad_ids), batch_size):
+        updated += refresh_ad_index(ad_ids[start:start + batch_size])
+    return updated
+
+
+def update_index_views(ad_id, views_count):
+    """Счетчик просмотров меняется часто: обновляем только его"""
+    AdSearchIndex.objects.filter(ad_id=ad_id).update(views_count=views_count)
+
+
+def rebuild_ad_index(batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Полная перестройка индекса"""
+    AdSearchIndex.objects.exclude(ad_id__in=active_ads().values('pk')).delete()
+
+    ad_ids = list(active_ads().order_by('pk').values_list('pk', flat=True))
+    updated = 0
+    for start in range(0, len(ad_ids), batch_size):
+        updated += refresh_ad_index(ad_ids[start:start + batch_size])
+        if progress:
+            progress(updated, len(ad_ids))
+    return updated
+
+
+def load_ads(index_rows):
+    """
+    Объекты CarAd для строк индекса в том же порядке (один запрос).
+
+    URL главного фото и id характеристик берутся из индекса.
+    """
+    index_rows = list(index_rows)
+    ads = CarAd.objects.select_related(
+        'model__brand', 'city', 'owner'
+    ).in_bulk([row.ad_id for row in index_rows])
+
+    result = []
+    for row in index_rows:
+        ad = ads.get(row.ad_id)
+        if ad is None:
+            continue
+        ad.main_photo_url = row.main_photo_url
+        ad.feature_ids = row.feature_ids
+        result.append(ad)
+    return result
@@ -1,10 +1,313 @@
 # apps/advertisements/signals.py
-from django.db.models.signals import pre_save
+import os
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import CarAd
+
+from apps.catalog.models import CarBrand, CarModel
+from apps.users.models import User
+from .autocomplete import refresh_brand_suggestions, refresh_model_suggestions
+from .counters import add_counts, affects_counters, count_changes, current_state, stored_state
+from .filters import invalidate_filter_refs
+from .listing_cache import CATALOG_TAG, ad_tags, invalidate_listings
+from .models import CarAd, CarAdFeature, CarPhoto, City, SearchSuggestion
+from .photo_renditions import needs_renditions
+from .photo_storage import change_refs, register_contents, store_content
+from .search import update_search_vectors
+from .search_index import refresh_ad_index, refresh_ad_index_for, update_index_views
+from .tasks import render_photo_task
+
+# Поля объявления, влияющие на поисковый вектор
+SEARCH_VECTOR_FIELDS = {'title', 'description', 'model', 'model_id'}
+
+# Поля счетчиков: при их сохранении в индексе обновляется только views_count
+VIEW_COUNTER_FIELDS = {'views', 'views_count', 'updated_at'}
+
 
 @receiver(pre_save, sender=CarAd)
 def auto_generate_title(sender, instance, **kwargs):
     """Автоматически генерирует заголовок перед сохранением"""
     if not instance.title or instance.title.strip() == '':
-        instance.title = instance.generate_title()
\ No newline at end of file
+        instance.title = instance.generate_title()
+
+
+@receiver(post_save, sender=CarAd)
+def refresh_ad_search_vector(sender, instance, created, update_fields=None, **kwargs):
+    """Пересчитывает поисковый вектор после изменения текстовых полей"""
+    if update_fields is not None and not SEARCH_VECTOR_FIELDS.intersection(update_fields):
+        return
+    update_search_vectors(CarAd.objects.filter(pk=instance.pk))
+
+
+# Поля марки и модели, входящие в поисковый вектор объявлений
+CATALOG_VECTOR_FIELDS = {
+    CarBrand: ('name',),
+    CarModel: ('name', 'brand_id'),
+}
+
+
+def _vector_source(instance):
+    return tuple(getattr(instance, field) for field in CATALOG_VECTOR_FIELDS[type(instance)])
+
+
+@receiver(pre_save, sender=CarBrand)
+@receiver(pre_save, sender=CarModel)
+def remember_vector_source(sender, instance, update_fields=None, **kwargs):
+    """
+    Название (и марка модели) до изменения: векторы объявлений
+    пересчитываются, только если они изменились, а не при правке
+    логотипа, описания и т.п.
+    """
+    instance._previous_vector_source = None
+    if instance._state.adding or instance.pk is None:
+        return
+    fields = CATALOG_VECTOR_FIELDS[sender]
+    if update_fields is not None and not {
+        name for field in fields for name in (field, field.removesuffix('_id'))
+    }.intersection(update_fields):
+        instance._previous_vector_source = _vector_source(instance)
+        return
+    instance._previous_vector_source = sender._base_manager.filter(pk=instance.pk).values_list(*fields).first()
+
+
+def _vector_source_changed(instance, created):
+    return not created and getattr(instance, '_previous_vector_source', None) != _vector_source(instance)
+
+
+@receiver(post_save, sender=CarBrand)
+def refresh_brand_search_vectors(sender, instance, created, **kwargs):
+    """Название марки входит в вектор всех ее объявлений"""
+    if _vector_source_changed(instance, created):
+        update_search_vectors(CarAd.objects.filter(model__brand_id=instance.pk))
+
+
+@receiver(post_save, sender=CarModel)
+def refresh_model_search_vectors(sender, instance, created, **kwargs):
+    """Название модели входит в вектор всех ее объявлений"""
+    if _vector_source_changed(instance, created):
+        update_search_vectors(CarAd.objects.filter(model_id=instance.pk))
+
+
+@receiver(post_save, sender=CarBrand)
+@receiver(post_delete, sender=CarBrand)
+def refresh_brand_autocomplete(sender, instance, **kwargs):
+    """Подсказки автодополнения для марки и ее моделей"""
+    refresh_brand_suggestions(instance.pk)
+
+
+@receiver(post_save, sender=CarModel)
+def refresh_model_autocomplete(sender, instance, **kwargs):
+    """Подсказки модели (остальные модели марки не пересчитываются)"""
+    refresh_model_suggestions(instance.pk)
+
+
+@receiver(post_delete, sender=CarModel)
+def remove_model_autocomplete(sender, instance, **kwargs):
+    """Удаляет подсказки удаленной модели"""
+    SearchSuggestion.objects.filter(
+        kind__in=[SearchSuggestion.KindType.MODEL, SearchSuggestion.KindType.BRAND_MODEL],
+        object_id=instance.pk
+    ).delete()
+
+
+@receiver(pre_save, sender=CarPhoto)
+def store_photo_content(sender, instance, update_fields=None, **kwargs):
+    """
+    Новый файл оригинала - в хранилище по содержимому вместо upload_to;
+    запоминается прежний файл для счетчиков ссылок.
+    """
+    instance._previous_content_id = None
+    if update_fields is not None and not {'image', 'content'}.intersection(update_fields):
+        return
+    if not instance._state.adding:
+        instance._previous_content_id = CarPhoto.objects.filter(
+            pk=instance.pk
+        ).values_list('content_id', flat=True).first()
+
+    image = instance.image
+    if image and not image._committed:
+        image.open('rb')
+        content = store_content(image.read(), os.path.splitext(image.name)[1] or '.jpg')
+        register_contents([content])
+        image.name = content.name
+        image._committed = True
+        instance.content_id = content.digest
+
+
+@receiver(post_save, sender=CarPhoto)
+def update_photo_refs(sender, instance, update_fields=None, **kwargs):
+    """Ссылка на новый файл вместо прежнего"""
+    if update_fields is not None and not {'image', 'content'}.intersection(update_fields):
+        return
+    previous = getattr(instance, '_previous_content_id', None)
+    if previous != instance.content_id:
+        change_refs({instance.content_id: 1, previous: -1})
+
+
+@receiver(post_delete, sender=CarPhoto)
+def release_photo_content(sender, instance, **kwargs):
+    """Файл без ссылок удаляется после фиксации"""
+    change_refs({instance.content_id: -1})
+
+
+@receiver(post_save, sender=CarPhoto)
+def render_photo_renditions(sender, instance, update_fields=None, **kwargs):
+    """Варианты нового или замененного оригинала создаются в фоне"""
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if needs_renditions(instance):
+        photo_id = instance.pk
+        transaction.on_commit(lambda: render_photo_task.delay(photo_id))
+
+
+@receiver(post_save, sender=CarBrand)
+@receiver(post_delete, sender=CarBrand)
+@receiver(post_save, sender=CarModel)
+@receiver(post_delete, sender=CarModel)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def reset_filter_refs(sender, instance, **kwargs):
+    """Справочник slug -> id для фильтров собирается заново"""
+    invalidate_filter_refs()
+
+
+# ============================================================================
+# ИНДЕКС ad_search_index
+# ============================================================================
+
+@receiver(post_save, sender=CarAd)
+def refresh_ad_search_index(sender, instance, update_fields=None, **kwargs):
+    """Строка индекса пересчитывается после сохранения объявления"""
+    if update_fields is not None and set(update_fields) <= VIEW_COUNTER_FIELDS:
+        update_index_views(instance.pk, instance.views_count)
+        return
+    ad_id = instance.pk
+    transaction.on_commit(lambda: refresh_ad_index([ad_id]))
+
+
+@receiver(post_save, sender=CarPhoto)
+@receiver(post_delete, sender=CarPhoto)
+@receiver(post_save, sender=CarAdFeature)
+@receiver(post_delete, sender=CarAdFeature)
+def refresh_ad_index_related(sender, instance, **kwargs):
+    """Главное фото и характеристики хранятся в индексе"""
+    ad_id = instance.car_ad_id
+    transaction.on_commit(lambda: refresh_ad_index([ad_id]))
+
+
+@receiver(post_save, sender=CarBrand)
+def refresh_brand_ad_index(sender, instance, created, update_fields=None, **kwargs):
+    """Slug и название марки скопированы в строки индекса"""
+    if update_fields is not None and not {'slug', 'name'}.intersection(update_fields):
+        return
+    if not created:
+        refresh_ad_index_for(CarAd.objects.filter(model__brand_id=instance.pk))
+
+
+@receiver(post_save, sender=CarModel)
+def refresh_model_ad_index(sender, instance, created, update_fields=None, **kwargs):
+    """Slug, название и тип кузова модели скопированы в строки индекса"""
+    if update_fields is not None and not {'slug', 'name', 'body_type', 'brand', 'brand_id'}.intersection(update_fields):
+        return
+    if not created:
+        refresh_ad_index_for(CarAd.objects.filter(model_id=instance.pk))
+
+
+@receiver(post_save, sender=City)
+def refresh_city_ad_index(sender, instance, created, update_fields=None, **kwargs):
+    """Название и slug города скопированы в строки индекса"""
+    if update_fields is not None and not {'name', 'slug'}.intersection(update_fields):
+        return
+    if not created:
+        refresh_ad_index_for(CarAd.objects.filter(city_id=instance.pk))
+
+
+# ============================================================================
+# КЭШ СТРАНИЦ СПИСКА
+# ============================================================================
+
+@receiver(pre_save, sender=CarAd)
+def remember_listing_tags(sender, instance, update_fields=None, **kwargs):
+    """
+    Объявление до изменения (один запрос): марка, модель и город - чтобы
+    объявление ушло и со старых страниц, остальные поля - для счетчиков.
+    """
+    instance._previous_listing_tags = []
+    instance._previous_counted_state = None
+    if update_fields is not None and set(update_fields) <= VIEW_COUNTER_FIELDS:
+        return
+    state = stored_state(instance)
+    if state:
+        instance._previous_listing_tags = ad_tags(state['brand'], state['model'], state['city'])
+        instance._previous_counted_state = state
+
+
+@receiver(post_save, sender=CarAd)
+@receiver(post_delete, sender=CarAd)
+def reset_ad_listings(sender, instance, update_fields=None, **kwargs):
+    """
+    Страницы списка, на которые объявление попадало или попадет,
+    и все записи пространства имен ads (статистика, фасеты).
+    """
+    if update_fields is not None and set(update_fields) <= VIEW_COUNTER_FIELDS:
+        return
+    tags = ad_tags(instance.brand_id, instance.model_id, instance.city_id)
+    previous = getattr(instance, '_previous_listing_tags', [])
+    transaction.on_commit(lambda: invalidate_listings(tags, previous))
+
+
+@receiver(post_save, sender=CarPhoto)
+@receiver(post_delete, sender=CarPhoto)
+def reset_photo_listings(sender, instance, **kwargs):
+    """Главное фото показывается в карточке"""
+    row = CarAd.objects.filter(pk=instance.car_ad_id).values_list('brand_id', 'model_id', 'city_id').first()
+    if row:
+        tags = ad_tags(*row)
+        transaction.on_commit(lambda: invalidate_listings(tags))
+
+
+@receiver(post_save, sender=CarBrand)
+@receiver(post_delete, sender=CarBrand)
+@receiver(post_save, sender=CarModel)
+@receiver(post_delete, sender=CarModel)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def reset_catalog_listings(sender, instance, **kwargs):
+    """Пространство имен catalog: страницы списка и статистика каталога"""
+    transaction.on_commit(lambda: invalidate_listings([CATALOG_TAG]))
+
+
+# ============================================================================
+# СЧЕТЧИКИ САЙТА
+# ============================================================================
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=CarBrand)
+@receiver(pre_save, sender=CarModel)
+def remember_counted_state(sender, instance, update_fields=None, **kwargs):
+    """Учитываемые поля до изменения (для объявлений - в remember_listing_tags)"""
+    instance._previous_counted_state = None
+    if affects_counters(sender, update_fields):
+        instance._previous_counted_state = stored_state(instance)
+
+
+@receiver(post_save, sender=CarAd)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=CarBrand)
+@receiver(post_save, sender=CarModel)
+def update_site_counters(sender, instance, update_fields=None, **kwargs):
+    """Разница вклада записи до и после сохранения"""
+    if not affects_counters(sender, update_fields):
+        return
+    previous = getattr(instance, '_previous_counted_state', None)
+    add_counts(count_changes(sender, previous, current_state(instance)))
+
+
+@receiver(post_delete, sender=CarAd)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=CarBrand)
+@receiver(post_delete, sender=CarModel)
+def remove_from_site_counters(sender, instance, **kwargs):
+    """Вклад удаленной записи вычитается в транзакции удаления"""
+    add_counts(count_changes(sender, current_state(instance), None))
@@ -0,0 +1,226 @@
+# apps/advertisements/similarity.py
+"""
+Похожие объявления: k ближайших соседей по характеристикам.
+
+Признаки берутся из плоской таблицы ad_search_index одним запросом:
+цена и пробег (в логарифме), год, мощность - нормализуются (z-score);
+марка, тип кузова и регион сравниваются на равенство. Расстояния для
+пакета объявлений считаются векторно в NumPy:
+
+    d² = |q|² + |x|² - 2·q·x  +  Σ w² · [категория отличается]
+
+Результат хранится в таблице ad_similar (SimilarAd) и пересчитывается
+инкрементально: для объявлений, чья строка индекса изменилась позже
+расчета, и для объявлений, у которых в списке есть измененные или снятые.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+
+from .models import AdSearchIndex, CarAd, SimilarAd
+from .search_index import load_ads
+
+SIMILAR_ADS_COUNT = 12
+DEFAULT_BATCH_SIZE = 256
+
+# Веса числовых признаков (после нормализации)
+NUMERIC_WEIGHTS = {
+    'price': 1.5,
+    'year': 1.0,
+    'mileage': 1.0,
+    'engine_power': 0.75,
+}
+
+# Штраф за различие категории (вклад в d² равен весу в квадрате)
+CATEGORY_WEIGHTS = {
+    'brand_id': 2.0,
+    'body_type': 1.0,
+    'region': 0.5,
+}
+
+
+@dataclass
+class AdVectors:
+    """Признаки активных объявлений"""
+    ids: np.ndarray
+    numeric: np.ndarray
+    norms: np.ndarray
+    categories: dict
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _normalize(column):
+    """z-score; пропуски заменяются медианой"""
+    missing = np.isnan(column)
+    if missing.all():
+        return np.zeros_like(column)
+    if missing.any():
+        column = np.where(missing, np.nanmedian(column), column)
+    std = column.std()
+    return (column - column.mean()) / (std if std > 0 else 1.0)
+
+
+def _codes(values):
+    """Категории -> целочисленные коды (пустое значение получает свой код)"""
+    _, codes = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int32)
+
+
+def load_vectors():
+    """Признаки всех объявлений индекса (один запрос)"""
+    rows = list(
+        AdSearchIndex.objects.order_by('ad_id').values_list(
+            'ad_id', 'price', 'year', 'mileage', 'engine_power', *CATEGORY_WEIGHTS
+        )
+    )
+    if not rows:
+        empty = np.zeros((0, len(NUMERIC_WEIGHTS)), dtype=np.float32)
+        return AdVectors(np.zeros(0, dtype=np.int64), empty, np.zeros(0, dtype=np.float32), {})
+
+    columns = list(zip(*rows))
+    ids = np.array(columns[0], dtype=np.int64)
+
+    raw = {
+        'price': np.log1p(np.array(columns[1], dtype=np.float64)),
+        'year': np.array(columns[2], dtype=np.float64),
+        'mileage': np.log1p(np.array(columns[3], dtype=np.float64)),
+        'engine_power': np.array(
+            [np.nan if value is None else value for value in columns[4]], dtype=np.float64
+        ),
+    }
+    numeric = np.column_stack([
+        _normalize(raw[name]) * weight for name, weight in NUMERIC_WEIGHTS.items()
+    ]).astype(np.float32)
+
+    categories = {
+        name: _codes(columns[5 + position]) for position, name in enumerate(CATEGORY_WEIGHTS)
+    }
+    return AdVectors(ids, numeric, np.einsum('ij,ij->i', numeric, numeric), categories)
+
+
+def nearest_neighbors(vectors, rows, k=SIMILAR_ADS_COUNT):
+    """
+    k ближайших соседей для строк rows (индексы в vectors).
+
+    Возвращает (индексы соседей, расстояния), оба формы (len(rows), k'),
+    k' = min(k, len(vectors) - 1). Само объявление в соседи не попадает.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    k = min(k, len(vectors) - 1)
+    if k <= 0 or not len(rows):
+        return np.zeros((len(rows), 0), dtype=np.int64), np.zeros((len(rows), 0), dtype=np.float32)
+
+    query = vectors.numeric[rows]
+    distances = vectors.norms[rows][:, None] + vectors.norms[None, :] - 2 * (query @ vectors.numeric.T)
+    for name, weight in CATEGORY_WEIGHTS.items():
+        codes = vectors.categories[name]
+        distances += np.float32(weight ** 2) * (codes[rows][:, None] != codes[None, :])
+
+    np.maximum(distances, 0, out=distances)
+    distances[np.arange(len(rows)), rows] = np.inf
+
+    # argpartition - O(N) на строку, сортируем только k лучших
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1, kind='stable')
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    return nearest, np.sqrt(np.take_along_axis(nearest_distances, order, axis=1))
+
+
+def _store(vectors, rows, nearest, distances):
+    ad_ids = vectors.ids[rows].tolist()
+    links = [
+        SimilarAd(ad_id=ad_id, similar_id=int(vectors.ids[neighbor]), rank=rank, distance=float(distance))
+        for ad_id, neighbors, row_distances in zip(ad_ids, nearest, distances)
+        for rank, (neighbor, distance) in enumerate(zip(neighbors, row_distances), start=1)
+    ]
+    with transaction.atomic():
+        SimilarAd.objects.filter(ad_id__in=ad_ids).delete()
+        SimilarAd.objects.bulk_create(links)
+    return len(ad_ids)
+
+
+def refresh_similar_ads(ad_ids=None, k=SIMILAR_ADS_COUNT, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Пересчитать соседей для ad_ids (None - для всех активных объявлений).
+
+    Списки неактивных объявлений удаляются.
+    """
+    # Снятые с публикации объявления списков не имеют
+    SimilarAd.objects.exclude(ad_id__in=AdSearchIndex.objects.values('ad_id')).delete()
+
+    vectors = load_vectors()
+    if ad_ids is None:
+        rows = np.arange(len(vectors))
+    else:
+        rows = np.flatnonzero(np.isin(vectors.ids, np.fromiter(ad_ids, dtype=np.int64)))
+
+    updated = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        nearest, distances = nearest_neighbors(vectors, batch, k)
+        updated += _store(vectors, batch, nearest, distances)
+        if progress:
+            progress(updated, len(rows))
+    return updated
+
+
+def stale_ad_ids():
+    """
+    Объявления, чьи списки устарели.
+
+    Строка индекса обновлена позже расчета (или расчета не было), либо
+    в списке есть объявление, которое изменилось или снято с публикации.
+    """
+    computed_at = SimilarAd.objects.filter(ad_id=OuterRef('ad_id')).values('computed_at')[:1]
+    changed = set(
+        AdSearchIndex.objects.annotate(
+            similar_computed_at=Subquery(computed_at)
+        ).filter(
+            Q(similar_computed_at__isnull=True) | Q(indexed_at__gt=F('similar_computed_at'))
+        ).values_list('ad_id', flat=True)
+    )
+
+    removed = SimilarAd.objects.exclude(similar_id__in=AdSearchIndex.objects.values('ad_id'))
+    dependent = SimilarAd.objects.filter(
+        Q(similar_id__in=changed) | Q(pk__in=removed.values('pk'))
+    ).values_list('ad_id', flat=True)
+    return changed | set(dependent)
+
+
+def refresh_stale_similar_ads(k=SIMILAR_ADS_COUNT, batch_size=DEFAULT_BATCH_SIZE):
+    """Инкрементальный пересчет (для периодической задачи)"""
+    ad_ids = stale_ad_ids()
+    if not ad_ids:
+        return 0
+    return refresh_similar_ads(ad_ids, k=k, batch_size=batch_size)
+
+
+def similar_ads_for(ad, limit=6):
+    """
+    Похожие активные объявления из таблицы ad_similar (один запрос).
+
+    У объявлений выставлен main_photo_url из индекса. Пока список
+    не рассчитан (новое объявление), отдаются свежие объявления той же марки.
+    """
+    ads = list(
+        CarAd.objects.filter(
+            similar_to__ad_id=ad.pk,
+            search_index__isnull=False,
+        ).select_related(
+            'model__brand', 'city', 'search_index'
+        ).order_by('similar_to__rank')[:limit]
+    )
+    for similar_ad in ads:
+        similar_ad.main_photo_url = similar_ad.search_index.main_photo_url
+    if ads or not ad.brand_id:
+        return ads
+
+    latest = AdSearchIndex.objects.filter(
+        brand_id=ad.brand_id
+    ).exclude(ad_id=ad.pk).order_by('-created_at')[:limit]
+    return load_ads(latest)
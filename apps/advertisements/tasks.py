@@ -0,0 +1,38 @@
+# apps/advertisements/tasks.py
+from celery import shared_task
+
+from .autocomplete import rebuild_suggestions
+from .counters import reconcile_counters
+from .photo_renditions import render_photo
+from .similarity import refresh_stale_similar_ads
+from .view_counters import flush_view_counters
+
+
+@shared_task(ignore_result=True)
+def refresh_similar_ads_task():
+    """Пересчет похожих объявлений для измененных объявлений"""
+    return refresh_stale_similar_ads()
+
+
+@shared_task(ignore_result=True)
+def flush_view_counters_task():
+    """Перенос накопленных в Redis просмотров в БД"""
+    return flush_view_counters()
+
+
+@shared_task(ignore_result=True)
+def reconcile_counters_task():
+    """Исправление расхождений счетчиков сайта с таблицами"""
+    return len(reconcile_counters())
+
+
+@shared_task(ignore_result=True)
+def rebuild_suggestions_task():
+    """Перестройка подсказок автодополнения: популярные запросы и веса марок и моделей"""
+    return rebuild_suggestions()
+
+
+@shared_task(ignore_result=True)
+def render_photo_task(photo_id):
+    """Варианты фотографии разных размеров в WebP и JPEG"""
+    return render_photo(photo_id)
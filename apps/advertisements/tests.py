@@ -1,6 +1,60 @@
 # tests\tests.py
-from django.test import TestCase
+import io
+import json
+import os
+import pickle
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from contextlib import nullcontext
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DataError, OperationalError, connection
+from django.db.models import Q
+from django.http import Http404, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.safestring import SafeString, mark_safe
+
+from apps.advertisements import autocomplete, counters, photo_storage
+from apps.analytics import events
+from apps.analytics.models import SearchAnalytics
+from apps.advertisements.counters import count_changes, get_counts, reconcile_counters
+from apps.advertisements.facets import RANGE_FACETS, TERMS_FACETS, build_facets
+from apps.advertisements.filters import (
+    AD_COLUMNS, FilterRefs, canonical_params, normalize_filters, parse_listing_filters
+)
+from apps.advertisements.listing_cache import (
+    ad_tags, get_listing, invalidate_listings, listing_tags, release_listing, store_listing
+)
+from apps.advertisements.models import AdSearchIndex, CarAd, CarPhoto, City, PhotoFile
+from apps.advertisements.photo_ingestion import MAX_DIMENSION, PhotoRejected, ingest_photos, normalize_image
+from apps.advertisements.photo_renditions import RENDITION_SIZES, render_image
+from apps.advertisements.photo_storage import hamming_distance, perceptual_hash, phash_bands
+from apps.advertisements.search_index import rebuild_ad_index
+from apps.advertisements.similarity import AdVectors, nearest_neighbors
+from apps.advertisements.views import AdvertisementsListView
+from apps.catalog.views import StatsAPIView
+from apps.catalog.models import CarBrand, CarModel
+from apps.users.models import User
+from apps.advertisements.search import build_raw_tsquery, build_search_query
+from apps.core.counting import CountingPaginator, ResultCount
+from apps.core.home_snapshot import refresh_home_snapshot
+from apps.core.views import HomePageView
+from apps.core.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_ordering
+from apps.core import cache_serializer, image_resize, media_serving, tagged_cache
+from apps.core.views import resized_image
+from apps.core.local_cache import LocalCache
+from apps.core.tagged_cache import ADS, CATALOG, bump_tags, cached, get_or_compute, local_cache
+from api.views import AdSearchPagination, AdViewSet
+from rest_framework.request import Request
+from PIL import Image, ImageDraw
 
 
 class CarAdListViewTest(TestCase):
@@ -41,4 +95,961 @@ class CarAdListViewTest(TestCase):
 
         response = self.client.get(reverse('core:ad_list'))
         self.assertTrue('is_paginated' in response.context)
-        self.assertTrue(response.context['is_paginated'])
\ No newline at end of file
+        self.assertTrue(response.context['is_paginated'])
+
+
+class SearchQueryBuilderTest(SimpleTestCase):
+    def test_empty_query(self):
+        self.assertIsNone(build_search_query(''))
+        self.assertIsNone(build_search_query('  !! '))
+
+    def test_prefix_terms(self):
+        self.assertEqual(build_raw_tsquery('Toyota  Camry!'), 'toyota:* & camry:*')
+
+    def test_operators_are_stripped(self):
+        self.assertEqual(
+            build_raw_tsquery("bmw | x5 & (m'sport)"),
+            'bmw:* & x5:* & m:* & sport:*'
+        )
+
+
+class KeysetCursorTest(SimpleTestCase):
+    def test_ordering_gets_id_tiebreaker(self):
+        self.assertEqual(keyset_ordering(CarAd.objects.order_by('price')), ['price', 'id'])
+        self.assertEqual(keyset_ordering(CarAd.objects.all()), ['-created_at', '-id'])
+
+    def test_random_ordering_is_not_keyset(self):
+        self.assertIsNone(keyset_ordering(CarAd.objects.order_by('?')))
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        ad = CarAd(id=42, price=1500000, created_at=created_at)
+        token = encode_cursor(['-created_at', '-id'], ad, reverse=True)
+
+        ordering, values, reverse = decode_cursor(token, CarAd)
+        self.assertEqual(ordering, ['-created_at', '-id'])
+        self.assertEqual(values, [created_at, 42])
+        self.assertTrue(reverse)
+
+    def test_broken_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor', CarAd)
+
+
+class AdSearchPaginationTest(SimpleTestCase):
+    def _response(self, query):
+        paginator = AdSearchPagination()
+        request = Request(RequestFactory().get(f'/api/search/?{query}'))
+        with mock.patch('apps.core.pagination.keyset_ordering', return_value=None):
+            results = paginator.paginate_queryset(list(range(45)), request)
+        return paginator.get_paginated_response(results).data
+
+    def test_keeps_legacy_keys(self):
+        data = self._response('page=2&page_size=20')
+        self.assertEqual(data['count'], 45)
+        self.assertIs(data['next'], True)
+        self.assertIs(data['previous'], True)
+        self.assertEqual(data['page'], 2)
+        self.assertEqual(data['page_size'], 20)
+        self.assertIn('page=3', data['next_url'])
+        self.assertEqual(data['results'], list(range(20, 40)))
+
+    def test_last_page(self):
+        data = self._response('page=3')
+        self.assertIs(data['next'], False)
+        self.assertIsNone(data['next_url'])
+
+
+class ResultCountTest(SimpleTestCase):
+    def test_display(self):
+        self.assertEqual(str(ResultCount(1234)), '1 234')
+        self.assertEqual(str(ResultCount(10000, approximate=True)), '10 000+')
+        self.assertEqual(str(ResultCount(154321, approximate=True)), '150 000+')
+
+    def test_behaves_like_int(self):
+        count = ResultCount(154321, approximate=True)
+        self.assertEqual(count + 1, 154322)
+        restored = pickle.loads(pickle.dumps(count))
+        self.assertEqual(restored, count)
+        self.assertTrue(restored.approximate)
+
+    def test_paginator_over_list(self):
+        paginator = CountingPaginator(list(range(45)), 20)
+        self.assertEqual(paginator.count, 45)
+        self.assertEqual(paginator.num_pages, 3)
+        self.assertFalse(paginator.count_is_approximate)
+
+
+class NearestNeighborsTest(SimpleTestCase):
+    def _vectors(self, numeric, brands):
+        numeric = np.array(numeric, dtype=np.float32)
+        codes = np.zeros(len(numeric), dtype=np.int32)
+        return AdVectors(
+            ids=np.arange(100, 100 + len(numeric)),
+            numeric=numeric,
+            norms=(numeric ** 2).sum(axis=1),
+            categories={'brand_id': np.array(brands, dtype=np.int32), 'body_type': codes, 'region': codes},
+        )
+
+    def test_neighbors_are_sorted_and_exclude_self(self):
+        vectors = self._vectors([[0, 0], [1, 0], [5, 0], [2, 0]], [0, 0, 0, 0])
+        nearest, distances = nearest_neighbors(vectors, [0, 2], k=2)
+        self.assertEqual(nearest.tolist(), [[1, 3], [3, 1]])
+        self.assertAlmostEqual(float(distances[0][0]), 1.0, places=5)
+
+    def test_other_brand_is_penalized(self):
+        vectors = self._vectors([[0, 0], [0.5, 0], [1, 0]], [0, 1, 0])
+        nearest, _ = nearest_neighbors(vectors, [0], k=1)
+        self.assertEqual(nearest.tolist(), [[2]])
+
+    def test_k_is_limited_by_dataset(self):
+        vectors = self._vectors([[0, 0], [1, 0]], [0, 0])
+        nearest, _ = nearest_neighbors(vectors, [0, 1], k=12)
+        self.assertEqual(nearest.tolist(), [[1], [0]])
+
+
+class ListingFiltersTest(SimpleTestCase):
+    refs = FilterRefs(
+        brands={'toyota': 1, 'bmw': 2},
+        models={'camry': (10, 1), 10: 1, 'x5': (20, 2), 20: 2, '911': (30, 3), 30: 3, 911: 2},
+        cities={'moskva': 5, 'москва': 5},
+    )
+
+    def _filters(self, query):
+        return parse_listing_filters(QueryDict(query), refs=self.refs)
+
+    def test_invalid_values_are_ignored(self):
+        filters = self._filters('min_price=abc&max_year=3000&doors=0&fuel_type=all&fuel_type=coal')
+        self.assertEqual(filters.facets, {})
+
+    def test_model_implies_brand(self):
+        filters = self._filters('model=camry')
+        self.assertEqual(filters.key.as_dict(), {'brand': 1, 'model': 10})
+
+        filters = self._filters('brand=toyota&model=camry&min_price=100')
+        self.assertEqual(set(filters.facets), {'brand', 'model', 'price'})
+        self.assertNotIn('brand', str(filters.facet_q(exclude='brand')))
+
+    def test_model_of_another_brand_is_dropped(self):
+        filters = self._filters('brand=bmw&model=camry')
+        self.assertEqual(filters.key.as_dict(), {'brand': 2})
+
+    def test_equivalent_queries_share_key(self):
+        variants = [
+            'brand=toyota&model=camry&min_price=500000&city=moskva&q=Camry++XV70',
+            'model_id=10&city_id=5&min_price=500000&max_year=2100&search=camry xv70',
+            'brand_id=1&model=10&city=Москва&min_price=500000&fuel_type=all&has_tuning=false&q=CAMRY%20xv70',
+        ]
+        keys = {normalize_filters(QueryDict(query), refs=self.refs) for query in variants}
+        self.assertEqual(len(keys), 1)
+
+    def test_numeric_slug_is_not_an_id(self):
+        # slug модели 911 важнее модели с id 911
+        self.assertEqual(self._filters('model=911').key.as_dict(), {'brand': 3, 'model': 30})
+        self.assertEqual(self._filters('model_id=911').key.as_dict(), {'brand': 2, 'model': 911})
+
+        key = normalize_filters(QueryDict('model_id=911'), refs=self.refs)
+        params = QueryDict(mutable=True)
+        params.update(canonical_params(key))
+        self.assertEqual(normalize_filters(params, refs=self.refs), key)
+
+    def test_unknown_slug_filters_by_slug(self):
+        filters = self._filters('brand=lada')
+        self.assertEqual(str(filters.facets['brand']), str(Q(brand_slug='lada')))
+
+    def test_ad_columns(self):
+        filters = parse_listing_filters(QueryDict('brand=lada&body_type=sedan'), refs=self.refs, columns=AD_COLUMNS)
+        self.assertEqual(str(filters.facets['brand']), str(Q(brand__slug='lada')))
+        self.assertEqual(str(filters.facets['body_type']), str(Q(model__body_type='sedan')))
+
+    def test_canonical_params_round_trip(self):
+        key = normalize_filters(
+            QueryDict('model=camry&min_engine_volume=1.6&max_price=900000&has_tuning=on&q=Camry++XV70'),
+            refs=self.refs
+        )
+        params = QueryDict(mutable=True)
+        params.update(canonical_params(key))
+        self.assertEqual(normalize_filters(params, refs=self.refs), key)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ListingCacheTest(SimpleTestCase):
+    refs = ListingFiltersTest.refs
+
+    def setUp(self):
+        local_cache.clear()
+
+    def _tags(self, query):
+        return listing_tags(parse_listing_filters(QueryDict(query), refs=self.refs))
+
+    def test_tags_follow_filters(self):
+        self.assertEqual(self._tags('min_price=100'), ['catalog', 'ads'])
+        self.assertEqual(
+            self._tags('brand=toyota&model=camry&city=moskva'), ['catalog', 'model:10', 'city:5', 'brand:1']
+        )
+        # Фасет марок на странице марки считает объявления всех марок
+        self.assertEqual(self._tags('brand=toyota'), ['catalog', 'brand:1', 'ads'])
+
+    def test_only_affected_pages_are_invalidated(self):
+        toyota, bmw = self._tags('brand=toyota&city=moskva'), self._tags('brand=bmw&city=moskva')
+        for key, tags in (('toyota', toyota), ('bmw', bmw)):
+            _, versions, _ = get_listing(key, tags)
+            store_listing(key, versions, key, [])
+            release_listing(key)
+
+        invalidate_listings(ad_tags(2, 20, 6))
+
+        self.assertEqual(get_listing('toyota', toyota)[0]['html'], 'toyota')
+        listing, _, locked = get_listing('bmw', bmw)
+        self.assertIsNone(listing)
+        self.assertTrue(locked)
+        # Пока первый запрос рендерит страницу, остальные получают устаревшую
+        listing, _, locked = get_listing('bmw', bmw)
+        self.assertEqual(listing['html'], 'bmw')
+        self.assertFalse(locked)
+
+    def test_namespace_bump_recomputes_value(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'total_ads': len(calls)}
+
+        get_or_compute('stats', [ADS, CATALOG], compute)
+        get_or_compute('stats', [ADS, CATALOG], compute)
+        bump_tags([CATALOG])
+        self.assertEqual(get_or_compute('stats', [ADS, CATALOG], compute), {'total_ads': 2})
+
+    def test_local_cache_is_evicted_by_bump(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        get_or_compute('facets', [ADS], compute, metric='ad_facets')
+        self.assertEqual(local_cache.get('facets'), 1)
+
+        bump_tags([ADS])
+        self.assertIsNone(local_cache.get('facets'))
+        self.assertEqual(get_or_compute('facets', [ADS], compute, metric='ad_facets'), 2)
+
+    def test_local_cache_sees_bump_in_other_process(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        get_or_compute('facets:remote', [ADS], compute, metric='ad_facets')
+        # bump_tags в другом процессе: поколение в Redis меняется, L1 этого процесса - нет
+        tagged_cache.cache.incr(tagged_cache._version_key(ADS))
+        self.assertEqual(local_cache.get('facets:remote'), 1)
+        self.assertEqual(get_or_compute('facets:remote', [ADS], compute, metric='ad_facets'), 2)
+
+    def test_local_cache_checks_versions_once_per_request(self):
+        self.addCleanup(tagged_cache._finish_request)
+        tagged_cache._start_request()
+        get_or_compute('facets:l1', [ADS], lambda: 1, metric='ad_facets')
+        get_or_compute('stats:l1', [CATALOG], lambda: 2, metric='catalog_stats')
+
+        tagged_cache._start_request()
+        with mock.patch.object(tagged_cache.cache, 'get_many', wraps=tagged_cache.cache.get_many) as get_many, \
+                mock.patch.object(tagged_cache, '_record') as record:
+            self.assertEqual(get_or_compute('facets:l1', [ADS], lambda: 3, metric='ad_facets'), 1)
+            self.assertEqual(get_or_compute('stats:l1', [CATALOG], lambda: 4, metric='catalog_stats'), 2)
+        get_many.assert_called_once()
+        self.assertEqual(record.call_args_list, [mock.call('ad_facets', 'l1_hit'), mock.call('catalog_stats', 'l1_hit')])
+
+    def test_catalog_stats_use_local_cache(self):
+        calls = []
+
+        @cached('catalog_stats', [CATALOG])
+        def stats():
+            calls.append(1)
+            return {'total_brands': len(calls)}
+
+        stats()
+        with mock.patch.object(tagged_cache, '_record') as record:
+            self.assertEqual(stats(), {'total_brands': 1})
+        record.assert_called_once_with('catalog_stats', 'l1_hit')
+
+        # Представление читает статистику из памяти процесса, без запросов к БД
+        with mock.patch.object(tagged_cache, '_record') as record:
+            self.assertEqual(StatsAPIView().get_stats(), {'total_brands': 1})
+        record.assert_called_once_with('catalog_stats', 'l1_hit')
+
+    def test_local_cache_is_bounded(self):
+        lru = LocalCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+
+class CacheSerializerTest(SimpleTestCase):
+    def test_plain_values_use_msgpack(self):
+        value = {
+            'versions': {'ads': 1700000000000000000},
+            'value': (['brand_key', 'price_min'], [[1, Decimal('1.6')], [None, None]]),
+            'html': mark_safe('<div>'),
+            'created': timezone.now(),
+        }
+        data = cache_serializer.dumps(value)
+        self.assertEqual(data[:1], cache_serializer.MSGPACK_MARKER)
+
+        restored = cache_serializer.loads(data)
+        self.assertEqual(restored, value)
+        self.assertIsInstance(restored['value'], tuple)
+        self.assertIsInstance(restored['html'], SafeString)
+
+    def test_other_values_fall_back_to_pickle(self):
+        count = ResultCount(15000, approximate=True)
+        restored = cache_serializer.loads(cache_serializer.dumps({'value': count}))
+        self.assertTrue(restored['value'].approximate)
+        # Значения, записанные до перехода на msgpack
+        self.assertEqual(cache_serializer.loads(pickle.dumps([1, 2])), [1, 2])
+
+
+class PhotoRenditionsTest(SimpleTestCase):
+    def _jpeg(self, size, orientation=None):
+        image = Image.new('RGB', size, (200, 30, 30))
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def test_sizes_and_formats(self):
+        rendered = render_image(self._jpeg((3000, 2000)))
+        self.assertEqual(set(rendered), set(RENDITION_SIZES))
+        self.assertEqual((rendered['card']['width'], rendered['card']['height']), (480, 320))
+        self.assertEqual(Image.open(io.BytesIO(rendered['gallery']['webp'])).format, 'WEBP')
+        self.assertEqual(Image.open(io.BytesIO(rendered['gallery']['jpeg'])).format, 'JPEG')
+
+    def test_exif_orientation_applied_without_upscaling(self):
+        # Orientation 6: снимок повернут на 90 градусов
+        rendered = render_image(self._jpeg((800, 600), orientation=6))
+        self.assertEqual((rendered['retina']['width'], rendered['retina']['height']), (600, 800))
+        self.assertEqual((rendered['card']['width'], rendered['card']['height']), (270, 360))
+        jpeg = Image.open(io.BytesIO(rendered['card']['jpeg']))
+        self.assertNotIn(0x0112, jpeg.getexif())
+
+
+class NormalizeImageTest(SimpleTestCase):
+    def test_strips_exif_and_limits_size(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        Image.new('RGB', (MAX_DIMENSION * 2, 1000)).save(buffer, format='JPEG', exif=exif)
+
+        image = Image.open(io.BytesIO(normalize_image(buffer.getvalue())))
+        # Повернуто по EXIF и вписано в MAX_DIMENSION
+        self.assertEqual(image.size, (500, MAX_DIMENSION))
+        self.assertEqual(dict(image.getexif()), {})
+
+    def test_rejects_non_images(self):
+        with self.assertRaises(PhotoRejected):
+            normalize_image(b'not an image')
+
+
+class PhotoIngestionTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        brand = CarBrand.objects.create(name="Photo Brand")
+        model = CarModel.objects.create(brand=brand, name="Photo Model")
+        owner = User.objects.create_user(username='photo_owner', password='x')
+        self.ad = CarAd.objects.create(title="Photo Ad", model=model, owner=owner, price=1000000, year=2020)
+
+    def _upload(self, name):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480)).save(buffer, format='PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_bulk_ingest_sets_one_main_photo_and_positions(self):
+        first = ingest_photos(self.ad, [self._upload('a.png'), SimpleUploadedFile('b.png', b'junk')])
+        self.assertEqual([name for name, _ in first.rejected], ['b.png'])
+
+        second = ingest_photos(self.ad, [self._upload('c.png'), self._upload('d.png')])
+        photos = list(self.ad.photos.order_by('position').values_list('position', 'is_main'))
+        self.assertEqual(photos, [(0, True), (2, False), (3, False)])
+        self.assertTrue(all(photo.image.name.endswith('.jpg') for photo in second.photos))
+
+    def test_same_file_is_stored_once(self):
+        other_ad = CarAd.objects.create(
+            title="Photo Ad 2", model=self.ad.model, owner=self.ad.owner, price=1000000, year=2020
+        )
+        ingest_photos(self.ad, [self._upload('a.png')])
+        ingest_photos(other_ad, [self._upload('copy.png')])
+
+        photo_file = PhotoFile.objects.get()
+        self.assertEqual(photo_file.ref_count, 2)
+        self.assertEqual(set(CarPhoto.objects.values_list('image', flat=True)), {photo_file.name})
+
+        self.ad.photos.get().delete()
+        photo_file.refresh_from_db()
+        self.assertEqual(photo_file.ref_count, 1)
+        other_ad.photos.get().delete()
+        self.assertFalse(PhotoFile.objects.exists())
+
+    def test_plan_limit(self):
+        with mock.patch('apps.advertisements.photo_ingestion.DEFAULT_MAX_PHOTOS', 2):
+            result = ingest_photos(self.ad, [self._upload(f'{i}.png') for i in range(3)])
+        self.assertEqual((len(result.photos), result.over_limit), (2, 1))
+
+
+class PerceptualHashTest(SimpleTestCase):
+    def _picture(self, size, format, mirror=False):
+        image = Image.new('RGB', (1200, 900), (240, 240, 240))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((100, 150, 500, 700), fill=(30, 30, 120))
+        draw.ellipse((650, 100, 1100, 550), fill=(200, 40, 40))
+        if mirror:
+            image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        buffer = io.BytesIO()
+        image.resize(size).save(buffer, format=format, quality=60)
+        return buffer.getvalue()
+
+    def test_resized_copy_is_near_duplicate(self):
+        original = perceptual_hash(self._picture((1200, 900), 'JPEG'))
+        copy = perceptual_hash(self._picture((400, 300), 'PNG'))
+        other = perceptual_hash(self._picture((1200, 900), 'JPEG', mirror=True))
+        self.assertLessEqual(hamming_distance(original, copy), 3)
+        self.assertGreater(hamming_distance(original, other), 3)
+
+    def test_close_hashes_share_a_band(self):
+        value = perceptual_hash(self._picture((300, 200), 'PNG'))
+        close = value ^ (1 | 1 << 20 | 1 << 40)
+        self.assertTrue(set(enumerate(phash_bands(value))) & set(enumerate(phash_bands(close))))
+        self.assertIsNone(perceptual_hash(b'not an image'))
+
+
+class ContentStorageTest(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.storage = FileSystemStorage(location=media.name)
+        for patcher in (
+            mock.patch.object(photo_storage, '_storage', return_value=self.storage),
+            mock.patch.object(photo_storage, '_lock_contents'),
+            mock.patch.object(photo_storage.transaction, 'atomic', nullcontext),
+            mock.patch.object(PhotoFile, 'objects'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_file_deleted_before_registration_is_restored(self):
+        content = photo_storage.store_content(b'photo')
+        found = photo_storage.store_content(b'photo')
+        self.assertTrue(content.created)
+        self.assertFalse(found.created)
+
+        # Параллельный delete_files успел удалить найденный файл
+        self.storage.delete(found.name)
+        photo_storage.register_contents([found])
+
+        photo_storage._lock_contents.assert_called_once()
+        with self.storage.open(found.name) as file:
+            self.assertEqual(file.read(), b'photo')
+
+
+class ImageResizeTest(SimpleTestCase):
+    path = 'cars/photos/1/1_000.jpg'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+        os.makedirs(os.path.join(media.name, 'cars', 'photos', '1'))
+        Image.new('RGB', (1000, 500)).save(os.path.join(media.name, self.path), format='JPEG')
+
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(image_resize, 'RESIZE_CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cached_files(self):
+        return [name for _, _, files in os.walk(self.cache_dir) for name in files]
+
+    def test_copy_is_rendered_once(self):
+        signature = image_resize._signature(self.path, 320, 0)
+        target = image_resize.get_resized(self.path, 320, 0, signature)
+        self.assertEqual(Image.open(target).size, (320, 160))
+        self.assertEqual(image_resize.get_resized(self.path, 320, 0, signature), target)
+        self.assertEqual(len(self._cached_files()), 1)
+
+    def test_view_serves_copy_with_long_cache(self):
+        signature = image_resize._signature(self.path, 0, 100)
+        request = RequestFactory().get('/', {'s': signature})
+        request.user = AnonymousUser()
+        with mock.patch('apps.core.views.media_access', return_value='public'):
+            response = resized_image(request, width=0, height=100, path=self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (200, 100))
+
+        # Поврежденный оригинал - 404, а не 500
+        with open(os.path.join(settings.MEDIA_ROOT, self.path), 'wb') as source:
+            source.write(b'\xff\xd8\xff\xe0 truncated')
+        os.utime(os.path.join(settings.MEDIA_ROOT, self.path), (1, 1))
+        request = RequestFactory().get('/', {'s': signature})
+        request.user = AnonymousUser()
+        with mock.patch('apps.core.views.media_access', return_value='public'):
+            with self.assertRaises(Http404):
+                resized_image(request, width=0, height=100, path=self.path)
+
+        # Фото неопубликованного объявления - недоступно и в уменьшенном виде
+        with mock.patch('apps.core.views.media_access', return_value=None):
+            with self.assertRaises(Http404):
+                resized_image(request, width=0, height=100, path=self.path)
+
+    def test_rejects_unsigned_and_foreign_paths(self):
+        with self.assertRaises(image_resize.InvalidResize):
+            image_resize.get_resized(self.path, 320, 0, 'forged')
+        for path in ('cars/photos/../../settings.jpg', 'documents/passport.jpg'):
+            with self.assertRaises(image_resize.InvalidResize):
+                image_resize.get_resized(path, 320, 0, image_resize._signature(path, 320, 0))
+        self.assertEqual(self._cached_files(), [])
+
+
+class AnalyticsEventsTest(SimpleTestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(events.transaction, 'atomic', nullcontext),
+            mock.patch.object(SearchAnalytics, 'objects'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_long_values_are_truncated(self):
+        fields = events._fit(SearchAnalytics, {'user_id': 1, 'query': 'x' * 1000})
+        self.assertEqual(len(fields['query']), 200)
+
+    def test_bad_row_does_not_block_batch(self):
+        SearchAnalytics.objects.bulk_create.side_effect = DataError
+        SearchAnalytics.objects.create.side_effect = [None, DataError('bad'), None]
+        rows = [{'query': 'a'}, {'query': 'b'}, {'query': 'c'}]
+        self.assertEqual(events._insert(SearchAnalytics, rows), (2, 1))
+
+    def test_connection_errors_are_retried(self):
+        SearchAnalytics.objects.bulk_create.side_effect = OperationalError
+        with self.assertRaises(OperationalError):
+            events._insert(SearchAnalytics, [{'query': 'a'}])
+
+    def test_event_time_is_taken_at_tracking(self):
+        redis = mock.Mock()
+        redis.rpush.return_value = 1
+        tracked_at = (timezone.now() - timedelta(minutes=5)).replace(microsecond=0)
+        with mock.patch.object(events, '_redis', return_value=redis), \
+                mock.patch.object(events.timezone, 'now', return_value=tracked_at):
+            events.track_event('search', query='camry')
+        raw = redis.rpush.call_args.args[1]
+
+        events._write([raw])
+        row = SearchAnalytics.objects.bulk_create.call_args.args[0][0]
+        field = SearchAnalytics._meta.get_field('searched_at')
+        # bulk_create берет значение через pre_save
+        self.assertEqual(field.to_python(field.pre_save(row, add=True)), tracked_at)
+
+
+class MediaServingTest(SimpleTestCase):
+    path = 'brands/logos/test_logo.png'
+    data = b'0123456789'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        os.makedirs(os.path.join(media.name, 'brands', 'logos'))
+        with open(os.path.join(media.name, self.path), 'wb') as file:
+            file.write(self.data)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _get(self, **headers):
+        request = RequestFactory().get('/', **headers)
+        request.user = AnonymousUser()
+        return media_serving.serve_media(request, self.path)
+
+    def test_conditional_and_range_requests(self):
+        response = self._get()
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        partial = self._get(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(partial.streaming_content), b'2345')
+        self.assertEqual(b''.join(self._get(HTTP_RANGE='bytes=-3').streaming_content), b'789')
+        self.assertEqual(self._get(HTTP_RANGE='bytes=20-').status_code, 416)
+        # Файл изменился с момента первого ответа - отдается целиком
+        self.assertEqual(self._get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_proxy_transfers_bytes(self):
+        with mock.patch.object(media_serving, 'MEDIA_ACCEL', 'x-accel'):
+            response = self._get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/brands/logos/test_logo.png')
+        self.assertEqual(response.content, b'')
+        self.assertIn('max-age=86400', response['Cache-Control'])
+
+    def test_dot_segments_do_not_bypass_photo_access(self):
+        for path in ('./cars/photos/12/a.jpg', 'users/../cars/photos/12/a.jpg',
+                     'cars//photos/12/a.jpg', '/cars/photos/12/a.jpg', './brands/logos/test_logo.png'):
+            self.assertIsNone(media_serving.clean_path(path))
+            self.assertIsNone(media_serving.media_access(AnonymousUser(), path))
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        self.assertIsNone(media_serving.serve_media(request, 'logos/../' + self.path))
+        self.assertEqual(media_serving.clean_path(self.path), self.path)
+
+    def test_content_files_are_immutable(self):
+        digest = 'ab' * 32
+        self.assertTrue(media_serving.CONTENT_FILE.match(f'cars/photos/sha256/ab/ab/{digest}.jpg'))
+        self.assertTrue(media_serving.CONTENT_FILE.match(f'cars/renditions/ab/{digest}_card.webp'))
+        self.assertFalse(media_serving.CONTENT_FILE.match('cars/photos/12/12_000.jpg'))
+
+    def test_only_legacy_photos_need_access_check(self):
+        digest = 'ab' * 32
+        with mock.patch.object(CarAd, 'objects') as ads:
+            for path in (f'cars/photos/sha256/12/34/{digest}.jpg', f'cars/renditions/12/{digest}_card.webp', self.path):
+                self.assertEqual(media_serving.media_access(AnonymousUser(), path), 'public')
+            ads.filter.assert_not_called()
+
+            ads.filter.return_value.filter.return_value.exists.return_value = False
+            self.assertIsNone(media_serving.media_access(AnonymousUser(), 'cars/photos/12/12_000.jpg'))
+            ads.filter.assert_called_once_with(pk=12)
+
+
+class AutocompleteFormatTest(SimpleTestCase):
+    def test_suggestions_keep_response_keys(self):
+        brand = autocomplete._suggestion({
+            'kind': 'brand', 'text': 'Toyota', 'url': '/catalog/brands/toyota/', 'object_id': 1,
+            'data': {'slug': 'toyota', 'logo': '/media/brands/logos/toyota.png'},
+        })
+        self.assertEqual(brand, {
+            'type': 'brand', 'id': 1, 'name': 'Toyota', 'slug': 'toyota',
+            'logo': '/media/brands/logos/toyota.png', 'display': 'Toyota (марка)',
+            'url': '/catalog/brands/toyota/',
+        })
+
+        model = autocomplete._suggestion({
+            'kind': 'brand_model', 'text': 'Toyota Camry', 'url': '/catalog/models/camry/', 'object_id': 10,
+            'data': {'name': 'Camry', 'slug': 'camry', 'brand': 'Toyota'},
+        })
+        self.assertEqual(
+            (model['type'], model['name'], model['brand'], model['slug'], model['display']),
+            ('model', 'Camry', 'Toyota', 'camry', 'Toyota Camry (модель)'),
+        )
+
+        ad = autocomplete._suggestion({
+            'kind': 'ad', 'text': 'Toyota Camry 2020', 'url': '', 'object_id': 7, 'data': {'slug': 'camry-2020'},
+        })
+        self.assertEqual(
+            (ad['type'], ad['title'], ad['url']),
+            ('ad', 'Toyota Camry 2020', reverse('advertisements:ad_detail', kwargs={'slug': 'camry-2020'})),
+        )
+
+
+class FacetResultTest(SimpleTestCase):
+    def _row(self, name=None, **values):
+        row = {f'{facet}_grp': 1 for facet in TERMS_FACETS}
+        if name:
+            row[f'{name}_grp'] = 0
+        row.update(values)
+        return row
+
+    def test_rows_are_grouped_by_facet(self):
+        filters = parse_listing_filters(
+            QueryDict('brand=toyota&fuel_type=petrol'), refs=FilterRefs(brands={'toyota': 1})
+        )
+        rows = [
+            self._row('brand', brand_key=1, brand_slug='toyota', brand_label='Toyota', brand_count=5),
+            self._row('brand', brand_key=2, brand_slug='bmw', brand_label='BMW', brand_count=0),
+            self._row('fuel_type', fuel_type_key='petrol', fuel_type_count=3),
+            self._row(total=3, price_min=100, price_max=900),
+        ]
+        result = build_facets(filters, rows)
+
+        self.assertEqual(result.total, 3)
+        brands = result.terms['brand'].values
+        self.assertEqual([value.slug for value in brands], ['toyota'])
+        self.assertTrue(brands[0].selected)
+        self.assertEqual(result.terms['fuel_type'].values[0].count, 3)
+        self.assertEqual(result.ranges['price'].max, 900)
+        self.assertEqual(set(result.ranges), set(RANGE_FACETS))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN (FORMAT JSON) есть только в PostgreSQL')
+class CountChangesTest(SimpleTestCase):
+    state = {
+        'status': 'active', 'is_active': True, 'brand': 1, 'model': 2, 'city': 3, 'region': 'Москва', 'price': 500,
+    }
+
+    def test_new_active_ad(self):
+        self.assertEqual(count_changes(CarAd, None, self.state), {
+            counters.ALL_ADS: 1,
+            counters.ACTIVE_ADS: 1,
+            counters.ACTIVE_PRICE_SUM: 500,
+            counters.brand_ads(1): 1,
+            counters.model_ads(2): 1,
+            counters.city_ads(3): 1,
+            counters.region_ads('Москва'): 1,
+            counters.region_price_sum('Москва'): 500,
+        })
+
+    def test_deactivated_ad(self):
+        changes = count_changes(CarAd, self.state, {**self.state, 'status': 'sold'})
+        self.assertNotIn(counters.ALL_ADS, changes)
+        self.assertEqual(changes[counters.ACTIVE_ADS], -1)
+        self.assertEqual(changes[counters.ACTIVE_PRICE_SUM], -500)
+        self.assertEqual(changes[counters.brand_ads(1)], -1)
+
+    def test_moved_and_repriced(self):
+        changes = count_changes(CarAd, self.state, {**self.state, 'city': 4, 'price': 450})
+        self.assertEqual(changes, {
+            counters.city_ads(3): -1,
+            counters.city_ads(4): 1,
+            counters.ACTIVE_PRICE_SUM: -50,
+            counters.region_price_sum('Москва'): -50,
+        })
+
+    def test_unrelated_update_fields(self):
+        self.assertFalse(counters.affects_counters(CarAd, ['title', 'views_count']))
+        self.assertTrue(counters.affects_counters(CarAd, ['status']))
+        self.assertFalse(counters.affects_counters(User, ['last_login']))
+
+
+class AdminActionsTest(TestCase):
+    def test_actions_refresh_index_for_filtered_changelist(self):
+        from apps.advertisements import admin as ads_admin
+
+        brand = CarBrand.objects.create(name="Admin Brand")
+        model = CarModel.objects.create(brand=brand, name="Admin Model")
+        ad = CarAd.objects.create(title="Pending Ad", model=model, price=1000000, year=2020, status='pending')
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_user(username='moderator', password='x', is_staff=True)
+        modeladmin = mock.Mock()
+
+        # Список отфильтрован по статусу «на модерации»
+        ads_admin.activate_ads(modeladmin, request, CarAd.objects.filter(status='pending'))
+        self.assertTrue(AdSearchIndex.objects.filter(ad_id=ad.pk).exists())
+
+        ads_admin.mark_as_sold(modeladmin, request, CarAd.objects.filter(status='active'))
+        self.assertFalse(AdSearchIndex.objects.filter(ad_id=ad.pk).exists())
+
+
+class CatalogSearchVectorTest(TestCase):
+    def setUp(self):
+        self.brand = CarBrand.objects.create(name="Vector Brand")
+        self.model = CarModel.objects.create(brand=self.brand, name="Vector Model")
+
+    def test_vectors_follow_name_changes_only(self):
+        with mock.patch('apps.advertisements.signals.update_search_vectors') as update:
+            self.brand.description = 'Новое описание'
+            self.brand.save()
+            self.model.save(update_fields=['is_active'])
+            update.assert_not_called()
+
+            self.model.name = 'Renamed Model'
+            self.model.save()
+            self.assertEqual(update.call_count, 1)
+
+
+class SiteCounterTest(TestCase):
+    def setUp(self):
+        self.brand = CarBrand.objects.create(name="Counter Brand")
+        self.model = CarModel.objects.create(brand=self.brand, name="Counter Model")
+
+    def _ad(self, **fields):
+        return CarAd.objects.create(
+            **{'title': "Counter Ad", 'model': self.model, 'price': 1000000, 'year': 2020, 'status': 'active', **fields}
+        )
+
+    def test_signals_keep_counters(self):
+        ad = self._ad()
+        self._ad(status='draft')
+        counts = get_counts(counters.ALL_ADS, counters.ACTIVE_ADS)
+        self.assertEqual(counts, {counters.ALL_ADS: 2, counters.ACTIVE_ADS: 1})
+        self.model.refresh_from_db()
+        self.brand.refresh_from_db()
+        self.assertEqual((self.model.ads_count, self.brand.ads_count), (1, 1))
+
+        ad.status = 'sold'
+        ad.save()
+        self.assertEqual(get_counts(counters.ACTIVE_ADS)[counters.ACTIVE_ADS], 0)
+        self.model.refresh_from_db()
+        self.assertEqual(self.model.ads_count, 0)
+
+        ad.delete()
+        self.assertEqual(get_counts(counters.ALL_ADS)[counters.ALL_ADS], 1)
+        self.assertEqual(reconcile_counters(fix=False), {})
+
+    def test_reconcile_fixes_drift(self):
+        self._ad()
+        # update() по queryset сигналы не вызывает
+        CarAd.objects.update(status='sold')
+        drift = reconcile_counters()
+        self.assertEqual(drift[counters.ACTIVE_ADS], (1, 0))
+        self.assertEqual(drift[counters.brand_ads(self.brand.pk)], (1, 0))
+        self.assertEqual(get_counts(counters.ACTIVE_ADS)[counters.ACTIVE_ADS], 0)
+        self.brand.refresh_from_db()
+        self.assertEqual(self.brand.ads_count, 0)
+        self.assertEqual(reconcile_counters(fix=False), {})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HomeSnapshotTest(TestCase):
+    def setUp(self):
+        local_cache.clear()
+        self.brand = CarBrand.objects.create(name="Snapshot Brand")
+        self.model = CarModel.objects.create(brand=self.brand, name="Snapshot Model")
+        self.ads = [
+            CarAd.objects.create(
+                title=f"Snapshot Ad {i}", model=self.model, price=1000000, year=2020, status='active'
+            )
+            for i in range(3)
+        ]
+        rebuild_ad_index()
+        refresh_home_snapshot()
+
+    def _context(self):
+        view = HomePageView()
+        view.setup(RequestFactory().get('/'))
+        return view.get_context_data()
+
+    def test_context_from_snapshot_in_one_query(self):
+        with self.assertNumQueries(1):
+            context = self._context()
+        self.assertEqual(context['total_ads'], 3)
+        self.assertEqual([brand.pk for brand in context['popular_brands']], [self.brand.pk])
+        self.assertEqual(context['popular_brands'][0].ads_count, 3)
+        self.assertEqual({ad.pk for ad in context['recent_ads']}, {ad.pk for ad in self.ads})
+
+    def test_inactive_ads_dropped_before_refresh(self):
+        CarAd.objects.filter(pk=self.ads[0].pk).update(status='sold')
+        context = self._context()
+        self.assertNotIn(self.ads[0].pk, [ad.pk for ad in context['recent_ads']])
+
+
+class QueryPlanTest(TestCase):
+    """
+    Типовые запросы списка объявлений не должны переходить на Seq Scan.
+
+    Планировщик на маленькой таблице честно предпочтет последовательное
+    чтение, поэтому enable_seqscan выключается: Seq Scan останется только там,
+    где подходящего индекса нет совсем.
+    """
+    ADS_COUNT = 3000
+    TABLES = {CarAd._meta.db_table, 'ad_search_index'}
+
+    @classmethod
+    def setUpTestData(cls):
+        brands = CarBrand.objects.bulk_create(
+            CarBrand(name=f'Brand {i}', slug=f'brand-{i}') for i in range(10)
+        )
+        models = CarModel.objects.bulk_create(
+            CarModel(brand=brand, name=f'Model {i}', slug=f'model-{brand.pk}-{i}')
+            for brand in brands for i in range(5)
+        )
+        cities = City.objects.bulk_create(
+            City(name=f'City {i}', slug=f'city-{i}', region='Регион') for i in range(5)
+        )
+        fuels = [choice for choice, _ in CarAd.FuelType.choices]
+        transmissions = [choice for choice, _ in CarAd.TransmissionType.choices]
+        statuses = ['active'] * 8 + ['draft', 'sold']
+
+        CarAd.objects.bulk_create(
+            CarAd(
+                title=f'Ad {i}',
+                slug=f'ad-{i}',
+                description='Тест',
+                model=models[i % len(models)],
+                brand_id=models[i % len(models)].brand_id,
+                city=cities[i % len(cities)],
+                price=100000 + i * 1000,
+                year=2000 + i % 25,
+                mileage=i * 100,
+                fuel_type=fuels[i % len(fuels)],
+                transmission_type=transmissions[i % len(transmissions)],
+                status=statuses[i % len(statuses)],
+                views_count=i % 500,
+            )
+            for i in range(cls.ADS_COUNT)
+        )
+        rebuild_ad_index()
+        cls.brand = brands[0]
+        cls.model = models[0]
+        cls.city = cities[0]
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {CarAd._meta.db_table}')
+            cursor.execute('ANALYZE ad_search_index')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def _seq_scans(self, plan):
+        scans = []
+        if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in self.TABLES:
+            scans.append(plan['Relation Name'])
+        for child in plan.get('Plans', []):
+            scans.extend(self._seq_scans(child))
+        return scans
+
+    def assertNoSeqScan(self, queryset, label):
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        self.assertEqual(self._seq_scans(plan), [], f'{label}: Seq Scan в плане {plan}')
+
+    def _list_view_queryset(self, query):
+        view = AdvertisementsListView()
+        view.setup(RequestFactory().get('/', QueryDict(query)))
+        return view.get_queryset()[:21]
+
+    def _viewset_queryset(self, query):
+        view = AdViewSet(action='list', format_kwarg=None)
+        view.request = Request(RequestFactory().get('/', QueryDict(query)))
+        return view.filter_queryset(view.get_queryset())[:21]
+
+    def test_list_view_uses_indexes(self):
+        shapes = [
+            '',
+            f'brand={self.brand.pk}&min_price=200000&max_price=900000',
+            f'brand={self.brand.pk}&model={self.model.pk}&min_year=2010',
+            f'brand={self.brand.slug}',
+            'fuel_type=diesel&transmission_type=automatic',
+            f'city={self.city.pk}',
+            'sort=price&order=asc',
+            'sort=views_count',
+            'sort=mileage&order=asc',
+        ]
+        for query in shapes:
+            with self.subTest(query=query):
+                self.assertNoSeqScan(self._list_view_queryset(query), f'AdvertisementsListView ?{query}')
+
+    def test_viewset_uses_indexes(self):
+        # Частичные индексы - для списка опубликованных (?status=active)
+        shapes = [
+            'status=active',
+            f'status=active&brand={self.brand.pk}&min_price=200000&max_price=900000',
+            f'status=active&model={self.model.pk}&min_year=2010',
+            f'status=active&city={self.city.pk}',
+            'status=active&ordering=price',
+            'status=active&ordering=-views',
+            'status=active&ordering=year',
+        ]
+        for query in shapes:
+            with self.subTest(query=query):
+                self.assertNoSeqScan(self._viewset_queryset(query), f'AdViewSet ?{query}')
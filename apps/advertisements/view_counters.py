@@ -0,0 +1,163 @@
+# apps/advertisements/view_counters.py
+"""
+Буферизованные счетчики просмотров объявлений.
+
+Просмотр - это HINCRBY в хэше Redis (без блокировки строки в PostgreSQL).
+Периодическая задача переносит накопленные приращения в car_ads и
+ad_search_index пакетными UPDATE ... FROM (VALUES ...). При чтении к
+значению из БД добавляется еще не записанное приращение.
+
+Перенос хэша получает id (поле FLUSH_ID_FIELD хэша), который пишется в
+view_counter_flushes в той же транзакции, что и приращения. Если процесс
+упал после фиксации, но до удаления хэша, повторный перенос видит свой
+id в БД и только удаляет хэш: приращение не учитывается дважды.
+
+Если Redis недоступен, просмотр записывается сразу атомарным
+UPDATE views = views + 1 (без чтения-изменения-записи).
+"""
+import logging
+import uuid
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .models import AdSearchIndex, CarAd, ViewCounterFlush
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'ad_views:pending'
+# Приращения, которые сейчас переносятся в БД
+FLUSHING_KEY = 'ad_views:flushing'
+# Поле хэша FLUSHING_KEY с id переноса (id объявлений - числа, не пересекаются)
+FLUSH_ID_FIELD = 'flush_id'
+FLUSH_LOCK_KEY = 'ad_views:flush_lock'
+FLUSH_LOCK_TIMEOUT = 5 * 60
+FLUSH_BATCH_SIZE = 1000
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def record_view(ad_id, amount=1):
+    """
+    Учесть просмотр объявления.
+
+    Возвращает приращение, еще не отраженное в строке БД (включая
+    переносимое сейчас).
+    """
+    try:
+        pipe = _redis().pipeline()
+        pipe.hincrby(PENDING_KEY, ad_id, amount)
+        pipe.hget(FLUSHING_KEY, ad_id)
+        pending, in_flight = pipe.execute()
+        return int(pending) + int(in_flight or 0)
+    except (NotImplementedError, RedisError):
+        logger.warning('Redis недоступен, просмотр объявления %s записан напрямую', ad_id)
+        CarAd.objects.filter(pk=ad_id).update(
+            views=F('views') + amount,
+            views_count=F('views_count') + amount,
+        )
+        AdSearchIndex.objects.filter(ad_id=ad_id).update(views_count=F('views_count') + amount)
+        return amount
+
+
+def pending_views(ad_ids):
+    """Незаписанные приращения: {ad_id: delta} (один запрос к Redis)"""
+    ad_ids = list(ad_ids)
+    if not ad_ids:
+        return {}
+    try:
+        pipe = _redis().pipeline()
+        pipe.hmget(PENDING_KEY, ad_ids)
+        pipe.hmget(FLUSHING_KEY, ad_ids)
+        values, flushing = pipe.execute()
+    except (NotImplementedError, RedisError):
+        return {}
+    return {
+        ad_id: int(value or 0) + int(in_flight or 0)
+        for ad_id, value, in_flight in zip(ad_ids, values, flushing)
+        if value or in_flight
+    }
+
+
+def merge_pending_views(ads):
+    """Добавить незаписанные просмотры к views/views_count объектов CarAd"""
+    ads = list(ads)
+    deltas = pending_views(ad.pk for ad in ads)
+    for ad in ads:
+        delta = deltas.get(ad.pk, 0)
+        ad.views += delta
+        ad.views_count += delta
+    return ads
+
+
+def _apply_deltas(deltas, flush_id):
+    """
+    Пакетные UPDATE ... FROM (VALUES ...) для car_ads и ad_search_index.
+
+    False, если перенос flush_id уже был применен.
+    """
+    # Порядок по id: параллельные транзакции блокируют строки в одном порядке
+    items = sorted(deltas.items())
+    ads_table = connection.ops.quote_name(CarAd._meta.db_table)
+    index_table = connection.ops.quote_name(AdSearchIndex._meta.db_table)
+
+    # Одна транзакция с отметкой переноса: хэш применяется ровно один раз
+    with transaction.atomic(), connection.cursor() as cursor:
+        if ViewCounterFlush.objects.select_for_update().filter(pk=flush_id).exists():
+            return False
+        # Нужна только отметка текущего хэша
+        ViewCounterFlush.objects.all().delete()
+        ViewCounterFlush.objects.create(flush_id=flush_id)
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = items[start:start + FLUSH_BATCH_SIZE]
+            values = ', '.join(['(%s, %s)'] * len(batch))
+            params = [value for item in batch for value in item]
+            cursor.execute(
+                f'UPDATE {ads_table} AS ad '
+                f'SET views = ad.views + v.delta, views_count = ad.views_count + v.delta '
+                f'FROM (VALUES {values}) AS v(id, delta) WHERE ad.id = v.id',
+                params,
+            )
+            cursor.execute(
+                f'UPDATE {index_table} AS idx '
+                f'SET views_count = idx.views_count + v.delta '
+                f'FROM (VALUES {values}) AS v(id, delta) WHERE idx.ad_id = v.id',
+                params,
+            )
+    return True
+
+
+def flush_view_counters():
+    """
+    Перенести накопленные просмотры в БД.
+
+    Хэш атомарно переименовывается, поэтому новые просмотры во время
+    переноса копятся в новом хэше. Если прошлый перенос упал, его
+    приращения переносятся первыми (или только удаляются, если уже
+    записаны). Возвращает количество объявлений.
+    """
+    if not cache.add(FLUSH_LOCK_KEY, 1, FLUSH_LOCK_TIMEOUT):
+        return 0
+
+    try:
+        redis = _redis()
+        if not redis.exists(FLUSHING_KEY):
+            if not redis.exists(PENDING_KEY):
+                return 0
+            redis.rename(PENDING_KEY, FLUSHING_KEY)
+        # id назначается до записи в БД: хэш без id еще не применялся
+        redis.hsetnx(FLUSHING_KEY, FLUSH_ID_FIELD, uuid.uuid4().hex)
+
+        values = redis.hgetall(FLUSHING_KEY)
+        flush_id = values.pop(FLUSH_ID_FIELD.encode()).decode()
+        deltas = {int(ad_id): int(delta) for ad_id, delta in values.items() if int(delta)}
+        flushed = len(deltas) if deltas and _apply_deltas(deltas, flush_id) else 0
+        redis.delete(FLUSHING_KEY)
+        return flushed
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
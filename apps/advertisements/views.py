@@ -1,11 +1,26 @@
 ﻿# apps/advertisements/views.py
+import copy
 import csv
 import datetime
 import logging
 
 from apps.advertisements.forms import CarAdForm, SimpleCarAdForm
 from apps.catalog.models import CarBrand, CarModel, CarFeature
-from apps.advertisements.models import CarAd, CarPhoto, CarAdFeature, FavoriteAd, SearchHistory, CarView
+from apps.advertisements.models import (
+    AdSearchIndex, CarAd, CarAdFeature, FavoriteAd
+)
+from apps.advertisements.facets import get_facets
+from apps.advertisements.filters import canonical_params, parse_listing_filters
+from apps.advertisements.listing_cache import (
+    get_listing, listing_cache_key, listing_tags, page_params, release_listing, store_listing
+)
+from apps.advertisements.photo_ingestion import ingest_photos
+from apps.advertisements.search import search_ads, search_all
+from apps.advertisements.search_index import load_ads
+from apps.advertisements.similarity import similar_ads_for
+from apps.analytics.events import track_event
+from apps.core.counting import count_results
+from apps.core.pagination import KeysetPaginationMixin
 from apps.users.models import User
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -15,12 +30,12 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, TemplateView, CreateView, UpdateView, DeleteView
 from django.db.models import Q, Count, Min, Max, Prefetch
 from django.urls import reverse_lazy
-from django.http import JsonResponse, Http404, HttpResponse
+from django.http import JsonResponse, Http404, HttpResponse, QueryDict
 from django.views.decorators.http import require_GET, require_POST
-from django.core.cache import cache
 from django.views import View
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.conf import settings
 from datetime import datetime
 
@@ -204,35 +219,8 @@ class SearchView(TemplateView):
         query = self.request.GET.get('q', '')
 
         if query:
-            # Поиск по маркам
-            brands = CarBrand.objects.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query),
-                is_active=True
-            )[:10]
-
-            # Поиск по моделям
-            models = CarModel.objects.filter(
-                Q(name__icontains=query) |
-                Q(brand__name__icontains=query),
-                is_active=True
-            ).select_related('brand')[:20]
-
-            # Поиск по объявлениям
-            ads = CarAd.objects.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query) |
-                Q(model__name__icontains=query) |
-                Q(model__brand__name__icontains=query),
-                status='active',
-                is_active=True
-            ).select_related('model__brand').prefetch_related('photos')[:20]
-
-            context['brands'] = brands
-            context['models'] = models
-            context['advertisements'] = ads
+            context.update(search_all(query))
             context['query'] = query
-            context['results_count'] = brands.count() + models.count() + ads.count()
 
         return context
 
@@ -247,7 +235,90 @@ def contact_view(request):
     return render(request, 'core/contact.html')
 
 
-class AdvertisementsListView(ListView):
+class AdSearchIndexListMixin(KeysetPaginationMixin):
+    """
+    Список по таблице ad_search_index: фильтры, сортировка и пагинация
+    без JOIN, объекты CarAd загружаются только для текущей страницы.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        page.object_list = load_ads(page.object_list)
+        return paginator, page, page.object_list, is_paginated
+
+
+class CachedListingMixin:
+    """
+    Кэш блока списка объявлений (см. listing_cache).
+
+    При попадании в кэш queryset, фасеты и карточки не считаются:
+    рендерится только оболочка страницы, а избранное пользователя
+    подставляется отдельно одним запросом.
+    """
+    listing_template_name = 'advertisements/partials/ad_list_content.html'
+
+    def get_listing_params(self):
+        """Параметры фильтров списка"""
+        return self.request.GET
+
+    def get(self, request, *args, **kwargs):
+        self.filters = parse_listing_filters(self.get_listing_params())
+        self.listing = None
+        self.listing_key = None
+        self.listing_page = page_params(request.GET, self.page_kwarg, self.cursor_param)
+
+        locked = False
+        if self.listing_page is not None:
+            self.listing_key = listing_cache_key(type(self).__name__, self.filters, self.listing_page)
+            self.listing, self.listing_versions, locked = get_listing(
+                self.listing_key, listing_tags(self.filters)
+            )
+        if self.listing is not None:
+            return self.render_to_response({'view': self})
+        try:
+            return super().get(request, *args, **kwargs)
+        finally:
+            if locked:
+                release_listing(self.listing_key)
+
+    def get_listing_request(self):
+        """
+        Запрос с каноническими параметрами для рендера блока: ссылки
+        и значения полей одинаковы для всех написаний одних фильтров.
+        """
+        if self.listing_key is None:
+            return self.request
+        listing_request = copy.copy(self.request)
+        params = QueryDict(mutable=True)
+        params.update(canonical_params(self.filters.key))
+        params.update(self.listing_page)
+        listing_request.GET = params
+        return listing_request
+
+    def get_favorite_ids(self, ad_ids):
+        if not self.request.user.is_authenticated or not ad_ids:
+            return []
+        return list(
+            FavoriteAd.objects.filter(
+                user=self.request.user, car_ad_id__in=ad_ids
+            ).values_list('car_ad_id', flat=True)
+        )
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.listing is None:
+            html = render_to_string(self.listing_template_name, context, self.get_listing_request())
+            ad_ids = [ad.pk for ad in context.get('page_obj') or []]
+            if self.listing_key:
+                self.listing = store_listing(self.listing_key, self.listing_versions, html, ad_ids)
+            else:
+                self.listing = {'html': html, 'ad_ids': ad_ids}
+
+        context['listing_html'] = mark_safe(self.listing['html'])
+        context['favorite_ids'] = self.get_favorite_ids(self.listing['ad_ids'])
+        return super().render_to_response(context, **response_kwargs)
+
+
+class AdvertisementsListView(CachedListingMixin, AdSearchIndexListMixin, ListView):
     """Список объявлений с расширенной фильтрацией"""
     model = CarAd
     template_name = 'advertisements/ad_list.html'
@@ -262,18 +333,11 @@ class AdvertisementsListView(ListView):
         self.current_sort = None
         self.current_order = None
         self.filter_params = {}
+        self.filters = None
 
     def get_queryset(self):
-        queryset = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).select_related(
-            'model__brand',
-            'owner'
-        ).prefetch_related(
-            'photos',
-            Prefetch('ad_features__feature', queryset=CarAdFeature.objects.select_related('feature'))
-        )
+        # В индексе только активные объявления
+        queryset = AdSearchIndex.objects.all()
 
         # Получаем все GET-параметры
         params = self.request.GET
@@ -285,202 +349,10 @@ class AdvertisementsListView(ListView):
         self.current_sort = params.get('sort', '-created_at')
         self.current_order = params.get('order', 'desc')
 
-        # 1. Фильтр по марке и модели
-        brand_slug = params.get('brand')
-        if brand_slug:
-            # Ищем бренд по slug
-            try:
-                brand = CarBrand.objects.filter(slug=brand_slug).first()
-                if brand:
-                    queryset = queryset.filter(model__brand_id=brand.id)
-                else:
-                    # Если бренд не найден, возвращаем пустой queryset
-                    queryset = queryset.none()
-            except Exception:
-                queryset = queryset.none()
-
-        # 2. Фильтр по модели
-        model_slug = params.get('model')
-        if model_slug and brand_slug:  # Модель имеет смысл только если выбрана марка
-            try:
-                # Ищем модель по slug и марке
-                brand = CarBrand.objects.filter(slug=brand_slug).first()
-                if brand:
-                    model = CarModel.objects.filter(slug=model_slug, brand=brand).first()
-                    if model:
-                        queryset = queryset.filter(model_id=model.id)
-            except Exception:
-                pass
-
-        # 3. Фильтр по цене с валидацией
-        min_price = params.get('min_price')
-        max_price = params.get('max_price')
-
-        if min_price:
-            try:
-                min_price_val = int(min_price)
-                if min_price_val > 0:  # Только положительные значения
-                    queryset = queryset.filter(price__gte=min_price_val)
-            except ValueError:
-                pass  # Игнорируем некорректные значения
-
-        if max_price:
-            try:
-                max_price_val = int(max_price)
-                if max_price_val > 0:  # Только положительные значения
-                    queryset = queryset.filter(price__lte=max_price_val)
-            except ValueError:
-                pass  # Игнорируем некорректные значения
-
-        # 4. Фильтр по году выпуска с валидацией
-        min_year = params.get('min_year')
-        max_year = params.get('max_year')
-
-        if min_year:
-            try:
-                min_year_val = int(min_year)
-                if 1900 <= min_year_val <= 2100:  # Реалистичные года
-                    queryset = queryset.filter(year__gte=min_year_val)
-            except ValueError:
-                pass
-
-        if max_year:
-            try:
-                max_year_val = int(max_year)
-                if 1900 <= max_year_val <= 2100:  # Реалистичные года
-                    queryset = queryset.filter(year__lte=max_year_val)
-            except ValueError:
-                pass
+        # Фильтры (марка, модель, диапазоны, характеристики, поиск) разобраны в get()
+        queryset = self.filters.apply(queryset)
 
-        # 5. Фильтр по пробегу с валидацией
-        min_mileage = params.get('min_mileage')
-        max_mileage = params.get('max_mileage')
-
-        if min_mileage:
-            try:
-                min_mileage_val = int(min_mileage)
-                if min_mileage_val >= 0:  # Пробег не может быть отрицательным
-                    queryset = queryset.filter(mileage__gte=min_mileage_val)
-            except ValueError:
-                pass
-
-        if max_mileage:
-            try:
-                max_mileage_val = int(max_mileage)
-                if max_mileage_val >= 0:
-                    queryset = queryset.filter(mileage__lte=max_mileage_val)
-            except ValueError:
-                pass
-
-        # 6. Фильтр по типу кузова (из модели CarModel)
-        body_type = params.get('body_type')
-        if body_type:
-            queryset = queryset.filter(model__body_type=body_type)
-
-        # 7. Фильтры из модели CarAd (технические характеристики)
-        filter_fields = [
-            'fuel_type',  # Тип топлива
-            'transmission_type',  # Коробка передач
-            'drive_type',  # Привод
-            'condition',  # Состояние
-            'color_exterior',  # Цвет кузова
-            'color_interior',  # Цвет салона
-            'owner_type',  # Тип владельца (частник/дилер)
-            'steering_wheel',  # Расположение руля
-        ]
-
-        for field in filter_fields:
-            value = params.get(field)
-            if value and value != 'all':  # 'all' можно использовать для "Все варианты"
-                queryset = queryset.filter(**{field: value})
-
-        # 8. Фильтр по объему двигателя с валидацией
-        min_engine_volume = params.get('min_engine_volume')
-        max_engine_volume = params.get('max_engine_volume')
-
-        if min_engine_volume:
-            try:
-                min_volume = float(min_engine_volume)
-                if min_volume > 0:
-                    queryset = queryset.filter(engine_volume__gte=min_volume)
-            except (ValueError, TypeError):
-                pass
-
-        if max_engine_volume:
-            try:
-                max_volume = float(max_engine_volume)
-                if max_volume > 0:
-                    queryset = queryset.filter(engine_volume__lte=max_volume)
-            except (ValueError, TypeError):
-                pass
-
-        # 9. Фильтр по мощности двигателя с валидацией
-        min_engine_power = params.get('min_engine_power')
-        max_engine_power = params.get('max_engine_power')
-
-        if min_engine_power:
-            try:
-                min_power = int(min_engine_power)
-                if min_power > 0:
-                    queryset = queryset.filter(engine_power__gte=min_power)
-            except (ValueError, TypeError):
-                pass
-
-        if max_engine_power:
-            try:
-                max_power = int(max_engine_power)
-                if max_power > 0:
-                    queryset = queryset.filter(engine_power__lte=max_power)
-            except (ValueError, TypeError):
-                pass
-
-        # 10. Фильтр по наличию сервисной истории и тюнингу
-        if params.get('has_service_history') == 'true':
-            queryset = queryset.filter(service_history=True)
-
-        if params.get('has_tuning') == 'true':
-            queryset = queryset.filter(has_tuning=True)
-
-        # 11. Поиск по тексту (заголовок, описание, марка, модель)
-        search = params.get('search')
-        if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(description__icontains=search) |
-                Q(model__name__icontains=search) |
-                Q(model__brand__name__icontains=search) |
-                Q(vin__icontains=search)
-            )
-
-        # 12. Фильтр по городу/региону
-        city = params.get('city')
-        if city:
-            queryset = queryset.filter(city__icontains=city)
-
-        region = params.get('region')
-        if region:
-            queryset = queryset.filter(region__icontains=region)
-
-        # 13. Фильтр по количеству дверей и мест
-        doors = params.get('doors')
-        if doors:
-            try:
-                doors_val = int(doors)
-                if doors_val > 0:
-                    queryset = queryset.filter(doors=doors_val)
-            except ValueError:
-                pass
-
-        seats = params.get('seats')
-        if seats:
-            try:
-                seats_val = int(seats)
-                if seats_val > 0:
-                    queryset = queryset.filter(seats=seats_val)
-            except ValueError:
-                pass
-
-        # 14. Сортировка (после всех фильтров)
+        # Сортировка (после всех фильтров)
         sort_field = self.current_sort.replace('-', '') if self.current_sort.startswith('-') else self.current_sort
         if sort_field in ['price', 'year', 'created_at', 'mileage', 'views_count']:
             if self.current_order == 'asc':
@@ -491,18 +363,11 @@ class AdvertisementsListView(ListView):
             # Сортировка по умолчанию - сначала новые
             queryset = queryset.order_by('-created_at')
 
-        # Убираем дубликаты если есть
-        queryset = queryset.distinct()
-
         return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Получаем параметры запроса
-        params = self.request.GET
-        brand_id = params.get('brand')
-
         # Используем сохраненные атрибуты
         context['selected_brand'] = self.selected_brand
         context['selected_model'] = self.selected_model
@@ -518,69 +383,23 @@ class AdvertisementsListView(ListView):
         else:
             context['current_order'] = 'asc'
 
-        # Используем кэш для часто запрашиваемых данных
-        cache_key = f'filter_data_{brand_id}'
-        filter_data = cache.get(cache_key)
-
-        if not filter_data:
-            filter_data = {}
-
-            # Статистика для фильтров (минимальные/максимальные значения)
-            # Используем базовый queryset без текущих фильтров
-            base_qs = CarAd.objects.filter(
-                status='active',
-                is_active=True
-            )
-
-            # Если выбрана марка, фильтруем по ней
-            if brand_id:
-                if brand_id.isdigit():
-                    # Это ID
-                    base_qs = base_qs.filter(model__brand_id=int(brand_id))
-                else:
-                    # Это slug, находим ID по slug
-                    try:
-                        brand = CarBrand.objects.filter(slug=brand_id).first()
-                        if brand:
-                            base_qs = base_qs.filter(model__brand_id=brand.id)
-                    except (ValueError, CarBrand.DoesNotExist):
-                        pass  # Игнорируем некорректные значения
-
-            # Вычисляем диапазоны
-            filter_data['price_range'] = base_qs.aggregate(
-                min_price=Min('price'),
-                max_price=Max('price')
-            )
-
-            filter_data['year_range'] = base_qs.aggregate(
-                min_year=Min('year'),
-                max_year=Max('year')
-            )
-
-            filter_data['mileage_range'] = base_qs.aggregate(
-                min_mileage=Min('mileage'),
-                max_mileage=Max('mileage')
-            )
-
-            filter_data['engine_volume_range'] = base_qs.filter(
-                engine_volume__isnull=False
-            ).aggregate(
-                min_volume=Min('engine_volume'),
-                max_volume=Max('engine_volume')
-            )
-
-            filter_data['engine_power_range'] = base_qs.filter(
-                engine_power__isnull=False
-            ).aggregate(
-                min_power=Min('engine_power'),
-                max_power=Max('engine_power')
-            )
-
-            # Кэшируем на 5 минут
-            cache.set(cache_key, filter_data, 300)
-
-        # Добавляем данные из кэша в контекст
-        context.update(filter_data)
+        # Фасеты: значения и количества при текущих фильтрах одним запросом
+        facets = get_facets(self.filters)
+        context['facets'] = facets
+
+        # Диапазоны значений для полей «от/до»
+        ranges = facets.ranges
+        context['price_range'] = {'min_price': ranges['price'].min, 'max_price': ranges['price'].max}
+        context['year_range'] = {'min_year': ranges['year'].min, 'max_year': ranges['year'].max}
+        context['mileage_range'] = {'min_mileage': ranges['mileage'].min, 'max_mileage': ranges['mileage'].max}
+        context['engine_volume_range'] = {
+            'min_volume': ranges['engine_volume'].min,
+            'max_volume': ranges['engine_volume'].max,
+        }
+        context['engine_power_range'] = {
+            'min_power': ranges['engine_power'].min,
+            'max_power': ranges['engine_power'].max,
+        }
 
         # Добавляем переменные для шаблона
         context['selected_brand'] = self.selected_brand
@@ -588,108 +407,17 @@ class AdvertisementsListView(ListView):
         context['current_sort'] = self.current_sort
         context['current_order'] = self.current_order
 
-        # Получаем все бренды для фильтра
-        # Кэшируем список брендов
-        brands_cache_key = 'all_brands_filter'
-        all_brands = cache.get(brands_cache_key)
-
-        if not all_brands:
-            all_brands = CarBrand.objects.filter(
-                is_active=True
-            ).order_by('name')
-            cache.set(brands_cache_key, all_brands, 3600)  # 1 час
-
-        context['brands'] = all_brands
+        # Списки для выпадающих фильтров (только значения с объявлениями)
+        terms = facets.terms
+        context['brands'] = terms['brand'].values
+        context['active_brands'] = terms['brand'].values
 
-        # Если выбрана марка, получаем ее модели
+        # Модели показываем, если выбрана марка
         if self.selected_brand:
-            models_cache_key = f'models_for_brand_{self.selected_brand}'
-            models = cache.get(models_cache_key)
-
-            if not models:
-                # Проверяем, число ли это или slug
-                if self.selected_brand.isdigit():
-                    # Это ID
-                    models = CarModel.objects.filter(
-                        brand_id=int(self.selected_brand),
-                        is_active=True
-                    ).order_by('name')
-                else:
-                    # Это slug, ищем бренд
-                    brand = CarBrand.objects.filter(slug=self.selected_brand).first()
-                    if brand:
-                        models = CarModel.objects.filter(
-                            brand_id=brand.id,
-                            is_active=True
-                        ).order_by('name')
-                    else:
-                        models = CarModel.objects.none()
-
-                cache.set(models_cache_key, models, 300)  # 5 минут
-
-            context['models'] = models
-
-        # Списки для выпадающих фильтров
-        # Все марки, у которых есть активные объявления
-        active_brands_cache_key = 'active_brands'
-        active_brands = cache.get(active_brands_cache_key)
-
-        if not active_brands:
-            active_brands = CarBrand.objects.filter(
-                models__advertisements__status='active',
-                is_active=True
-            ).distinct().order_by('name')
-            cache.set(active_brands_cache_key, active_brands, 300)  # 5 минут
-
-        context['active_brands'] = active_brands
-
-        # Модели для фильтра (если выбрана марка)
-        if brand_id:
-            active_models_cache_key = f'active_models_{brand_id}'
-            active_models = cache.get(active_models_cache_key)
-
-            if not active_models:
-                # Проверяем, является ли brand_id числом или slug
-                if brand_id.isdigit():
-                    # Это ID
-                    brand_filter = {'brand_id': int(brand_id)}
-                else:
-                    # Это slug, ищем бренд
-                    brand = CarBrand.objects.filter(slug=brand_id).first()
-                    if brand:
-                        brand_filter = {'brand_id': brand.id}
-                    else:
-                        brand_filter = {}  # Если бренд не найден
-
-                if brand_filter:
-                    active_models = CarModel.objects.filter(
-                        **brand_filter,
-                        advertisements__status='active',
-                        advertisements__is_active=True,
-                        is_active=True
-                    ).distinct().order_by('name')
-                else:
-                    active_models = CarModel.objects.none()
-
-                cache.set(active_models_cache_key, active_models, 300)
-
-            context['active_models'] = active_models
-
-        # Типы кузова для фильтра (только с активными объявлениями)
-        body_types_cache_key = 'active_body_types'
-        body_types = cache.get(body_types_cache_key)
-
-        if not body_types:
-            body_types = CarModel.objects.filter(
-                advertisements__status='active',
-                advertisements__is_active=True,
-                is_active=True
-            ).exclude(body_type='').values_list(
-                'body_type', flat=True
-            ).distinct().order_by('body_type')
-            cache.set(body_types_cache_key, body_types, 300)
+            context['models'] = terms['model'].values
+            context['active_models'] = terms['model'].values
 
-        context['body_types'] = body_types
+        context['body_types'] = terms['body_type'].values
 
         # Все доступные значения для фильтров из модели CarAd
         context['fuel_types'] = CarAd.FuelType.choices
@@ -698,81 +426,18 @@ class AdvertisementsListView(ListView):
         context['condition_types'] = CarAd.ConditionType.choices
         context['owner_types'] = CarAd.OwnerType.choices
 
-        # Уникальные цвета для фильтра (только активные объявления)
-        colors_cache_key = 'active_colors'
-        colors_data = cache.get(colors_cache_key)
-
-        if not colors_data:
-            colors_data = {
-                'exterior_colors': CarAd.objects.filter(
-                    status='active', is_active=True
-                ).exclude(color_exterior='').values_list(
-                    'color_exterior', flat=True
-                ).distinct().order_by('color_exterior'),
-                'interior_colors': CarAd.objects.filter(
-                    status='active', is_active=True
-                ).exclude(color_interior='').values_list(
-                    'color_interior', flat=True
-                ).distinct().order_by('color_interior')
-            }
-            cache.set(colors_cache_key, colors_data, 300)
-
-        context.update(colors_data)
-
-        # Города и регионы для фильтра
-        locations_cache_key = 'active_locations'
-        locations = cache.get(locations_cache_key)
-
-        if not locations:
-            locations = {
-                'cities': CarAd.objects.filter(
-                    status='active', is_active=True
-                ).exclude(city_id=None).values_list(
-                    'city', flat=True
-                ).distinct().order_by('city')[:50],  # Ограничиваем до 50
-                'regions': CarAd.objects.filter(
-                    status='active', is_active=True
-                ).exclude(region='').values_list(
-                    'region', flat=True
-                ).distinct().order_by('region')
-            }
-            cache.set(locations_cache_key, locations, 300)
-
-        context.update(locations)
-
-        # Уникальные значения для дверей и мест
-        door_counts_cache_key = 'door_counts'
-        door_counts = cache.get(door_counts_cache_key)
-
-        if not door_counts:
-            door_counts = {
-                'door_options': CarAd.objects.filter(
-                    status='active', is_active=True,
-                    doors__isnull=False
-                ).values_list('doors', flat=True).distinct().order_by('doors'),
-                'seat_options': CarAd.objects.filter(
-                    status='active', is_active=True,
-                    seats__isnull=False
-                ).values_list('seats', flat=True).distinct().order_by('seats')
-            }
-            cache.set(door_counts_cache_key, door_counts, 300)
-
-        context.update(door_counts)
+        context['exterior_colors'] = terms['color_exterior'].values
+        context['interior_colors'] = terms['color_interior'].values
+        context['cities'] = terms['city'].values
+        context['regions'] = terms['region'].values
+        context['door_options'] = terms['doors'].values
+        context['seat_options'] = terms['seats'].values
 
         # Сохраняем текущие параметры фильтрации для шаблона
         context['current_filters'] = self.request.GET.dict()
 
-        # Добавляем общее количество объявлений в системе
-        total_ads_cache_key = 'total_active_ads'
-        total_ads = cache.get(total_ads_cache_key)
-
-        if not total_ads:
-            total_ads = CarAd.objects.filter(
-                status='active', is_active=True
-            ).count()
-            cache.set(total_ads_cache_key, total_ads, 60)  # 1 минута
-
-        context['total_active_ads'] = total_ads
+        # Общее количество активных объявлений (кэшируется, для больших - оценка)
+        context['total_active_ads'] = count_results(AdSearchIndex.objects.all())
 
         return context
 
@@ -802,13 +467,14 @@ class AdvertisementsListView(ListView):
                 f'Некорректные значения в параметрах: {", ".join(invalid_params)}. Исправьте фильтры.'
             )
 
-        # Сохраняем историю поиска для авторизованных пользователей
+        # Сохраняем историю поиска для авторизованных пользователей (пакетно, см. analytics.events)
         if request.user.is_authenticated and len(request.GET) > 0:
-            SearchHistory.objects.create(
-                user=request.user,
+            track_event(
+                'search_history',
+                user_id=request.user.pk,
                 search_query=request.GET.get('search', ''),
                 filters=request.GET.dict(),
-                results_count=0  # Будет обновлено позже
+                results_count=0
             )
 
         return super().get(request, *args, **kwargs)
@@ -838,23 +504,16 @@ class AdvertisementsDetailView(DetailView):
 
         # Сохраняем просмотр в историю
         if self.request.user.is_authenticated:
-            CarView.objects.create(
-                user=self.request.user,
-                car_ad=ad,
+            track_event(
+                'car_view',
+                user_id=self.request.user.pk,
+                car_ad_id=ad.pk,
                 ip_address=self.request.META.get('REMOTE_ADDR'),
                 user_agent=self.request.META.get('HTTP_USER_AGENT', '')
             )
 
-        # Похожие объявления
-        similar_ads = CarAd.objects.filter(
-            model__brand=ad.model.brand,
-            status='active',
-            is_active=True
-        ).exclude(id=ad.id).select_related(
-            'model__brand'
-        ).prefetch_related('photos').order_by('?')[:6]
-
-        context['similar_ads'] = similar_ads
+        # Похожие объявления (заранее рассчитанные соседи, см. similarity.py)
+        context['similar_ads'] = similar_ads_for(ad)
 
         # Проверяем, есть ли в избранном
         if self.request.user.is_authenticated:
@@ -878,6 +537,16 @@ class AdvertisementsDetailView(DetailView):
             raise Http404("Объявление не найдено")
 
 
+def report_ingested_photos(request, result):
+    """Сообщения о фото, которые не были добавлены"""
+    for name, reason in result.rejected:
+        messages.warning(request, f'Фото {name} не добавлено: {reason}')
+    if result.over_limit:
+        messages.warning(
+            request, f'Не добавлено {result.over_limit} фото: превышен лимит фотографий для вашего тарифа'
+        )
+
+
 class CarAdCreateView(LoginRequiredMixin, CreateView):
     """Создание нового объявления"""
     form_class = SimpleCarAdForm  # CarAdForm - была такая модель
@@ -926,14 +595,9 @@ class CarAdCreateView(LoginRequiredMixin, CreateView):
         response = super().form_valid(form)
 
         # Обработка фото
-        photos = self.request.FILES.getlist('photos')
-        for i, photo in enumerate(photos):
-            CarPhoto.objects.create(
-                car_ad=self.object,  # ← теперь self.object существует!
-                image=photo,
-                is_main=(i == 0),
-                position=i
-            )
+        report_ingested_photos(
+            self.request, ingest_photos(self.object, self.request.FILES.getlist('photos'), self.request.user)
+        )
 
         messages.success(self.request, message)
         return response
@@ -970,14 +634,9 @@ class AdUpdateView(LoginRequiredMixin, UpdateView):
         response = super().form_valid(form)
 
         # Обработка новых фото
-        photos = self.request.FILES.getlist('photos')
-        for i, photo in enumerate(photos):
-            CarPhoto.objects.create(
-                car_ad=self.object,
-                image=photo,
-                is_main=(i == 0 and not self.object.photos.exists()),
-                position=i + self.object.photos.count()
-            )
+        report_ingested_photos(
+            self.request, ingest_photos(self.object, self.request.FILES.getlist('photos'), self.request.user)
+        )
 
         messages.success(self.request, message)
         return response
@@ -1219,13 +878,7 @@ class AdSearchAPIView(View):
     def get(self, request):
         # Логика поиска
         search_query = request.GET.get('q', '')
-        results = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )[:10]
+        results = search_ads(search_query).select_related('model__brand')[:10]
 
         data = [
             {
@@ -1247,12 +900,7 @@ class SimilarAdsAPIView(View):
 
     def get(self, request, ad_id):
         try:
-            ad = CarAd.objects.get(id=ad_id)
-            similar_ads = CarAd.objects.filter(
-                model__brand=ad.model.brand,
-                status='active',
-                is_active=True
-            ).exclude(id=ad_id)[:6]
+            ad = CarAd.objects.only('id', 'brand_id').get(id=ad_id)
 
             data = [
                 {
@@ -1260,9 +908,9 @@ class SimilarAdsAPIView(View):
                     'title': similar_ad.title,
                     'price': str(similar_ad.price),
                     'slug': similar_ad.slug,
-                    'image': similar_ad.get_main_photo().image.url if similar_ad.get_main_photo() else ''
+                    'image': similar_ad.main_photo_url,
                 }
-                for similar_ad in similar_ads
+                for similar_ad in similar_ads_for(ad)
             ]
 
             return JsonResponse({'results': data})
@@ -1397,45 +1045,34 @@ def export_ads_csv(request):
     return response
 
 
-class FilteredAdListView(ListView):
+class FilteredAdListView(CachedListingMixin, AdSearchIndexListMixin, ListView):
     """Список объявлений для фильтрации по slug (для filter_patterns)"""
     model = CarAd
     template_name = 'advertisements/ad_list.html'
     context_object_name = 'advertisements'
     paginate_by = 20
 
-    def get_queryset(self):
-        queryset = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).select_related('model__brand', 'owner')
-
-        # Обработка slug из URL
-        if 'brand_slug' in self.kwargs:
-            brand_slug = self.kwargs['brand_slug']
-            queryset = queryset.filter(model__brand__slug=brand_slug)
-
-        elif 'model_slug' in self.kwargs:
-            model_slug = self.kwargs['model_slug']
-            queryset = queryset.filter(model__slug=model_slug)
-
-        elif 'city_slug' in self.kwargs:
-            city_slug = self.kwargs['city_slug']
-            queryset = queryset.filter(city__slug=city_slug)
+    # Параметр URL -> параметр спецификации фильтров
+    url_params = {
+        'brand_slug': 'brand',
+        'model_slug': 'model',
+        'city_slug': 'city',
+        'min_price': 'min_price',
+        'max_price': 'max_price',
+        'min_year': 'min_year',
+        'max_year': 'max_year',
+    }
+
+    def get_listing_params(self):
+        # Фильтр из URL дополняет GET-параметры боковой панели
+        params = self.request.GET.copy()
+        for kwarg, param in self.url_params.items():
+            if kwarg in self.kwargs:
+                params[param] = str(self.kwargs[kwarg])
+        return params
 
-        elif 'min_price' in self.kwargs and 'max_price' in self.kwargs:
-            queryset = queryset.filter(
-                price__gte=self.kwargs['min_price'],
-                price__lte=self.kwargs['max_price']
-            )
-
-        elif 'min_year' in self.kwargs and 'max_year' in self.kwargs:
-            queryset = queryset.filter(
-                year__gte=self.kwargs['min_year'],
-                year__lte=self.kwargs['max_year']
-            )
-
-        return queryset
+    def get_queryset(self):
+        return self.filters.apply(AdSearchIndex.objects.all())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -0,0 +1,204 @@
+# apps/analytics/events.py
+"""
+Пакетная запись событий аналитики (просмотры, поиски, активность).
+
+track_event() ничего не пишет в БД: событие сериализуется в JSON и
+добавляется в список Redis (один RPUSH). Очередь ограничена
+MAX_QUEUE_LENGTH: при переполнении новые события отбрасываются и
+учитываются в счетчике потерь. Периодическая задача drain_events()
+забирает события пачками (LPOP с count) и пишет их bulk_create.
+
+Время события (EVENT_TIME_FIELDS) фиксируется в track_event() и
+записывается явно, поэтому не зависит от задержки выгрузки.
+"""
+import json
+import logging
+from collections import Counter, defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, InterfaceError, OperationalError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'analytics:events'
+DROPPED_KEY = 'analytics:dropped'
+MAX_QUEUE_LENGTH = 500000
+DRAIN_BATCH_SIZE = 5000
+DRAIN_MAX_BATCHES = 20
+
+# Тип события -> модель
+EVENT_MODELS = {
+    'car_view': 'apps.advertisements.models.CarView',
+    'search_history': 'apps.advertisements.models.SearchHistory',
+    'page_view': 'apps.analytics.models.PageView',
+    'search': 'apps.analytics.models.SearchAnalytics',
+    'user_activity': 'apps.users.models_profile.UserActivity',
+}
+
+# Тип события -> поле времени события
+EVENT_TIME_FIELDS = {
+    'car_view': 'viewed_at',
+    'search_history': 'created_at',
+    'page_view': 'viewed_at',
+    'search': 'searched_at',
+    'user_activity': 'created_at',
+}
+
+# Потери в текущем процессе, когда недоступен сам Redis
+local_dropped = Counter()
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def track_event(event_type, **fields):
+    """
+    Записать событие (fire-and-forget: ошибки Redis не пробрасываются).
+
+    fields - значения полей модели; для внешних ключей передаются id
+    (user_id=..., car_ad_id=...). Время события - момент вызова.
+    """
+    if event_type not in EVENT_MODELS:
+        raise ValueError(f'Неизвестный тип события: {event_type}')
+
+    fields.setdefault(EVENT_TIME_FIELDS[event_type], timezone.now())
+
+    payload = json.dumps({'type': event_type, 'fields': fields}, cls=DjangoJSONEncoder)
+    try:
+        redis = _redis()
+        length = redis.rpush(QUEUE_KEY, payload)
+        if length > MAX_QUEUE_LENGTH:
+            # Очередь переполнена: выгрузка не успевает, лишнее отбрасываем
+            pipe = redis.pipeline()
+            pipe.ltrim(QUEUE_KEY, 0, MAX_QUEUE_LENGTH - 1)
+            pipe.hincrby(DROPPED_KEY, event_type, length - MAX_QUEUE_LENGTH)
+            pipe.execute()
+    except (NotImplementedError, RedisError):
+        local_dropped[event_type] += 1
+        if local_dropped[event_type] == 1 or local_dropped[event_type] % 1000 == 0:
+            logger.warning(
+                'Очередь аналитики недоступна, потеряно событий %s: %s',
+                event_type, local_dropped[event_type]
+            )
+
+
+def _fit(model, fields):
+    """Строки длиннее max_length поля обрезаются (поисковый запрос и т.п.)"""
+    for field in model._meta.concrete_fields:
+        value = fields.get(field.attname)
+        max_length = getattr(field, 'max_length', None)
+        if max_length and isinstance(value, str) and len(value) > max_length:
+            fields[field.attname] = value[:max_length]
+    return fields
+
+
+def _insert(model, rows):
+    """
+    bulk_create строк одного типа.
+
+    Если пачка не записывается (объявление удалено до выгрузки,
+    недопустимое значение), строки пишутся по одной, каждая в своей точке
+    сохранения, ошибочные отбрасываются: такая пачка не запишется и при
+    повторе. Ошибка соединения пробрасывается - пачку можно повторить.
+    Возвращает (записано, отброшено).
+    """
+    rows = [_fit(model, fields) for fields in rows]
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([model(**fields) for fields in rows], batch_size=1000)
+        return len(rows), 0
+    except (OperationalError, InterfaceError):
+        raise
+    except (DatabaseError, TypeError, ValueError):
+        pass
+
+    written = 0
+    for fields in rows:
+        try:
+            with transaction.atomic():
+                model.objects.create(**fields)
+            written += 1
+        except (OperationalError, InterfaceError):
+            raise
+        except (DatabaseError, TypeError, ValueError) as exc:
+            logger.warning('Событие аналитики %s отброшено: %s', model.__name__, exc)
+    return written, len(rows) - written
+
+
+def _write(events):
+    """Запись пачки событий в одной транзакции; возвращает (записано, отброшено по типам)"""
+    grouped = defaultdict(list)
+    for raw in events:
+        try:
+            event = json.loads(raw)
+            if event['type'] not in EVENT_MODELS:
+                raise KeyError(event['type'])
+            grouped[event['type']].append(dict(event['fields']))
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Некорректное событие аналитики пропущено: %r', raw[:200])
+
+    written, dropped = 0, Counter()
+    with transaction.atomic():
+        for event_type, rows in grouped.items():
+            model = import_string(EVENT_MODELS[event_type])
+            type_written, type_dropped = _insert(model, rows)
+            written += type_written
+            if type_dropped:
+                dropped[event_type] += type_dropped
+    return written, dropped
+
+
+def drain_events(batch_size=DRAIN_BATCH_SIZE, max_batches=DRAIN_MAX_BATCHES):
+    """
+    Выгрузить накопленные события в БД.
+
+    За один вызов - не больше max_batches пачек по batch_size событий.
+    Если БД недоступна, пачка возвращается в начало очереди; события,
+    которые не записываются из-за своих данных, отбрасываются и
+    учитываются в счетчике потерь.
+    """
+    redis = _redis()
+    written = 0
+    for _ in range(max_batches):
+        events = redis.lpop(QUEUE_KEY, batch_size)
+        if not events:
+            break
+        try:
+            batch_written, dropped = _write(events)
+        except (OperationalError, InterfaceError):
+            logger.exception('Не удалось записать пачку событий аналитики')
+            redis.lpush(QUEUE_KEY, *reversed(events))
+            break
+        except DatabaseError:
+            # Пачка не записывается не из-за соединения - повтор не поможет
+            logger.exception('Пачка событий аналитики отброшена')
+            batch_written, dropped = 0, Counter(unwritable=len(events))
+
+        written += batch_written
+        if dropped:
+            pipe = redis.pipeline()
+            for event_type, count in dropped.items():
+                pipe.hincrby(DROPPED_KEY, event_type, count)
+            pipe.execute()
+        if len(events) < batch_size:
+            break
+    return written
+
+
+def queue_stats():
+    """Длина очереди и счетчики потерь (для мониторинга)"""
+    redis = _redis()
+    pipe = redis.pipeline()
+    pipe.llen(QUEUE_KEY)
+    pipe.hgetall(DROPPED_KEY)
+    length, dropped = pipe.execute()
+    return {
+        'queued': length,
+        'dropped': {key.decode(): int(value) for key, value in dropped.items()},
+        'dropped_locally': dict(local_dropped),
+    }
@@ -1,5 +1,6 @@
 # apps/analytics/models.py
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from apps.users.models import TimeStampedModel, User
 
@@ -65,7 +66,7 @@ class PageView(TimeStampedModel):
     os = models.CharField(_('Операционная система'), max_length=100, blank=True)
 
     # Время
-    viewed_at = models.DateTimeField(_('Время просмотра'), auto_now_add=True)
+    viewed_at = models.DateTimeField(_('Время просмотра'), default=timezone.now, editable=False)
     time_on_page = models.IntegerField(_('Время на странице (сек)'), null=True, blank=True)
 
     def __str__(self):
@@ -115,7 +116,7 @@ class SearchAnalytics(TimeStampedModel):
     session_id = models.CharField(_('ID сессии'), max_length=100, blank=True)
 
     # Время
-    searched_at = models.DateTimeField(_('Время поиска'), auto_now_add=True)
+    searched_at = models.DateTimeField(_('Время поиска'), default=timezone.now, editable=False)
 
     def __str__(self):
         return f'Поиск: "{self.query}"'
@@ -0,0 +1,10 @@
+# apps/analytics/tasks.py
+from celery import shared_task
+
+from .events import drain_events
+
+
+@shared_task(ignore_result=True)
+def drain_events_task():
+    """Выгрузка накопленных событий аналитики в БД"""
+    return drain_events()
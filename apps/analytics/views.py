@@ -2,11 +2,12 @@
 from django.shortcuts import render
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView, View
-from django.db.models import Count, Sum, Avg, Q
+from django.db.models import Count, F, Sum, Avg, Q
 from django.utils import timezone
 from datetime import timedelta
 from django.http import JsonResponse
 from .models import PageView, SearchAnalytics, UserActivity, DailyStats
+from apps.advertisements.counters import ACTIVE_ADS, ALL_ADS, ALL_USERS, get_counts
 from apps.advertisements.models import CarAd
 from apps.users.models import User
 from apps.catalog.models import CarBrand, CarModel
@@ -29,8 +30,11 @@ class AnalyticsDashboardView(LoginRequiredMixin, TemplateView):
         end_date = timezone.now()
         start_date = end_date - timedelta(days=30)
 
+        # Итоговые количества - из счетчиков сайта
+        counts = get_counts(ALL_USERS, ALL_ADS, ACTIVE_ADS)
+
         # Статистика по пользователям
-        context['total_users'] = User.objects.count()
+        context['total_users'] = counts[ALL_USERS]
         context['new_users'] = User.objects.filter(
             date_joined__gte=start_date
         ).count()
@@ -39,11 +43,8 @@ class AnalyticsDashboardView(LoginRequiredMixin, TemplateView):
         ).count()
 
         # Статистика по объявлениям
-        context['total_ads'] = CarAd.objects.count()
-        context['active_ads'] = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).count()
+        context['total_ads'] = counts[ALL_ADS]
+        context['active_ads'] = counts[ACTIVE_ADS]
         context['new_ads'] = CarAd.objects.filter(
             created_at__gte=start_date
         ).count()
@@ -55,8 +56,8 @@ class AnalyticsDashboardView(LoginRequiredMixin, TemplateView):
 
         # Популярные марки
         context['popular_brands'] = CarBrand.objects.annotate(
-            ad_count=Count('models__ads', filter=Q(models__ads__status='active'))
-        ).order_by('-ad_count')[:10]
+            ad_count=F('ads_count')
+        ).order_by('-ads_count')[:10]
 
         # Ежедневная статистика для графика
         daily_stats = DailyStats.objects.filter(
@@ -27,12 +27,18 @@ class CarBrand(TimeStampedModel):
         db_table = 'car_brands'
         verbose_name = _('Марка автомобиля')
         verbose_name_plural = _('Марки автомобилей')
+        indexes = [
+            # «Топ» марок - просмотр индекса
+            models.Index(fields=['-ads_count'], name='car_brands_ads_count_idx', condition=models.Q(is_active=True)),
+        ]
 
     name = models.CharField(_('Название'), max_length=100, unique=True)
     slug = models.SlugField(_('Slug'), max_length=120, unique=True)
     country = models.CharField(_('Страна'), max_length=2, default='RU')
     description = models.TextField(_('Описание'), blank=True)
     is_active = models.BooleanField(_('Активно'), default=True)
+    # Активные объявления; поддерживается приращениями (advertisements.counters)
+    ads_count = models.IntegerField(_('Количество объявлений'), default=0)
     logo = models.ImageField(
         _('Логотип'),
         upload_to=car_brand_logo_path,
@@ -74,6 +80,9 @@ class CarModel(TimeStampedModel):
         db_table = 'car_models'
         verbose_name = _('Модель автомобиля')
         verbose_name_plural = _('Модели автомобилей')
+        indexes = [
+            models.Index(fields=['-ads_count'], name='car_models_ads_count_idx', condition=models.Q(is_active=True)),
+        ]
 
     brand = models.ForeignKey(CarBrand, on_delete=models.CASCADE,
                               related_name='models', verbose_name=_('Марка'))
@@ -83,6 +92,8 @@ class CarModel(TimeStampedModel):
     year_start = models.IntegerField(_('Год начала выпуска'), null=True, blank=True)
     year_end = models.IntegerField(_('Год окончания выпуска'), null=True, blank=True)
     is_active = models.BooleanField(_('Активно'), default=True)
+    # Активные объявления; поддерживается приращениями (advertisements.counters)
+    ads_count = models.IntegerField(_('Количество объявлений'), default=0)
     description = models.TextField(_('Описание'), blank=True)
     image = models.ImageField(
         _('Изображение'),
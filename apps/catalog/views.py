@@ -7,10 +7,11 @@ from django.contrib import messages
 from django.db.models import Count, Q, Avg, Min, Max
 from django.urls import reverse_lazy
 from django.http import JsonResponse
-from django.core.cache import cache
 from apps.catalog.models import CarBrand, CarModel, CarFeature, CarFeatureCategory
+from apps.advertisements.autocomplete import suggest
 from apps.advertisements.models import CarAd
 from apps.reviews.models import Review
+from apps.core.tagged_cache import CATALOG, cached
 import json
 
 
@@ -585,74 +586,29 @@ class BodyTypeListAPIView(View):
 
 
 class SearchAutocompleteAPIView(View):
-    """API для автодополнения поиска"""
+    """API для автодополнения поиска: марки и модели (core:api_search_autocomplete добавляет объявления)"""
 
     def get(self, request, *args, **kwargs):
         query = request.GET.get('q', '').strip()
-
-        if len(query) < 2:
-            return JsonResponse([], safe=False)
-
-        # Поиск марок
-        brands = CarBrand.objects.filter(
-            name__icontains=query,
-            is_active=True
-        ).values('id', 'name', 'slug')[:5]
-
-        # Поиск моделей
-        models = CarModel.objects.filter(
-            Q(name__icontains=query) | Q(brand__name__icontains=query),
-            is_active=True
-        ).select_related('brand').values(
-            'id', 'name', 'slug', 'brand__name', 'brand__slug'
-        )[:10]
-
-        results = []
-
-        # Добавляем марки
-        for brand in brands:
-            results.append({
-                'type': 'brand',
-                'id': brand['id'],
-                'name': brand['name'],
-                'slug': brand['slug'],
-                'display': f"{brand['name']} (марка)",
-                'url': f"/catalog/brands/{brand['slug']}/"
-            })
-
-        # Добавляем модели
-        for model in models:
-            results.append({
-                'type': 'model',
-                'id': model['id'],
-                'name': model['name'],
-                'brand': model['brand__name'],
-                'slug': model['slug'],
-                'display': f"{model['brand__name']} {model['name']} (модель)",
-                'url': f"/catalog/models/{model['slug']}/"
-            })
-
-        return JsonResponse(results, safe=False)
+        return JsonResponse(suggest(query), safe=False)
 
 
 class StatsAPIView(View):
     """API для получения статистики каталога"""
 
     def get(self, request, *args, **kwargs):
-        cache_key = 'catalog_stats'
-        stats = cache.get(cache_key)
-
-        if not stats:
-            stats = {
-                'total_brands': CarBrand.objects.filter(is_active=True).count(),
-                'total_models': CarModel.objects.filter(is_active=True).count(),
-                'brands_by_country': self.get_brands_by_country_stats(),
-                'popular_brands': self.get_popular_brands(),
-                'recent_models': self.get_recent_models(),
-            }
-            cache.set(cache_key, stats, 300)  # Кэшируем на 5 минут
-
-        return JsonResponse(stats)
+        return JsonResponse(self.get_stats())
+
+    # Сбрасывается при изменении марок и моделей
+    @cached('catalog_stats', [CATALOG], metric='catalog_stats')
+    def get_stats(self):
+        return {
+            'total_brands': CarBrand.objects.filter(is_active=True).count(),
+            'total_models': CarModel.objects.filter(is_active=True).count(),
+            'brands_by_country': self.get_brands_by_country_stats(),
+            'popular_brands': self.get_popular_brands(),
+            'recent_models': self.get_recent_models(),
+        }
 
     def get_brands_by_country_stats(self):
         brands = CarBrand.objects.filter(is_active=True)
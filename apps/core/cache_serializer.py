@@ -0,0 +1,104 @@
+# apps/core/cache_serializer.py
+"""
+Компактное кодирование значений кэша Redis (SERIALIZER и COMPRESSOR
+django_redis).
+
+Простые данные (dict, list, str, числа, None) и строки таблиц кодируются
+msgpack: без имен классов и служебных опкодов pickle, и разбираются
+быстрее. Кортежи, Decimal, даты и SafeString передаются расширениями
+msgpack и восстанавливаются с тем же типом. Все остальное (dataclass,
+подклассы int и dict, модели) по-прежнему идет через pickle, поэтому
+кэшировать можно что угодно, а выигрыш получают значения, приведенные к
+строкам и словарям.
+
+Значения длиннее COMPRESS_MIN_LENGTH сжимаются zstd: короткие ключи
+сжимать невыгодно, а отрендеренные блоки и строки фасетов сжимаются в
+несколько раз.
+"""
+import datetime
+import pickle
+from decimal import Decimal
+
+import msgpack
+from django.utils.safestring import SafeString
+from django_redis.compressors.zstd import ZStdCompressor
+from django_redis.serializers.base import BaseSerializer
+
+# Первый байт значения msgpack (pickle протокола 2+ начинается с 0x80)
+MSGPACK_MARKER = b'\x01'
+
+COMPRESS_MIN_LENGTH = 1024
+
+# Коды расширений msgpack
+EXT_TUPLE = 1
+EXT_DECIMAL = 2
+EXT_DATETIME = 3
+EXT_DATE = 4
+EXT_SAFESTRING = 5
+
+
+def _default(value):
+    """Типы, которых нет в msgpack; для остальных - TypeError и pickle"""
+    value_type = type(value)
+    if value_type is tuple:
+        return msgpack.ExtType(EXT_TUPLE, _pack(list(value)))
+    if value_type is Decimal:
+        return msgpack.ExtType(EXT_DECIMAL, str(value).encode())
+    if value_type is datetime.datetime:
+        return msgpack.ExtType(EXT_DATETIME, value.isoformat().encode())
+    if value_type is datetime.date:
+        return msgpack.ExtType(EXT_DATE, value.isoformat().encode())
+    if value_type is SafeString:
+        return msgpack.ExtType(EXT_SAFESTRING, str.__str__(value).encode())
+    raise TypeError(f'{value_type.__name__} кодируется pickle')
+
+
+def _ext_hook(code, data):
+    if code == EXT_TUPLE:
+        return tuple(_unpack(data))
+    if code == EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == EXT_DATETIME:
+        return datetime.datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return datetime.date.fromisoformat(data.decode())
+    if code == EXT_SAFESTRING:
+        return SafeString(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def _pack(value):
+    # strict_types: подклассы (ResultCount, ReturnDict) не теряют тип молча
+    return msgpack.packb(value, default=_default, strict_types=True, use_bin_type=True)
+
+
+def _unpack(data):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def dumps(value):
+    try:
+        return MSGPACK_MARKER + _pack(value)
+    except (TypeError, ValueError, OverflowError):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    if data[:1] == MSGPACK_MARKER:
+        return _unpack(data[1:])
+    return pickle.loads(data)
+
+
+class CompactSerializer(BaseSerializer):
+    """msgpack для простых данных, pickle для остального"""
+
+    def dumps(self, value):
+        return dumps(value)
+
+    def loads(self, value):
+        return loads(value)
+
+
+class ThresholdZStdCompressor(ZStdCompressor):
+    """zstd только для значений длиннее COMPRESS_MIN_LENGTH"""
+    min_length = COMPRESS_MIN_LENGTH
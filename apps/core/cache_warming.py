@@ -0,0 +1,145 @@
+# apps/core/cache_warming.py
+"""
+Прогрев кэша после деплоя или очистки Redis.
+
+Заранее считаются значения, которые иначе достаются первым посетителям:
+справочник фильтров, снимок и статистика главной страницы, API и каталога,
+фасеты и количества результатов для списка без фильтров, каждой активной
+марки и самых частых наборов фильтров из истории поиска.
+
+Все значения читаются через get_or_compute, поэтому прогрев безопасен для
+повторного запуска: актуальные записи только читаются, пересчитываются
+отсутствующие и устаревшие, а одновременный пересчет с запросами
+посетителей исключен блокировкой. Цели выполняются параллельно в потоках.
+"""
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.db import connections
+from django.http import QueryDict
+from django.utils import timezone
+
+from apps.advertisements.facets import get_facets
+from apps.advertisements.filters import canonical_params, get_filter_refs, parse_listing_filters
+from apps.advertisements.models import AdSearchIndex, SearchHistory
+from apps.analytics.models import SearchAnalytics
+from apps.catalog.models import CarBrand
+from apps.core.counting import count_results
+from apps.core.home_snapshot import get_home_snapshot
+
+logger = logging.getLogger(__name__)
+
+WARM_WORKERS = 4
+# Сколько наборов фильтров из истории поиска прогревать
+TOP_FILTER_SETS = 50
+# Период и объем выборки истории поиска
+SEARCH_HISTORY_DAYS = 7
+SEARCH_HISTORY_SAMPLE = 5000
+
+
+@dataclass
+class WarmResult:
+    name: str
+    seconds: float
+    error: str = ''
+
+
+def _filter_params(params):
+    """Сохраненные фильтры (request.GET.dict()) -> QueryDict"""
+    query = QueryDict(mutable=True)
+    for name, value in params.items():
+        if value not in (None, ''):
+            query[name] = str(value)
+    return query
+
+
+def top_filter_sets(limit=TOP_FILTER_SETS, days=SEARCH_HISTORY_DAYS, sample=SEARCH_HISTORY_SAMPLE):
+    """
+    Самые частые непустые наборы фильтров за последние days дней.
+
+    Записи приводятся к каноническому виду (ListingFilters), поэтому
+    одинаковые поиски, записанные по-разному, считаются вместе.
+    """
+    since = timezone.now() - timezone.timedelta(days=days)
+    refs = get_filter_refs()
+    sources = (
+        SearchHistory.objects.filter(created_at__gte=since),
+        SearchAnalytics.objects.filter(searched_at__gte=since),
+    )
+
+    counts = Counter()
+    filter_sets = {}
+    for queryset in sources:
+        # Сортировка модели - сначала новые
+        for params in queryset.values_list('filters', flat=True)[:sample]:
+            if not isinstance(params, dict):
+                continue
+            filters = parse_listing_filters(_filter_params(params), refs)
+            if not filters.key:
+                continue
+            key = filters.cache_key()
+            counts[key] += 1
+            filter_sets.setdefault(key, filters)
+    return [filter_sets[key] for key, _ in counts.most_common(limit)]
+
+
+def warm_listing(filters):
+    """Фасеты и количество результатов списка с фильтрами filters"""
+    get_facets(filters)
+    count_results(filters.apply(AdSearchIndex.objects.all()))
+
+
+def warm_targets(top=TOP_FILTER_SETS):
+    """Список (имя, функция) для прогрева"""
+    # Импорт здесь: представления импортируют модули core
+    from api.views import StatsView
+    from apps.catalog.views import StatsAPIView
+    from apps.core.views import HomeStatsAPIView
+
+    refs = get_filter_refs()
+    targets = [
+        ('home_snapshot', get_home_snapshot),
+        ('home_stats', HomeStatsAPIView().cached_stats),
+        ('api_stats', StatsView().cached_stats),
+        ('catalog_stats', StatsAPIView().get_stats),
+        ('listing', lambda: warm_listing(parse_listing_filters(QueryDict(), refs))),
+    ]
+
+    for brand_id, slug in CarBrand.objects.filter(is_active=True).order_by('id').values_list('id', 'slug'):
+        filters = parse_listing_filters(QueryDict(f'brand={brand_id}'), refs)
+        targets.append((f'brand:{slug}', lambda filters=filters: warm_listing(filters)))
+
+    if top:
+        for filters in top_filter_sets(top):
+            label = '&'.join(f'{name}={value}' for name, value in canonical_params(filters.key).items())
+            targets.append((f'filters:{label}', lambda filters=filters: warm_listing(filters)))
+    return targets
+
+
+def _run(name, func):
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception as exc:
+        logger.exception('Прогрев %s не удался', name)
+        return WarmResult(name, time.perf_counter() - started, str(exc) or type(exc).__name__)
+    finally:
+        # Соединения с БД у каждого потока свои
+        connections.close_all()
+    return WarmResult(name, time.perf_counter() - started)
+
+
+def warm_cache(workers=WARM_WORKERS, top=TOP_FILTER_SETS):
+    """
+    Прогреть кэш; возвращает список WarmResult в порядке целей.
+
+    Справочник фильтров считается первым: от него зависят все списки.
+    """
+    results = [_run('filter_refs', get_filter_refs)]
+    targets = warm_targets(top)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results.extend(executor.map(lambda target: _run(*target), targets))
+    return results
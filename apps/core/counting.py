@@ -0,0 +1,123 @@
+# apps/core/counting.py
+"""
+Дешевый подсчет количества результатов для списков.
+
+Точный COUNT(*) по широкому фильтру часто дороже выборки самой страницы,
+поэтому количество считается с ограничением: не дальше COUNT_THRESHOLD
+строк (SELECT COUNT(*) FROM (... LIMIT N+1)). Если строк больше, берется
+оценка планировщика PostgreSQL и показывается приблизительное значение
+(«10 000+»). Результат кэшируется по SQL запроса без сортировки: один и
+тот же канонический набор фильтров (FilterKey) компилируется в один и тот
+же SQL, поэтому одинаковые поиски, записанные по-разному, делят кэш.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+from .tagged_cache import get_or_compute
+
+# Сколько строк считаем точно
+COUNT_THRESHOLD = getattr(settings, 'RESULT_COUNT_THRESHOLD', 10000)
+# Точное значение быстро устаревает, оценка - медленнее
+COUNT_CACHE_TIMEOUT = 60
+ESTIMATE_CACHE_TIMEOUT = 300
+
+
+class ResultCount(int):
+    """
+    Количество результатов (ведет себя как int).
+
+    approximate=True - значение оценочное, в шаблонах выводится как «10 000+».
+    """
+
+    def __new__(cls, value, approximate=False):
+        count = super().__new__(cls, value)
+        count.approximate = approximate
+        return count
+
+    def __reduce__(self):
+        return (ResultCount, (int(self), self.approximate))
+
+    def __repr__(self):
+        return f'ResultCount({int(self)}, approximate={self.approximate})'
+
+    def __str__(self):
+        return self.display
+
+    @property
+    def display(self):
+        value = int(self)
+        if self.approximate:
+            value = _round_down(value)
+        text = f'{value:,}'.replace(',', ' ')
+        return f'{text}+' if self.approximate else text
+
+
+def _round_down(value):
+    """Округление вниз до двух значащих цифр: 154 321 -> 150 000"""
+    if value < 100:
+        return value
+    step = 10 ** (len(str(value)) - 2)
+    return value // step * step
+
+
+def _cache_key(queryset):
+    sql, params = queryset.order_by().query.sql_with_params()
+    raw = f'{queryset.db}:{sql}:{params!r}'
+    return 'result_count_' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def planner_estimate(queryset):
+    """Оценка количества строк планировщиком PostgreSQL (None для других БД)"""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+    except (DatabaseError, ValueError):
+        return None
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_results(queryset, threshold=COUNT_THRESHOLD):
+    """
+    Количество строк queryset: точное до threshold, дальше оценка.
+
+    Возвращает ResultCount.
+    """
+    def compute():
+        # COUNT по подзапросу с LIMIT читает не больше threshold + 1 строк
+        value = queryset.order_by().values('pk')[:threshold + 1].count()
+        if value <= threshold:
+            return (value, False)
+        estimate = planner_estimate(queryset) or 0
+        return (max(estimate, threshold), True)
+
+    # В кэше пара (значение, приблизительное)
+    value, approximate = get_or_compute(
+        _cache_key(queryset), (), compute, _count_timeout, metric='result_count'
+    )
+    return ResultCount(value, approximate=approximate)
+
+
+def _count_timeout(result):
+    return ESTIMATE_CACHE_TIMEOUT if result[1] else COUNT_CACHE_TIMEOUT
+
+
+class CountingPaginator(Paginator):
+    """Paginator с кэшированным и оценочным количеством результатов"""
+
+    count_threshold = COUNT_THRESHOLD
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return count_results(self.object_list, self.count_threshold)
+        return ResultCount(len(self.object_list))
+
+    @property
+    def count_is_approximate(self):
+        return getattr(self.count, 'approximate', False)
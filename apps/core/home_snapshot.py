@@ -0,0 +1,117 @@
+# apps/core/home_snapshot.py
+"""
+Снимок блоков главной страницы.
+
+Марки, итоги, регионы и списки объявлений считаются фоновой задачей
+(refresh_home_snapshot_task) в один словарь из простых данных: id
+объявлений с URL миниатюры, строки марок и регионов. Представление берет
+снимок из кэша (обычно из памяти процесса) и одним in_bulk загружает
+объявления: снятые с публикации после расчета снимка отбрасываются.
+
+SNAPSHOT_FORMAT входит в ключ: после изменения состава снимка старые
+записи не читаются.
+"""
+from django.db.models import Count
+from django.utils import timezone
+
+from apps.advertisements.counters import (
+    ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS, get_counts, top_regions
+)
+from apps.advertisements.models import AdSearchIndex, CarAd
+from apps.catalog.models import CarBrand
+
+from .tagged_cache import get_or_compute, refresh
+
+SNAPSHOT_FORMAT = 1
+HOME_SNAPSHOT_KEY = f'home_snapshot_v{SNAPSHOT_FORMAT}'
+# Задача обновляет снимок каждые 5 минут; таймаут - на случай ее остановки
+HOME_SNAPSHOT_TIMEOUT = 15 * 60
+
+POPULAR_BRANDS = 12
+SEARCH_SUGGESTIONS = 10
+RECENT_ADS = 8
+FEATURED_ADS = 6
+TOP_REGIONS = 6
+
+
+def _ad_cards(queryset, limit):
+    """Карточки объявлений из индекса: id и миниатюра"""
+    return [
+        {'id': ad_id, 'main_photo_url': photo_url}
+        for ad_id, photo_url in queryset.values_list('ad_id', 'main_photo_url')[:limit]
+    ]
+
+
+def build_home_snapshot():
+    """Данные блоков главной страницы (только активные объявления)"""
+    index = AdSearchIndex.objects.all()
+
+    # Количество объявлений марок (ads_count) и итоги - из счетчиков сайта
+    # Подсказки поиска - начало того же списка (SEARCH_SUGGESTIONS <= POPULAR_BRANDS)
+    brands = list(
+        CarBrand.objects.filter(is_active=True)
+        .annotate(models_count=Count('models'))
+        .order_by('-ads_count', 'name')
+        .values('id', 'name', 'slug', 'logo', 'models_count', 'ads_count')[:POPULAR_BRANDS]
+    )
+    counts = get_counts(ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS)
+
+    return {
+        'built_at': timezone.now().isoformat(),
+        'total_ads': counts[ACTIVE_ADS],
+        'total_brands': counts[ACTIVE_BRANDS],
+        'total_models': counts[ACTIVE_MODELS],
+        'total_users': counts[ACTIVE_USERS],
+        'popular_brands': brands[:POPULAR_BRANDS],
+        'search_suggestions': [brand for brand in brands if brand['ads_count'] > 0][:SEARCH_SUGGESTIONS],
+        'recent_ads': _ad_cards(index.order_by('-created_at', '-ad_id'), RECENT_ADS),
+        'featured_ads': _ad_cards(index.order_by('-views_count', '-ad_id'), FEATURED_ADS),
+        'top_regions': [{'region': region, 'count': count} for region, count in top_regions(TOP_REGIONS)],
+    }
+
+
+def get_home_snapshot():
+    """Снимок из кэша; без него (первый запуск) считается на месте"""
+    return get_or_compute(
+        HOME_SNAPSHOT_KEY, (), build_home_snapshot, HOME_SNAPSHOT_TIMEOUT, metric='home_snapshot'
+    )
+
+
+def refresh_home_snapshot():
+    return refresh(
+        HOME_SNAPSHOT_KEY, (), build_home_snapshot, HOME_SNAPSHOT_TIMEOUT, metric='home_snapshot'
+    )
+
+
+def snapshot_brands(rows):
+    """Несохраняемые объекты CarBrand для шаблона (brand.logo.url и т.п.)"""
+    brands = []
+    for row in rows:
+        brand = CarBrand(id=row['id'], name=row['name'], slug=row['slug'], logo=row['logo'])
+        brand.models_count = row['models_count']
+        brand.ads_count = row['ads_count']
+        brands.append(brand)
+    return brands
+
+
+def snapshot_ads(snapshot, *blocks):
+    """
+    Объявления блоков снимка одним запросом: {блок: [CarAd, ...]}.
+
+    Объявления, снятые с публикации после расчета снимка, пропускаются.
+    """
+    ids = {card['id'] for block in blocks for card in snapshot[block]}
+    ads = CarAd.objects.filter(
+        status='active', is_active=True
+    ).select_related('model__brand', 'city').in_bulk(ids)
+
+    result = {}
+    for block in blocks:
+        result[block] = []
+        for card in snapshot[block]:
+            ad = ads.get(card['id'])
+            if ad is None:
+                continue
+            ad.main_photo_url = card['main_photo_url']
+            result[block].append(ad)
+    return result
@@ -0,0 +1,223 @@
+# apps/core/image_resize.py
+"""
+Уменьшенные копии загруженных изображений по подписанным URL.
+
+URL вида /media/r/<ширина>x<высота>/<путь>?s=<подпись> (resized_url,
+srcset) отдает изображение, вписанное в прямоугольник; 0 - сторона не
+ограничена. Подпись не дает запрашивать произвольные размеры, источники
+ограничены каталогами фото объявлений, логотипов марок, изображений
+моделей и аватаров.
+
+Копия создается один раз пулом потоков ограниченного размера и хранится
+на диске (IMAGE_RESIZE_CACHE_DIR). Одновременные запросы одной копии в
+процессе ждут один и тот же пересчет. Файл пишется во временный и
+переименовывается, поэтому параллельная запись из другого процесса
+безопасна. В имя копии входит время изменения оригинала: замененный
+файл получает новую копию.
+
+Размер кэша ограничен IMAGE_RESIZE_CACHE_SIZE: при превышении удаляются
+давно не запрошенные файлы (время изменения обновляется при обращении,
+не чаще раза в час).
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.signing import Signer
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image, ImageOps
+
+RESIZE_CACHE_DIR = getattr(
+    settings, 'IMAGE_RESIZE_CACHE_DIR', os.path.join(os.path.dirname(settings.MEDIA_ROOT), 'resize_cache')
+)
+RESIZE_CACHE_SIZE = getattr(settings, 'IMAGE_RESIZE_CACHE_SIZE', 2 * 1024 ** 3)
+RESIZE_WORKERS = getattr(settings, 'IMAGE_RESIZE_WORKERS', 4)
+# Внутренняя location прокси для каталога копий (apps.core.media_serving)
+RESIZE_ACCEL_PREFIX = getattr(settings, 'IMAGE_RESIZE_ACCEL_PREFIX', '/protected-resized/')
+# Сколько запрос ждет пересчета, секунд
+RESIZE_TIMEOUT = 30
+# После превышения бюджета кэш уменьшается до этой доли
+EVICT_TO = 0.9
+# Обновлять время обращения не чаще
+TOUCH_INTERVAL = 60 * 60
+
+MAX_DIMENSION = 2560
+SRCSET_WIDTHS = (320, 640, 960, 1280, 1920)
+
+# Каталоги, из которых можно получать копии (upload_to полей изображений)
+SOURCE_PREFIXES = ('cars/photos/', 'brands/logos/', 'models/images/', 'avatars/')
+
+# Расширение -> (формат PIL, параметры кодирования)
+OUTPUT_FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', {'optimize': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+_signer = Signer(salt='apps.core.image_resize')
+_executor = ThreadPoolExecutor(max_workers=RESIZE_WORKERS, thread_name_prefix='image-resize')
+_pending = {}
+_pending_lock = threading.Lock()
+_evict_lock = threading.Lock()
+# Оценка размера кэша в этом процессе; уточняется при каждом вытеснении
+_cache_size = None
+
+
+class InvalidResize(Exception):
+    """Неверная подпись, размер или путь"""
+
+
+def _signature(path, width, height):
+    return _signer.signature(f'{width}x{height}/{path}')
+
+
+def resized_url(image, width, height=0):
+    """Подписанный URL копии image (FieldFile или имя файла) размером не больше width x height"""
+    name = getattr(image, 'name', image)
+    if not name:
+        return ''
+    url = reverse('resized_image', kwargs={'width': width, 'height': height, 'path': name})
+    return f'{url}?{urlencode({"s": _signature(name, width, height)})}'
+
+
+def srcset(image, widths=SRCSET_WIDTHS):
+    """Значение атрибута srcset: копии image нужных ширин"""
+    if not getattr(image, 'name', image):
+        return ''
+    return ', '.join(f'{resized_url(image, width)} {width}w' for width in widths)
+
+
+def resized_accel_uri(target):
+    """Адрес файла копии во внутренней location прокси"""
+    return RESIZE_ACCEL_PREFIX + os.path.relpath(target, RESIZE_CACHE_DIR).replace(os.sep, '/')
+
+
+def _check(path, width, height, signature):
+    if not constant_time_compare(signature or '', _signature(path, width, height)):
+        raise InvalidResize('Неверная подпись')
+    if not (width or height) or width > MAX_DIMENSION or height > MAX_DIMENSION:
+        raise InvalidResize('Неверный размер')
+    if '..' in path.split('/') or not path.startswith(SOURCE_PREFIXES):
+        raise InvalidResize('Недопустимый путь')
+    if os.path.splitext(path)[1].lower().lstrip('.') not in OUTPUT_FORMATS:
+        raise InvalidResize('Неподдерживаемый формат')
+
+
+def _cache_path(path, width, height, source_mtime):
+    ext = os.path.splitext(path)[1].lower()
+    digest = hashlib.sha1(f'{width}x{height}/{path}/{source_mtime}'.encode()).hexdigest()
+    return os.path.join(RESIZE_CACHE_DIR, digest[:2], f'{digest}{ext}')
+
+
+def _touch(target):
+    """Отметить обращение для вытеснения давно не используемых копий"""
+    try:
+        if time.time() - os.stat(target).st_mtime > TOUCH_INTERVAL:
+            os.utime(target)
+    except OSError:
+        pass
+
+
+def _render(source, target, width, height):
+    if os.path.exists(target):
+        return target
+    pil_format, params = OUTPUT_FORMATS[os.path.splitext(target)[1].lstrip('.')]
+
+    with Image.open(source) as image:
+        image.draft('RGB', (width or MAX_DIMENSION, height or MAX_DIMENSION))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width or MAX_DIMENSION, height or MAX_DIMENSION), Image.Resampling.LANCZOS)
+        if pil_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                image.save(output, format=pil_format, **params)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    _account(os.path.getsize(target))
+    return target
+
+
+def _account(size):
+    global _cache_size
+    with _evict_lock:
+        if _cache_size is not None:
+            _cache_size += size
+        if _cache_size is None or _cache_size > RESIZE_CACHE_SIZE:
+            _cache_size = evict()
+
+
+def evict(budget=None):
+    """
+    Удалить давно не запрошенные копии, если кэш больше бюджета.
+
+    Возвращает размер кэша после очистки.
+    """
+    budget = RESIZE_CACHE_SIZE if budget is None else budget
+    entries = []
+    total = 0
+    for root, _, files in os.walk(RESIZE_CACHE_DIR):
+        for name in files:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= budget:
+        return total
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= budget * EVICT_TO:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+    return total
+
+
+def get_resized(path, width, height, signature):
+    """
+    Путь к файлу копии на диске; создает ее при первом запросе.
+
+    InvalidResize - запрос не разрешен, FileNotFoundError - нет оригинала.
+    """
+    _check(path, width, height, signature)
+    source = default_storage.path(path)
+    target = _cache_path(path, width, height, os.stat(source).st_mtime_ns)
+    if os.path.exists(target):
+        _touch(target)
+        return target
+
+    with _pending_lock:
+        future = _pending.get(target)
+        if future is None:
+            future = _executor.submit(_render, source, target, width, height)
+            _pending[target] = future
+            future.add_done_callback(lambda _: _forget(target))
+    return future.result(timeout=RESIZE_TIMEOUT)
+
+
+def _forget(target):
+    with _pending_lock:
+        _pending.pop(target, None)
@@ -0,0 +1,70 @@
+# apps/core/local_cache.py
+"""
+Кэш первого уровня (L1) в памяти процесса.
+
+Небольшой LRU с коротким сроком жизни перед Redis (L2) для часто читаемых
+и редко меняющихся значений: справочник фильтров, фасеты, статистика.
+Записи хранятся вместе с поколениями своих тегов: bump_tags в этом
+процессе удаляет их сразу, а изменения из других процессов tagged_cache
+замечает, сверяя поколения с Redis (один get_many на запрос). ttl
+ограничивает возраст записи независимо от тегов.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+    """Потокобезопасный LRU с ограничением размера и срока жизни"""
+
+    def __init__(self, max_size=1000, ttl=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_entry(self, key):
+        """(значение, {тег: поколение}) или None"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, versions, stored_at = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, versions
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key, value, versions=()):
+        """versions - {тег: поколение} или просто теги"""
+        if not isinstance(versions, dict):
+            versions = dict.fromkeys(versions)
+        with self._lock:
+            self._entries[key] = (value, versions, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict_tags(self, tags):
+        """Удалить записи с любым из тегов"""
+        tags = set(tags)
+        with self._lock:
+            for key in [key for key, (_, versions, _) in self._entries.items() if tags.intersection(versions)]:
+                del self._entries[key]
+
+    def tags(self):
+        """Теги всех записей"""
+        with self._lock:
+            return {tag for _, versions, _ in self._entries.values() for tag in versions}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,135 @@
+# apps/core/management/commands/cache_benchmark.py
+import pickle
+import time
+
+import pyzstd
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from apps.advertisements.facets import _facet_rows, _row_dicts, build_facets
+from apps.advertisements.filters import ListingFilters, load_filter_refs
+from apps.advertisements.models import AdSearchIndex
+from apps.core import cache_serializer
+
+# Ключи кэша, значения которых берутся в сравнение
+CACHED_PATTERNS = (
+    'ad_listing_*',
+    'ad_facets_*',
+    'result_count_*',
+    'ad_filter_refs',
+    '*_stats',
+)
+
+
+def _pickle_zstd_dumps(value):
+    return pyzstd.compress(pickle.dumps(value, pickle.DEFAULT_PROTOCOL))
+
+
+def _pickle_zstd_loads(data):
+    return pickle.loads(pyzstd.decompress(data))
+
+
+def _compact_dumps(value):
+    data = cache_serializer.dumps(value)
+    if len(data) > cache_serializer.COMPRESS_MIN_LENGTH:
+        return pyzstd.compress(data)
+    return data
+
+
+def _compact_loads(data):
+    try:
+        data = pyzstd.decompress(data)
+    except pyzstd.ZstdError:
+        pass
+    return cache_serializer.loads(data)
+
+
+# Вариант -> (кодирование, декодирование)
+ENCODINGS = {
+    'pickle': (lambda value: pickle.dumps(value, pickle.DEFAULT_PROTOCOL), pickle.loads),
+    'pickle+zstd': (_pickle_zstd_dumps, _pickle_zstd_loads),
+    'compact': (cache_serializer.dumps, cache_serializer.loads),
+    'compact+zstd': (_compact_dumps, _compact_loads),
+}
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает размер и время (де)сериализации значений кэша: pickle и msgpack с zstd'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Сколько раз кодировать каждое значение',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=5,
+            help='Сколько значений каждого вида взять из Redis',
+        )
+
+    def handle(self, *args, **options):
+        samples = self.computed_samples() + self.cached_samples(options['limit'])
+        if not samples:
+            self.stdout.write('Нет значений для сравнения')
+            return
+
+        totals = {name: 0 for name in ENCODINGS}
+        header = f'{"значение":<40}' + ''.join(f'{name:>30}' for name in ENCODINGS)
+        self.stdout.write(header)
+        self.stdout.write(' ' * 40 + ''.join(f'{"байт / кодир. / декод. мкс":>30}' for _ in ENCODINGS))
+
+        for label, value in samples:
+            row = f'{label[:39]:<40}'
+            for name, (dumps, loads) in ENCODINGS.items():
+                size, encode_time, decode_time = self.measure(value, dumps, loads, options['iterations'])
+                totals[name] += size
+                row += f'{f"{size} / {encode_time:.0f} / {decode_time:.0f}":>30}'
+            self.stdout.write(row)
+
+        baseline = totals['pickle'] or 1
+        self.stdout.write('')
+        for name, total in totals.items():
+            self.stdout.write(f'{name:<15} {total:>10} байт ({total / baseline:.0%} от pickle)')
+
+    def measure(self, value, dumps, loads, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            data = dumps(value)
+        encoded = time.perf_counter()
+        for _ in range(iterations):
+            loads(data)
+        decoded = time.perf_counter()
+        return (
+            len(data),
+            (encoded - started) / iterations * 1e6,
+            (decoded - encoded) / iterations * 1e6,
+        )
+
+    def computed_samples(self):
+        """Значения в старом (объекты) и новом (строки, словари) виде"""
+        filters = ListingFilters()
+        columns, rows = _facet_rows(filters, AdSearchIndex.objects.all())
+        refs = load_filter_refs()
+        return [
+            ('facets: FacetResult', build_facets(filters, _row_dicts(columns, rows))),
+            ('facets: строки', (columns, rows)),
+            ('filter refs: FilterRefs', refs),
+            ('filter refs: dict', vars(refs)),
+        ]
+
+    def cached_samples(self, limit):
+        """Текущие значения из Redis"""
+        redis = get_redis_connection('default')
+        samples = []
+        for pattern in CACHED_PATTERNS:
+            for key in list(redis.scan_iter(cache.make_key(pattern), count=100))[:limit]:
+                raw = redis.get(key)
+                if raw is None:
+                    continue
+                value = cache.client.decode(raw)
+                samples.append((key.decode().split(':', 2)[-1], value))
+        return samples
@@ -0,0 +1,33 @@
+# apps/core/management/commands/cache_stats.py
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from apps.core.tagged_cache import METRICS_KEY, cache_stats, hit_ratios
+
+
+class Command(BaseCommand):
+    help = 'Показывает исходы обращений к кэшу и доли попаданий в L1 и L2'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счетчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        if not stats:
+            self.stdout.write('Метрик кэша пока нет')
+            return
+
+        ratios = hit_ratios(stats)
+        for name in sorted(stats):
+            outcomes = ', '.join(f'{outcome}={count}' for outcome, count in sorted(stats[name].items()))
+            self.stdout.write(
+                f'{name}: L1 {ratios[name]["l1"]:.1%}, L2 {ratios[name]["l2"]:.1%} ({outcomes})'
+            )
+
+        if options['reset']:
+            get_redis_connection('default').delete(METRICS_KEY)
+            self.stdout.write(self.style.SUCCESS('Счетчики обнулены'))
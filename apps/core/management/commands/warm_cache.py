@@ -0,0 +1,44 @@
+# apps/core/management/commands/warm_cache.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.cache_warming import TOP_FILTER_SETS, WARM_WORKERS, warm_cache
+
+
+class Command(BaseCommand):
+    help = 'Прогревает кэш: справочник фильтров, статистику, фасеты марок и частых поисков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=WARM_WORKERS,
+            help='Количество параллельных потоков',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=TOP_FILTER_SETS,
+            help='Сколько частых наборов фильтров из истории поиска прогреть (0 - не прогревать)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        results = warm_cache(workers=options['workers'], top=options['top'])
+        elapsed = time.perf_counter() - started
+
+        for result in sorted(results, key=lambda result: result.seconds, reverse=True):
+            line = f'{result.seconds * 1000:>9.0f} мс  {result.name}'
+            if result.error:
+                self.stdout.write(self.style.ERROR(f'{line}: {result.error}'))
+            else:
+                self.stdout.write(line)
+
+        failed = sum(1 for result in results if result.error)
+        total = sum(result.seconds for result in results)
+        summary = (
+            f'Целей: {len(results)}, ошибок: {failed}; '
+            f'{elapsed:.1f} с ({total:.1f} с суммарно в {options["workers"]} потоках)'
+        )
+        self.stdout.write(self.style.ERROR(summary) if failed else self.style.SUCCESS(summary))
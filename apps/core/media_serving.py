@@ -0,0 +1,220 @@
+# apps/core/media_serving.py
+"""
+Отдача файлов из MEDIA_ROOT.
+
+Проверка доступа нужна только старым фото объявлений (cars/photos/<id
+объявления>/...): остальные файлы публичны, и в production прокси отдает
+их сам, не обращаясь к приложению (nginx, MEDIA_ROOT = /app/media):
+
+    # Фото и варианты по SHA-256 - бессрочно
+    location ~ "^/media/cars/(photos/sha256/[0-9a-f]{2}/[0-9a-f]{2}|renditions/[0-9a-f]{2})/[0-9a-f]{64}" {
+        root /app;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+    # Старые фото объявлений и уменьшенные копии - через приложение
+    location ~ ^/media/(cars|r)/ { proxy_pass http://app; }
+    location /media/ { alias /app/media/; expires 1d; }
+
+Для запросов, которые дошли до приложения, Django решает, можно ли
+отдать файл, и формирует заголовки; байты передает прокси, если он
+настроен (MEDIA_ACCEL):
+
+- 'x-accel' - nginx, заголовок X-Accel-Redirect с адресом внутренней
+  location (MEDIA_ACCEL_PREFIX для медиа, IMAGE_RESIZE_ACCEL_PREFIX для
+  уменьшенных копий):
+
+      location /protected-media/ { internal; alias /app/media/; }
+      location /protected-resized/ { internal; alias /app/resize_cache/; }
+
+- 'x-sendfile' - Apache (mod_xsendfile) или lighttpd, заголовок X-Sendfile
+  с путем к файлу.
+
+Без прокси (разработка) файл отдает Django, в том числе частями (Range).
+
+ETag и Last-Modified считаются по stat файла, поэтому повторные запросы
+получают 304 без чтения файла. Файлы с хэшем содержимого в имени
+(фото и их варианты) кэшируются бессрочно (immutable).
+
+Старые фото объявлений, которые не опубликованы (черновик, модерация,
+снято с публикации), видят только владелец и сотрудники; остальным -
+404. Файлы хранилища по содержимому публичны без запросов к БД: имя
+содержит SHA-256 снимка, и узнать его можно только со страницы, где фото
+уже показано.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from apps.advertisements.models import ACTIVE_AD, CarAd
+
+MEDIA_ACCEL = getattr(settings, 'MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+PUBLIC_MAX_AGE = 24 * 60 * 60
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+PRIVATE_MAX_AGE = 60 * 60
+CHUNK_SIZE = 64 * 1024
+
+# Оригиналы (photo_storage) и варианты (photo_renditions) по SHA-256
+CONTENT_FILE = re.compile(
+    r'^cars/(?:photos/sha256/[0-9a-f]{2}/[0-9a-f]{2}|renditions/[0-9a-f]{2})/(?P<digest>[0-9a-f]{64})'
+)
+# Фото, загруженные до хранилища по содержимому: cars/photos/<id объявления>/...
+LEGACY_AD_FILE = re.compile(r'^cars/(?:photos|renditions)/(?P<ad_id>\d+)/')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def clean_path(path):
+    """
+    Путь к файлу, если он уже в каноническом виде; иначе None.
+
+    Доступ проверяется по тому же пути, который открывается: иначе
+    ./cars/... или users/../cars/... обошли бы проверку фото объявлений.
+    """
+    if not path or '\\' in path or '\x00' in path:
+        return None
+    segments = path.split('/')
+    if any(segment in ('', '.', '..') for segment in segments):
+        return None
+    normalized = posixpath.normpath(path)
+    return normalized if normalized == path else None
+
+
+def _photo_ads(path):
+    """Объявления, доступ к которым проверяется для файла; None - файл публичный"""
+    if CONTENT_FILE.match(path):
+        return None
+    match = LEGACY_AD_FILE.match(path)
+    if match:
+        return CarAd.objects.filter(pk=int(match['ad_id']))
+    if path.startswith('cars/'):
+        return CarAd.objects.none()
+    return None
+
+
+def media_access(user, path):
+    """'public', 'private' (только владельцу и сотрудникам) или None - нет доступа"""
+    path = clean_path(path)
+    if path is None:
+        return None
+    ads = _photo_ads(path)
+    if ads is None or ads.filter(ACTIVE_AD).exists():
+        return 'public'
+    if user.is_staff or (user.is_authenticated and ads.filter(owner=user).exists()):
+        return 'private'
+    return None
+
+
+def _byte_range(request, size, etag):
+    """(начало, конец) из заголовка Range, None - весь файл, False - недопустимый диапазон"""
+    header = request.META.get('HTTP_RANGE', '')
+    match = RANGE.match(header.strip())
+    if not match or not size:
+        return None
+    # If-Range: часть отдается, только если файл не изменился
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _chunks(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _transfer(request, full_path, accel_uri, size, etag):
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if MEDIA_ACCEL == 'x-accel':
+        # nginx сам обрабатывает Range для внутренней location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(accel_uri)
+        return response
+    if MEDIA_ACCEL == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+
+    byte_range = _byte_range(request, size, etag)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    response = StreamingHttpResponse(
+        _chunks(full_path, start, end - start + 1), status=206, content_type=content_type
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
+
+
+def send_file(request, full_path, accel_uri, immutable=False, private=False):
+    """
+    Ответ с файлом full_path (через прокси - по адресу accel_uri).
+
+    FileNotFoundError, если файла нет.
+    """
+    stat = os.stat(full_path)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _transfer(request, full_path, accel_uri, stat.st_size, etag)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if private:
+        patch_cache_control(response, private=True, max_age=PRIVATE_MAX_AGE)
+    elif immutable:
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=PUBLIC_MAX_AGE)
+    return response
+
+
+def serve_media(request, path):
+    """
+    Файл MEDIA_ROOT по пути path; None - нет доступа.
+
+    FileNotFoundError - файла нет, SuspiciousFileOperation - путь вне MEDIA_ROOT.
+    """
+    path = clean_path(path)
+    if path is None:
+        return None
+    access = media_access(request.user, path)
+    if access is None:
+        return None
+    return send_file(
+        request,
+        default_storage.path(path),
+        f'{MEDIA_ACCEL_PREFIX}{path}',
+        immutable=bool(CONTENT_FILE.match(path)),
+        private=access == 'private',
+    )
@@ -0,0 +1,362 @@
+# apps/core/pagination.py
+"""
+Keyset-пагинация (по курсору) для списков объявлений.
+
+Первые страницы доступны по номеру (?page=N), дальше навигация идет по
+непрозрачному курсору (?cursor=...): WHERE по полям текущей сортировки
+вместо OFFSET и без COUNT(*). Курсор привязан к сортировке, поэтому
+после смены сортировки старый курсор просто открывает первую страницу.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .counting import CountingPaginator
+
+# Сколько страниц отдаем по номеру, дальше только курсор
+MAX_PAGE_NUMBER = 10
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или не подходит к queryset"""
+
+
+# ============================================================================
+# ЯДРО KEYSET-ПАГИНАЦИИ
+# ============================================================================
+
+def keyset_ordering(queryset):
+    """
+    Сортировка queryset с уникальным ключом id в конце.
+
+    Возвращает None, если сортировку нельзя использовать для keyset
+    (выражения, поля связанных моделей, nullable-поля, аннотации).
+    """
+    ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    if not ordering:
+        return None
+
+    opts = queryset.model._meta
+    # attname: у таблиц с OneToOne-первичным ключом это ad_id, а не ad
+    pk_name = opts.pk.attname
+    result = []
+    for item in ordering:
+        if not isinstance(item, str) or item == '?':
+            return None
+        name = item.lstrip('-')
+        if name in ('pk', opts.pk.name):
+            name = pk_name
+        if name != pk_name:
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.is_relation or field.null:
+                return None
+        result.append(f'-{name}' if item.startswith('-') else name)
+
+    # id в том же направлении, что и последнее поле: индекс читается одним проходом
+    if not any(item.lstrip('-') == pk_name for item in result):
+        result.append(f'-{pk_name}' if result[-1].startswith('-') else pk_name)
+    return result
+
+
+def reverse_ordering(ordering):
+    return [item[1:] if item.startswith('-') else f'-{item}' for item in ordering]
+
+
+def keyset_q(ordering, values):
+    """
+    Условие «строго после values» для заданной сортировки.
+
+    (a, b) после (x, y) при сортировке по убыванию:
+    a <= x AND (a < x OR (a = x AND b < y)).
+    Первое условие дублирует часть OR, но позволяет использовать индекс.
+    """
+    clauses = Q()
+    equal = {}
+    for item, value in zip(ordering, values):
+        name = item.lstrip('-')
+        lookup = 'lt' if item.startswith('-') else 'gt'
+        clauses |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & clauses
+
+
+def _encode_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def encode_cursor(ordering, obj, reverse=False):
+    """Непрозрачный курсор на позицию объекта obj"""
+    values = [_encode_value(getattr(obj, item.lstrip('-'))) for item in ordering]
+    payload = {'o': ordering, 'v': values}
+    if reverse:
+        payload['r'] = 1
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, model):
+    """Разобрать курсор: (ordering, values, reverse)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        ordering = [str(item) for item in payload['o']]
+        raw_values = payload['v']
+        reverse = bool(payload.get('r'))
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeDecodeError):
+        raise InvalidCursor('Некорректный курсор')
+
+    if not isinstance(raw_values, list) or len(raw_values) != len(ordering):
+        raise InvalidCursor('Некорректный курсор')
+
+    values = []
+    for item, raw in zip(ordering, raw_values):
+        try:
+            field = model._meta.get_field(item.lstrip('-'))
+            values.append(field.to_python(raw))
+        except (FieldDoesNotExist, ValidationError):
+            raise InvalidCursor('Некорректный курсор')
+    return ordering, values, reverse
+
+
+class KeysetPage:
+    """Страница keyset-пагинации (совместима с page_obj в шаблонах)"""
+
+    is_keyset = True
+    number = None
+    paginator = None
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage ({len(self.object_list)} объектов)>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_keyset(queryset, ordering, token, page_size):
+    """
+    Страница после (или до) позиции курсора.
+
+    Выбирает page_size + 1 строк, чтобы понять, есть ли следующая страница,
+    без COUNT(*).
+    """
+    reverse = False
+    values = None
+    if token:
+        cursor_ordering, values, reverse = decode_cursor(token, queryset.model)
+        if cursor_ordering != ordering:
+            # Сортировка изменилась - начинаем сначала
+            values, reverse = None, False
+
+    scan_ordering = reverse_ordering(ordering) if reverse else ordering
+    queryset = queryset.order_by(*scan_ordering)
+    if values is not None:
+        queryset = queryset.filter(keyset_q(scan_ordering, values))
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    if reverse:
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, values is not None
+
+    next_cursor = encode_cursor(ordering, rows[-1]) if rows and has_next else None
+    previous_cursor = encode_cursor(ordering, rows[0], reverse=True) if rows and has_previous else None
+    return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+# ============================================================================
+# DJANGO (ListView)
+# ============================================================================
+
+class CappedPaginator(CountingPaginator):
+    """
+    Paginator, у которого номера страниц доступны только до max_pages.
+
+    Количество результатов считается дешево (см. apps.core.counting).
+    """
+
+    def __init__(self, *args, max_pages=MAX_PAGE_NUMBER, **kwargs):
+        self.max_pages = max_pages
+        super().__init__(*args, **kwargs)
+
+    @property
+    def is_capped(self):
+        return self.num_pages > self.max_pages
+
+    @property
+    def page_range(self):
+        return range(1, min(self.num_pages, self.max_pages) + 1)
+
+
+class KeysetPaginationMixin:
+    """
+    Миксин ListView: первые max_page_number страниц по номеру,
+    дальше по курсору (?cursor=...).
+    """
+    cursor_param = 'cursor'
+    max_page_number = MAX_PAGE_NUMBER
+    paginator_class = CappedPaginator
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(
+            queryset,
+            per_page,
+            orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page,
+            max_pages=self.max_page_number,
+            **kwargs
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = keyset_ordering(queryset)
+        token = self.request.GET.get(self.cursor_param)
+
+        if ordering and token:
+            try:
+                page = paginate_keyset(queryset, ordering, token, page_size)
+            except InvalidCursor:
+                raise Http404('Некорректный курсор')
+            return (None, page, page.object_list, page.has_other_pages())
+
+        if ordering:
+            page_number = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+            if str(page_number).isdigit() and int(page_number) > self.max_page_number:
+                raise Http404('Используйте постраничную навигацию по курсору')
+
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+
+        # С последней страницы по номеру переходим на курсор
+        if ordering and page.number >= self.max_page_number and page.has_next():
+            page.next_cursor = encode_cursor(ordering, page.object_list[len(page.object_list) - 1])
+
+        return paginator, page, object_list, is_paginated
+
+
+# ============================================================================
+# DJANGO REST FRAMEWORK
+# ============================================================================
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Пагинация DRF: ?page=N для первых страниц, ?cursor=... дальше.
+
+    В режиме курсора ответ не содержит count: {'next', 'previous', 'results'}.
+    Для больших выборок count - оценка, тогда count_approximate = true.
+    """
+    django_paginator_class = CappedPaginator
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    max_page_number = MAX_PAGE_NUMBER
+    invalid_cursor_message = 'Некорректный курсор'
+    deep_page_message = 'Страницы дальше {max_page} доступны только по курсору'
+
+    keyset_page = None
+    next_cursor = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.keyset_page = None
+        self.next_cursor = None
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        ordering = keyset_ordering(queryset)
+        token = request.query_params.get(self.cursor_query_param)
+
+        if ordering and token:
+            try:
+                self.keyset_page = paginate_keyset(queryset, ordering, token, page_size)
+            except InvalidCursor:
+                raise NotFound(self.invalid_cursor_message)
+            return list(self.keyset_page.object_list)
+
+        if ordering:
+            page_number = request.query_params.get(self.page_query_param, '1')
+            if page_number.isdigit() and int(page_number) > self.max_page_number:
+                raise NotFound(self.deep_page_message.format(max_page=self.max_page_number))
+
+        result = super().paginate_queryset(queryset, request, view)
+
+        if ordering and result and self.page.number >= self.max_page_number and self.page.has_next():
+            self.next_cursor = encode_cursor(ordering, result[-1])
+
+        return result
+
+    def _cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if self.next_cursor:
+            return self._cursor_link(self.next_cursor)
+        return super().get_next_link()
+
+    def get_paginated_response(self, data):
+        if self.keyset_page is not None:
+            return Response({
+                'next': self._cursor_link(self.keyset_page.next_cursor),
+                'previous': self._cursor_link(self.keyset_page.previous_cursor),
+                'results': data,
+            })
+        count = self.page.paginator.count
+        return Response({
+            'count': int(count),
+            'count_approximate': getattr(count, 'approximate', False),
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['required'] = ['results']
+        response_schema['properties']['count_approximate'] = {'type': 'boolean', 'example': False}
+        return response_schema
@@ -0,0 +1,399 @@
+# apps/core/tagged_cache.py
+"""
+Кэш с инвалидацией по тегам (счетчикам поколений).
+
+У каждого тега («brand:5», «catalog») есть номер поколения в кэше.
+Запись хранит поколения своих тегов на момент расчета; при чтении запись
+и текущие поколения забираются одним get_many, и если хотя бы один тег с
+тех пор был увеличен (bump_tags), запись считается устаревшей. Удалять
+ключи по шаблону не нужно: устаревшие записи просто истекают по таймауту.
+Поэтому таймауты могут быть длинными - актуальность от них не зависит.
+
+Начальное поколение тега - текущее время в наносекундах, поэтому после
+вытеснения ключа из Redis новое поколение не совпадет ни с одним
+сохраненным в записях.
+
+Пространства имен - общие теги для данных, зависящих от целой таблицы:
+их увеличивают сигналы сохранения и удаления соответствующих моделей.
+
+get_or_compute защищает дорогие расчеты от лавины запросов:
+
+- пересчет идет в одном процессе (блокировка cache.add = SET NX),
+  остальные в это время получают устаревшее значение;
+- запись пересчитывается досрочно с вероятностью, растущей к концу срока
+  и с длительностью расчета (XFetch), поэтому популярные ключи обычно
+  обновляются до истечения и без конкуренции;
+- исходы (hit, miss, stale, early, wait) считаются в процессе и пачками
+  сбрасываются в хэш Redis (cache_stats()).
+
+Для имен из CACHE_L1_NAMESPACES перед Redis стоит LRU в памяти процесса
+(local_cache): горячие значения читаются без передачи самих значений,
+исход l1_hit. Запись L1 хранит поколения своих тегов; в запросе текущие
+поколения читаются из Redis один раз (при первом чтении L1 - для всех
+тегов L1 одним get_many), поэтому bump_tags в другом процессе виден уже
+в следующем запросе. Вне запросов (задачи) поколения читаются при
+каждом обращении к L1. Доли попаданий по уровням - hit_ratios().
+"""
+import functools
+import logging
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .local_cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+TAG_VERSION_PREFIX = 'cache_tag_version:'
+
+# Пространства имен
+CATALOG = 'catalog'  # марки, модели, города
+ADS = 'ads'  # объявления
+USERS = 'users'  # пользователи
+
+DEFAULT_TIMEOUT = 24 * 60 * 60
+
+# Блокировка пересчета и ожидание значения, если устаревшего нет
+LOCK_TIMEOUT = 60
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+# Коэффициент досрочного пересчета (1.0 - рекомендованный, больше - раньше)
+EARLY_BETA = 1.0
+
+METRICS_KEY = 'cache_metrics'
+METRICS_FLUSH_EVERY = 100
+
+# Исходы обращений в текущем процессе, еще не сброшенные в Redis
+_metrics = Counter()
+
+# Имена (metric), значения которых держатся и в памяти процесса
+CACHE_L1_NAMESPACES = frozenset(getattr(settings, 'CACHE_L1_NAMESPACES', {
+    'ad_filter_refs', 'ad_facets', 'result_count', 'catalog_stats', 'home_stats', 'api_stats',
+    'home_snapshot',
+}))
+local_cache = LocalCache(
+    max_size=getattr(settings, 'CACHE_L1_MAX_SIZE', 1000),
+    ttl=getattr(settings, 'CACHE_L1_TTL', 5),
+)
+
+# Поколения тегов, прочитанные в текущем запросе (для проверки записей L1)
+_request = threading.local()
+
+
+def _start_request(**kwargs):
+    _request.versions = {}
+    _request.loaded = False
+
+
+def _finish_request(**kwargs):
+    _request.versions = None
+
+
+request_started.connect(_start_request, dispatch_uid='tagged_cache_start_request')
+request_finished.connect(_finish_request, dispatch_uid='tagged_cache_finish_request')
+
+
+def _version_key(tag):
+    return f'{TAG_VERSION_PREFIX}{tag}'
+
+
+def _read_versions(tags):
+    """Поколения тегов из кэша одним get_many (None - поколения нет)"""
+    found = cache.get_many([_version_key(tag) for tag in tags])
+    return {tag: found.get(_version_key(tag)) for tag in tags}
+
+
+def _current_versions(tags):
+    """Текущие поколения тегов записи L1: в запросе - один get_many"""
+    versions = getattr(_request, 'versions', None)
+    if versions is None:
+        return _read_versions(tags)
+    if not _request.loaded:
+        _request.loaded = True
+        versions.update(_read_versions(set(tags) | local_cache.tags()))
+    missing = [tag for tag in tags if tag not in versions]
+    if missing:
+        versions.update(_read_versions(missing))
+    return {tag: versions[tag] for tag in tags}
+
+
+def _remember_versions(versions):
+    """Поколения, только что прочитанные из кэша, - в поколения запроса"""
+    current = getattr(_request, 'versions', None)
+    if current is not None:
+        current.update(versions)
+
+
+def _init_versions(tags):
+    """Поколения тегов, которых еще нет в кэше"""
+    versions = {}
+    for tag in tags:
+        key = _version_key(tag)
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            # Тег успел создать параллельный запрос
+            version = cache.get(key, version)
+        versions[tag] = version
+    return versions
+
+
+def _lookup(key, tags):
+    """(запись или None, текущие поколения тегов) одним get_many"""
+    tags = sorted(set(tags))
+    found = cache.get_many([key] + [_version_key(tag) for tag in tags])
+    versions = {tag: found[_version_key(tag)] for tag in tags if _version_key(tag) in found}
+
+    missing = [tag for tag in tags if tag not in versions]
+    if missing:
+        versions.update(_init_versions(missing))
+    _remember_versions(versions)
+    return found.get(key), versions
+
+
+def get_tagged(key, tags):
+    """
+    Запись key, если ни один из тегов не менялся после ее сохранения.
+
+    Возвращает (значение или None, текущие поколения тегов). Поколения
+    нужно передать в set_tagged: если тег изменится во время расчета,
+    запись сразу окажется устаревшей.
+    """
+    entry, versions = _lookup(key, tags)
+    if entry is None or entry['versions'] != versions:
+        return None, versions
+    return entry['value'], versions
+
+
+def set_tagged(key, value, versions, timeout=DEFAULT_TIMEOUT):
+    cache.set(key, {'versions': versions, 'value': value}, timeout)
+
+
+def _record(name, outcome):
+    _metrics[(name, outcome)] += 1
+    if sum(_metrics.values()) >= METRICS_FLUSH_EVERY:
+        flush_metrics()
+
+
+def flush_metrics():
+    """Сбросить накопленные в процессе исходы в хэш Redis"""
+    if not _metrics:
+        return
+    counts = dict(_metrics)
+    _metrics.clear()
+    try:
+        pipe = get_redis_connection('default').pipeline()
+        for (name, outcome), count in counts.items():
+            pipe.hincrby(METRICS_KEY, f'{name}:{outcome}', count)
+        pipe.execute()
+    except (NotImplementedError, RedisError):
+        logger.debug('Метрики кэша не записаны: %s', counts)
+
+
+def cache_stats():
+    """Исходы по именам ключей: {'home_stats': {'hit': 10, 'stale': 1, ...}}"""
+    flush_metrics()
+    stats = {}
+    try:
+        raw = get_redis_connection('default').hgetall(METRICS_KEY)
+    except (NotImplementedError, RedisError):
+        return stats
+    for field, count in raw.items():
+        name, _, outcome = field.decode().rpartition(':')
+        stats.setdefault(name, {})[outcome] = int(count)
+    return stats
+
+
+def hit_ratios(stats=None):
+    """
+    Доли попаданий по уровням: {'ad_facets': {'l1': 0.8, 'l2': 0.9}}.
+
+    l1 - доля всех обращений, l2 - доля обращений, дошедших до Redis
+    (устаревшее значение тоже считается попаданием).
+    """
+    ratios = {}
+    for name, outcomes in (cache_stats() if stats is None else stats).items():
+        total = sum(outcomes.values())
+        l1_hits = outcomes.get('l1_hit', 0)
+        l2_total = total - l1_hits
+        l2_hits = outcomes.get('hit', 0) + outcomes.get('stale', 0) + outcomes.get('wait', 0)
+        ratios[name] = {
+            'l1': l1_hits / total if total else 0.0,
+            'l2': l2_hits / l2_total if l2_total else 0.0,
+        }
+    return ratios
+
+
+def _is_fresh(entry, versions, beta):
+    """Запись актуальна и не выпала на досрочный пересчет"""
+    if entry['versions'] != versions:
+        return False
+    # XFetch: now - delta * beta * ln(rand) >= expires -> пересчитать сейчас
+    jitter = entry.get('delta', 0) * beta * math.log(1.0 - random.random())
+    return time.time() - jitter < entry.get('expires', 0)
+
+
+def _wait_for_value(key):
+    """Ждем, пока пересчет в другом процессе сохранит значение"""
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def _compute_and_store(key, versions, compute, timeout, stale_timeout):
+    started = time.time()
+    value = compute()
+    finished = time.time()
+    ttl = timeout(value) if callable(timeout) else timeout
+    cache.set(key, {
+        'versions': versions,
+        'value': value,
+        'expires': finished + ttl,
+        'delta': finished - started,
+    }, ttl + (ttl if stale_timeout is None else stale_timeout))
+    return value
+
+
+def get_or_compute(key, tags, compute, timeout=DEFAULT_TIMEOUT, stale_timeout=None,
+                   beta=EARLY_BETA, metric=None):
+    """
+    Значение из кэша или compute() с защитой от одновременного пересчета.
+
+    timeout - срок актуальности (число или функция от значения);
+    stale_timeout - сколько после него отдавать устаревшее значение, пока
+    идет пересчет (по умолчанию равен timeout). metric - имя в метриках
+    (по умолчанию key).
+
+    compute должен возвращать готовые данные (списки, словари,
+    dataclass), а не ленивые QuerySet: их pickle не содержит результата.
+    """
+    metric = metric or key
+    local = metric in CACHE_L1_NAMESPACES
+    if local:
+        local_entry = local_cache.get_entry(key)
+        if local_entry is not None:
+            value, local_versions = local_entry
+            if _current_versions(local_versions) == local_versions:
+                _record(metric, 'l1_hit')
+                return value
+
+    entry, versions = _lookup(key, tags)
+    if entry is not None and _is_fresh(entry, versions, beta):
+        _record(metric, 'hit')
+        if local:
+            local_cache.set(key, entry['value'], versions)
+        return entry['value']
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    if not locked:
+        # Пересчитывает другой процесс
+        if entry is not None:
+            _record(metric, 'stale')
+            return entry['value']
+        entry = _wait_for_value(key)
+        if entry is not None:
+            _record(metric, 'wait')
+            return entry['value']
+        # Не дождались: считаем сами, блокировку не трогаем
+
+    try:
+        started = time.time()
+        value = _compute_and_store(key, versions, compute, timeout, stale_timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+    fresh_expired = entry is not None and entry['versions'] == versions and entry.get('expires', 0) > started
+    _record(metric, 'early' if fresh_expired else 'miss')
+    if local:
+        local_cache.set(key, value, versions)
+    return value
+
+
+def refresh(key, tags, compute, timeout=DEFAULT_TIMEOUT, stale_timeout=None, metric=None):
+    """
+    Пересчитать и сохранить запись get_or_compute независимо от ее
+    актуальности (фоновые задачи, которые обновляют значение заранее).
+    """
+    _, versions = _lookup(key, tags)
+    value = _compute_and_store(key, versions, compute, timeout, stale_timeout)
+    if (metric or key) in CACHE_L1_NAMESPACES:
+        local_cache.set(key, value, versions)
+    return value
+
+
+def get_tagged_or_stale(key, tags, metric=None):
+    """
+    Вариант get_tagged для расчетов, которые нельзя обернуть в функцию
+    (рендер страницы по частям).
+
+    Возвращает (значение, поколения, locked). Если значение None, вызывающий
+    считает его, сохраняет set_tagged и, если locked, снимает блокировку
+    release_refresh(key). Пока пересчитывает другой процесс, отдается
+    устаревшее значение.
+    """
+    metric = metric or key
+    entry, versions = _lookup(key, tags)
+    if entry is not None and entry['versions'] == versions:
+        _record(metric, 'hit')
+        return entry['value'], versions, False
+
+    locked = cache.add(f'{key}:lock', 1, LOCK_TIMEOUT)
+    if not locked and entry is not None:
+        _record(metric, 'stale')
+        return entry['value'], versions, False
+    _record(metric, 'miss')
+    return None, versions, locked
+
+
+def release_refresh(key):
+    cache.delete(f'{key}:lock')
+
+
+def cached(key, tags=(), timeout=DEFAULT_TIMEOUT, **options):
+    """
+    Декоратор для get_or_compute.
+
+    key - строка или функция от аргументов вызова, возвращающая ключ.
+    metric по умолчанию - строковый key (как в get_or_compute, от него
+    зависит L1), для функции key - имя функции.
+    """
+    def decorator(func):
+        metric = options.pop('metric', None) or (key if isinstance(key, str) else func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if callable(key) else key
+            return get_or_compute(
+                cache_key, tags, lambda: func(*args, **kwargs), timeout, metric=metric, **options
+            )
+        return wrapper
+    return decorator
+
+
+def bump_tags(tags):
+    """Сделать устаревшими все записи с этими тегами"""
+    tags = set(tags)
+    local_cache.evict_tags(tags)
+    current = getattr(_request, 'versions', None)
+    for tag in tags:
+        if current is not None:
+            current.pop(tag, None)
+        try:
+            cache.incr(_version_key(tag))
+        except ValueError:
+            # Поколения нет в кэше: при следующем чтении будет создано новое,
+            # и ни одна сохраненная запись с ним не совпадет
+            pass
@@ -0,0 +1,26 @@
+# apps/core/tasks.py
+import logging
+
+from celery import shared_task
+
+from .cache_warming import warm_cache
+from .home_snapshot import refresh_home_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def warm_cache_task():
+    """Прогрев кэша справочников, статистики и частых списков"""
+    results = warm_cache()
+    failed = [result.name for result in results if result.error]
+    logger.info(
+        'Прогрев кэша: %d целей за %.1f с, ошибок: %d %s',
+        len(results), sum(result.seconds for result in results), len(failed), failed or '',
+    )
+
+
+@shared_task(ignore_result=True)
+def refresh_home_snapshot_task():
+    """Пересчет снимка блоков главной страницы"""
+    refresh_home_snapshot()
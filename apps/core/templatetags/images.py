@@ -0,0 +1,19 @@
+# apps/core/templatetags/images.py
+from django import template
+
+from apps.core import image_resize
+
+register = template.Library()
+
+
+@register.filter
+def resized(image, size):
+    """{{ photo.image|resized:640 }} или {{ brand.logo|resized:"200x100" }}"""
+    width, _, height = str(size).partition('x')
+    return image_resize.resized_url(image, int(width or 0), int(height or 0))
+
+
+@register.filter
+def srcset(image):
+    """{{ photo.image|srcset }} для атрибута srcset"""
+    return image_resize.srcset(image)
@@ -7,18 +7,28 @@ from django.contrib import messages
 from django.core.paginator import Paginator
 from django.db.models import Q, Count, Min, Max, Avg, Sum, Prefetch
 from django.urls import reverse_lazy
+from django.core.exceptions import SuspiciousFileOperation
 from django.http import JsonResponse, Http404, HttpResponse
-from django.views.decorators.http import require_GET, require_POST
-from django.core.cache import cache
+from django.views.decorators.http import require_GET, require_POST, require_safe
 from django.utils import timezone
 from django.views import View
+from PIL import Image
 
 # Импорты моделей из других приложений
 from apps.catalog.models import CarBrand, CarModel, CarFeature
-from apps.advertisements.models import CarAd, CarPhoto, CarAdFeature, FavoriteAd, SearchHistory, CarView
+from apps.advertisements.models import AdSearchIndex, CarAd, CarPhoto, CarAdFeature, FavoriteAd, SearchHistory, CarView
+from apps.advertisements.autocomplete import AD_SUGGESTIONS_LIMIT, suggest
+from apps.advertisements.counters import (
+    ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS, get_counts, region_price_sum, top_regions
+)
+from apps.advertisements.search import search_all
 from apps.users.models import User
 from apps.reviews.models import Review
-from apps.analytics.models import PageView, SearchAnalytics
+from apps.analytics.events import track_event
+from apps.core.home_snapshot import get_home_snapshot, snapshot_ads, snapshot_brands
+from apps.core.image_resize import InvalidResize, get_resized, resized_accel_uri
+from apps.core.media_serving import media_access, send_file, serve_media
+from apps.core.tagged_cache import ADS, CATALOG, USERS, get_or_compute
 
 
 class HomePageView(TemplateView):
@@ -28,54 +38,40 @@ class HomePageView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
+        # Блоки считает фоновая задача (см. home_snapshot), здесь - только
+        # загрузка объявлений снимка одним запросом
+        snapshot = get_home_snapshot()
+        ads = snapshot_ads(snapshot, 'recent_ads', 'featured_ads')
+
         # Популярные марки (с логотипами)
-        context['popular_brands'] = CarBrand.objects.filter(
-            is_active=True
-        ).annotate(
-            models_count=Count('models'),
-            ads_count=Count('models__advertisements', filter=Q(models__advertisements__status='active'))
-        ).order_by('-ads_count')[:12]
+        context['popular_brands'] = snapshot_brands(snapshot['popular_brands'])
 
         # Последние добавленные объявления
-        context['recent_ads'] = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).select_related('model__brand', 'owner').prefetch_related('photos').order_by('-created_at')[:8]
+        context['recent_ads'] = ads['recent_ads']
 
         # Объявления с пометкой "топ" или "рекомендуемые"
-        context['featured_ads'] = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).select_related('model__brand', 'owner').prefetch_related('photos').order_by('-views_count')[:6]
+        context['featured_ads'] = ads['featured_ads']
 
         # Статистика сайта
-        context['total_ads'] = CarAd.objects.filter(status='active', is_active=True).count()
-        context['total_brands'] = CarBrand.objects.filter(is_active=True).count()
-        context['total_models'] = CarModel.objects.filter(is_active=True).count()
-        context['total_users'] = User.objects.filter(is_active=True).count()
+        context['total_ads'] = snapshot['total_ads']
+        context['total_brands'] = snapshot['total_brands']
+        context['total_models'] = snapshot['total_models']
+        context['total_users'] = snapshot['total_users']
 
         # Поиск по популярным маркам
-        context['search_suggestions'] = CarBrand.objects.filter(
-            is_active=True
-        ).annotate(
-            ads_count=Count('models__advertisements', filter=Q(models__advertisements__status='active'))
-        ).filter(ads_count__gt=0).order_by('-ads_count')[:10]
+        context['search_suggestions'] = snapshot_brands(snapshot['search_suggestions'])
 
         # Регионы с наибольшим количеством объявлений
-        context['top_regions'] = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).exclude(region='').values('region').annotate(
-            count=Count('id')
-        ).order_by('-count')[:6]
+        context['top_regions'] = snapshot['top_regions']
 
         return context
 
     def dispatch(self, request, *args, **kwargs):
         # Логируем просмотр главной страницы для аналитики
         if request.user.is_authenticated:
-            PageView.objects.create(
-                user=request.user,
+            track_event(
+                'page_view',
+                user_id=request.user.pk,
                 page_url=request.path,
                 page_title='Главная страница',
                 ip_address=self.get_client_ip(request),
@@ -134,12 +130,13 @@ class StatsView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Общая статистика
+        # Общая статистика (счетчики сайта)
+        counts = get_counts(ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS)
         context['total_stats'] = {
-            'advertisements': CarAd.objects.filter(status='active', is_active=True).count(),
-            'brands': CarBrand.objects.filter(is_active=True).count(),
-            'models': CarModel.objects.filter(is_active=True).count(),
-            'users': User.objects.filter(is_active=True).count(),
+            'advertisements': counts[ACTIVE_ADS],
+            'brands': counts[ACTIVE_BRANDS],
+            'models': counts[ACTIVE_MODELS],
+            'users': counts[ACTIVE_USERS],
             'reviews': Review.objects.filter(is_approved=True).count(),
         }
 
@@ -152,19 +149,11 @@ class StatsView(TemplateView):
             'sold_ads': CarAd.objects.filter(status='sold', updated_at__gte=thirty_days_ago).count(),
         }
 
-        # Популярные марки
-        context['popular_brands'] = CarBrand.objects.filter(
-            is_active=True
-        ).annotate(
-            ads_count=Count('models__advertisements', filter=Q(models__advertisements__status='active'))
-        ).order_by('-ads_count')[:10]
-
-        # Популярные модели
+        # Популярные марки и модели (ads_count поддерживается счетчиками)
+        context['popular_brands'] = CarBrand.objects.filter(is_active=True).order_by('-ads_count')[:10]
         context['popular_models'] = CarModel.objects.filter(
             is_active=True
-        ).annotate(
-            ads_count=Count('advertisements', filter=Q(ads__status='active'))
-        ).order_by('-ads_count')[:10]
+        ).select_related('brand').order_by('-ads_count')[:10]
 
         # Средние цены по маркам
         context['avg_prices'] = CarAd.objects.filter(
@@ -273,45 +262,15 @@ class SearchView(TemplateView):
         if query:
             # Логируем поиск
             if self.request.user.is_authenticated:
-                SearchAnalytics.objects.create(
-                    user=self.request.user,
+                track_event(
+                    'search',
+                    user_id=self.request.user.pk,
                     query=query,
                     filters=self.request.GET.dict()
                 )
 
-            # Поиск по маркам
-            brands = CarBrand.objects.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query),
-                is_active=True
-            )[:10]
-
-            # Поиск по моделям
-            models = CarModel.objects.filter(
-                Q(name__icontains=query) |
-                Q(brand__name__icontains=query) |
-                Q(description__icontains=query),
-                is_active=True
-            ).select_related('brand')[:20]
-
-            # Поиск по объявлениям
-            ads = CarAd.objects.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query) |
-                Q(model__name__icontains=query) |
-                Q(model__brand__name__icontains=query) |
-                Q(vin__icontains=query),
-                status='active',
-                is_active=True
-            ).select_related('model__brand', 'owner').prefetch_related('photos')[:20]
-
-            context.update({
-                'brands': brands,
-                'models': models,
-                'advertisements': ads,
-                'query': query,
-                'results_count': brands.count() + models.count() + ads.count()
-            })
+            context.update(search_all(query))
+            context['query'] = query
 
         return context
 
@@ -322,12 +281,12 @@ class TopBrandsView(ListView):
     paginate_by = 20
 
     def get_queryset(self):
+        # Просмотр индекса car_brands_ads_count_idx
         return CarBrand.objects.filter(
-            is_active=True
+            is_active=True, ads_count__gt=0
         ).annotate(
-            ads_count=Count('models__advertisements', filter=Q(models__advertisements__status='active')),
             models_count=Count('models')
-        ).filter(ads_count__gt=0).order_by('-ads_count')
+        ).order_by('-ads_count')
 
 class TopModelsView(ListView):
     """Топ моделей по количеству объявлений"""
@@ -336,11 +295,10 @@ class TopModelsView(ListView):
     paginate_by = 20
 
     def get_queryset(self):
+        # Просмотр индекса car_models_ads_count_idx
         return CarModel.objects.filter(
-            is_active=True
-        ).annotate(
-            ads_count=Count('advertisements', filter=Q(ads__status='active'))
-        ).filter(ads_count__gt=0).select_related('brand').order_by('-ads_count')
+            is_active=True, ads_count__gt=0
+        ).select_related('brand').order_by('-ads_count')
 
 class LatestAdsView(ListView):
     """Последние объявления"""
@@ -379,30 +337,31 @@ class AdsByRegionView(ListView):
 class HomeStatsAPIView(View):
     """API для получения статистики для главной страницы (AJAX)"""
 
-    def get(self, request, *args, **kwargs):
-        cache_key = 'home_stats'
-        stats = cache.get(cache_key)
-
-        if not stats:
-            stats = {
-                'total_ads': CarAd.objects.filter(status='active', is_active=True).count(),
-                'total_brands': CarBrand.objects.filter(is_active=True).count(),
-                'total_models': CarModel.objects.filter(is_active=True).count(),
-                'total_users': User.objects.filter(is_active=True).count(),
-                'popular_brands': list(
-                    CarBrand.objects.filter(is_active=True)
-                    .annotate(ads_count=Count('models__advertisements', filter=Q(models__advertisements__status='active')))
-                    .filter(ads_count__gt=0)
-                    .order_by('-ads_count')[:6]
-                    .values('id', 'name', 'slug', 'logo')
-                ),
-                'recent_ads_count': CarAd.objects.filter(
-                    created_at__gte=timezone.now() - timezone.timedelta(days=7)
-                ).count(),
-            }
-            cache.set(cache_key, stats, 300)  # 5 минут
+    # «За 7 дней» меняется и без событий, поэтому таймаут ограничен часом
+    cache_timeout = 60 * 60
 
-        return JsonResponse(stats)
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(self.cached_stats())
+
+    def cached_stats(self):
+        return get_or_compute('home_stats', [ADS, CATALOG, USERS], self.get_stats, self.cache_timeout)
+
+    def get_stats(self):
+        counts = get_counts(ACTIVE_ADS, ACTIVE_BRANDS, ACTIVE_MODELS, ACTIVE_USERS)
+        return {
+            'total_ads': counts[ACTIVE_ADS],
+            'total_brands': counts[ACTIVE_BRANDS],
+            'total_models': counts[ACTIVE_MODELS],
+            'total_users': counts[ACTIVE_USERS],
+            'popular_brands': list(
+                CarBrand.objects.filter(is_active=True, ads_count__gt=0)
+                .order_by('-ads_count')[:6]
+                .values('id', 'name', 'slug', 'logo')
+            ),
+            'recent_ads_count': CarAd.objects.filter(
+                created_at__gte=timezone.now() - timezone.timedelta(days=7)
+            ).count(),
+        }
 
 class PopularBrandsAPIView(View):
     """API для получения популярных марок (AJAX)"""
@@ -411,10 +370,10 @@ class PopularBrandsAPIView(View):
         limit = int(request.GET.get('limit', 10))
 
         brands = CarBrand.objects.filter(
-            is_active=True
+            is_active=True, ads_count__gt=0
         ).annotate(
-            ads_count=Count('models__advertisements', filter=Q(models__advertisements__status='active'))
-        ).filter(ads_count__gt=0).order_by('-ads_count')[:limit]
+            models_count=Count('models')
+        ).order_by('-ads_count')[:limit]
 
         data = [
             {
@@ -424,7 +383,7 @@ class PopularBrandsAPIView(View):
                 'country': brand.get_country_display(),
                 'logo_url': brand.logo.url if brand.logo else None,
                 'ads_count': brand.ads_count,
-                'models_count': brand.models.count(),
+                'models_count': brand.models_count,
             }
             for brand in brands
         ]
@@ -467,25 +426,27 @@ class RegionStatsAPIView(View):
     """API для получения статистики по регионам (AJAX)"""
 
     def get(self, request, *args, **kwargs):
-        region_stats = CarAd.objects.filter(
-            status='active',
-            is_active=True
-        ).exclude(region='').values('region').annotate(
-            count=Count('id'),
-            avg_price=Avg('price'),
-            min_year=Min('year'),
-            max_year=Max('year')
-        ).order_by('-count')[:10]
+        # Топ регионов, количество и средняя цена - из счетчиков сайта
+        regions = top_regions(10)
+        price_sums = get_counts(*[region_price_sum(region) for region, _ in regions])
+
+        # Годы - только по строкам индекса выбранных регионов
+        years = {
+            row['region']: row
+            for row in AdSearchIndex.objects.filter(
+                region__in=[region for region, _ in regions]
+            ).values('region').annotate(min_year=Min('year'), max_year=Max('year'))
+        }
 
-        data = [
-            {
-                'region': stat['region'],
-                'count': stat['count'],
-                'avg_price': float(stat['avg_price'] or 0),
-                'year_range': f"{stat['min_year'] or '?'}-{stat['max_year'] or '?'}",
-            }
-            for stat in region_stats
-        ]
+        data = []
+        for region, count in regions:
+            year_range = years.get(region, {})
+            data.append({
+                'region': region,
+                'count': count,
+                'avg_price': price_sums[region_price_sum(region)] / count,
+                'year_range': f"{year_range.get('min_year') or '?'}-{year_range.get('max_year') or '?'}",
+            })
 
         return JsonResponse({'regions': data})
 
@@ -494,64 +455,7 @@ class SearchAutocompleteAPIView(View):
 
     def get(self, request, *args, **kwargs):
         query = request.GET.get('q', '').strip()
-
-        if len(query) < 2:
-            return JsonResponse([], safe=False)
-
-        results = []
-
-        # Марки
-        brands = CarBrand.objects.filter(
-            name__icontains=query,
-            is_active=True
-        )[:5]
-
-        for brand in brands:
-            results.append({
-                'type': 'brand',
-                'id': brand.id,
-                'name': brand.name,
-                'slug': brand.slug,
-                'display': f"{brand.name} (марка)",
-                'url': f"/catalog/brands/{brand.slug}/",
-                'logo': brand.logo.url if brand.logo else None,
-            })
-
-        # Модели
-        models = CarModel.objects.filter(
-            Q(name__icontains=query) | Q(brand__name__icontains=query),
-            is_active=True
-        ).select_related('brand')[:10]
-
-        for model in models:
-            results.append({
-                'type': 'model',
-                'id': model.id,
-                'name': model.name,
-                'brand': model.brand.name,
-                'slug': model.slug,
-                'display': f"{model.brand.name} {model.name} (модель)",
-                'url': f"/catalog/models/{model.slug}/",
-            })
-
-        # Объявления (только заголовки)
-        ads = CarAd.objects.filter(
-            title__icontains=query,
-            status='active',
-            is_active=True
-        )[:5]
-
-        for ad in ads:
-            results.append({
-                'type': 'ad',
-                'id': ad.id,
-                'title': ad.title,
-                'slug': ad.slug,
-                'display': f"{ad.title[:50]}... (объявление)",
-                'url': ad.get_absolute_url() if hasattr(ad, 'get_absolute_url') else f'/advertisements/{ad.slug}/',
-            })
-
-        return JsonResponse(results, safe=False)
+        return JsonResponse(suggest(query, ads_limit=AD_SUGGESTIONS_LIMIT), safe=False)
 
 
 @require_GET
@@ -564,9 +468,10 @@ def check_site_status(request):
         with connection.cursor() as cursor:
             cursor.execute("SELECT 1")
 
-        # Проверяем наличие основных данных
-        brands_count = CarBrand.objects.filter(is_active=True).count()
-        models_count = CarModel.objects.filter(is_active=True).count()
+        # Проверяем наличие основных данных (счетчики сайта)
+        counts = get_counts(ACTIVE_BRANDS, ACTIVE_MODELS)
+        brands_count = counts[ACTIVE_BRANDS]
+        models_count = counts[ACTIVE_MODELS]
 
         status = {
             'status': 'ok',
@@ -609,6 +514,42 @@ def get_current_theme(request):
     return JsonResponse({'theme': theme})
 
 
+@require_safe
+def resized_image(request, width, height, path):
+    """Уменьшенная копия изображения по подписанному URL (resized_url)"""
+    # Копии фото неопубликованных объявлений - по тем же правилам, что и оригиналы
+    access = media_access(request.user, path)
+    if access is None:
+        raise Http404
+    try:
+        target = get_resized(path, width, height, request.GET.get('s'))
+    except TimeoutError:
+        # TimeoutError - подкласс OSError, поэтому проверяется первым
+        response = HttpResponse(status=503)
+        response['Retry-After'] = '5'
+        return response
+    except (InvalidResize, OSError, Image.DecompressionBombError):
+        # Нет оригинала, файл поврежден или не изображение, слишком большое разрешение
+        raise Http404
+
+    # Хранилище не перезаписывает файлы: новый оригинал получает другой путь и URL
+    return send_file(
+        request, target, resized_accel_uri(target), immutable=True, private=access == 'private'
+    )
+
+
+@require_safe
+def media_file(request, path):
+    """Файл из MEDIA_ROOT: доступ проверяет Django, байты передает прокси"""
+    try:
+        response = serve_media(request, path)
+    except (FileNotFoundError, IsADirectoryError, SuspiciousFileOperation):
+        raise Http404
+    if response is None:
+        raise Http404
+    return response
+
+
 # Error handlers
 
 def handler404(request, exception):
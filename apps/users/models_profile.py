@@ -1,5 +1,6 @@
 # apps/users/models_profile.py
 from django.db import models
+from django.utils.timezone import now
 from .models import User
 
 class Message(models.Model):
@@ -62,7 +63,7 @@ class UserActivity(models.Model):
     activity_type = models.CharField('Тип активности', max_length=50)
     ip_address = models.GenericIPAddressField('IP адрес', blank=True, null=True)
     user_agent = models.TextField('User Agent', blank=True, null=True)
-    created_at = models.DateTimeField('Время активности', auto_now_add=True)
+    created_at = models.DateTimeField('Время активности', default=now, editable=False)
 
     class Meta:
         verbose_name = 'Активность пользователя'
@@ -0,0 +1,17 @@
+# apps/users/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.core.tagged_cache import USERS, bump_tags
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def reset_users_namespace(sender, instance, update_fields=None, **kwargs):
+    """Статистика с количеством пользователей пересчитывается"""
+    # Вход в систему обновляет только last_login
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(lambda: bump_tags([USERS]))
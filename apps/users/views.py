@@ -15,7 +15,8 @@ import json
 
 from .forms import CustomUserCreationForm, ProfileEditForm, CustomAuthenticationForm
 from .models import User
-from .models_profile import Message, Notification, UserSettings, UserActivity
+from .models_profile import Message, Notification, UserSettings
+from apps.analytics.events import track_event
 from ..advertisements.models import FavoriteAd as Favorite
 
 
@@ -65,8 +66,9 @@ class RegisterView(CreateView):
             messages.warning(self.request, f'Не удалось отправить письмо для подтверждения: {str(e)}')
 
         # Создаем активность
-        UserActivity.objects.create(
-            user=user,
+        track_event(
+            'user_activity',
+            user_id=user.pk,
             activity_type='registration',
             ip_address=self.request.META.get('REMOTE_ADDR'),
             user_agent=self.request.META.get('HTTP_USER_AGENT', '')
@@ -135,6 +135,18 @@ LANGUAGES = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Уменьшенные копии изображений /media/r/... (apps.core.image_resize)
+IMAGE_RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'resize_cache')
+IMAGE_RESIZE_CACHE_SIZE = 2 * 1024 ** 3  # 2 ГБ
+IMAGE_RESIZE_WORKERS = 4
+
+# Передача медиа файлов прокси (apps.core.media_serving): '' - отдает Django,
+# 'x-accel' - nginx (X-Accel-Redirect), 'x-sendfile' - Apache/lighttpd (X-Sendfile)
+MEDIA_ACCEL = os.getenv('MEDIA_ACCEL', '')
+# Внутренние location nginx для MEDIA_ROOT и IMAGE_RESIZE_CACHE_DIR
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+IMAGE_RESIZE_ACCEL_PREFIX = '/protected-resized/'
+
 # Авто-поле по умолчанию
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -211,6 +223,9 @@ CACHES = {
         'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # msgpack для простых данных, zstd для значений длиннее 1 КБ
+            'SERIALIZER': 'apps.core.cache_serializer.CompactSerializer',
+            'COMPRESSOR': 'apps.core.cache_serializer.ThresholdZStdCompressor',
         }
     }
 }
@@ -223,6 +238,38 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Периодические задачи
+CELERY_BEAT_SCHEDULE = {
+    'drain-analytics-events': {
+        'task': 'apps.analytics.tasks.drain_events_task',
+        'schedule': 5,
+    },
+    'flush-view-counters': {
+        'task': 'apps.advertisements.tasks.flush_view_counters_task',
+        'schedule': 30,
+    },
+    'refresh-similar-ads': {
+        'task': 'apps.advertisements.tasks.refresh_similar_ads_task',
+        'schedule': 10 * 60,
+    },
+    'reconcile-counters': {
+        'task': 'apps.advertisements.tasks.reconcile_counters_task',
+        'schedule': 60 * 60,
+    },
+    'rebuild-search-suggestions': {
+        'task': 'apps.advertisements.tasks.rebuild_suggestions_task',
+        'schedule': 60 * 60,
+    },
+    'refresh-home-snapshot': {
+        'task': 'apps.core.tasks.refresh_home_snapshot_task',
+        'schedule': 5 * 60,
+    },
+    'warm-cache': {
+        'task': 'apps.core.tasks.warm_cache_task',
+        'schedule': 15 * 60,
+    },
+}
+
 # Настройки email
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.yandex.ru'
@@ -43,6 +43,8 @@ CACHES = {
         'LOCATION': 'redis://127.0.0.1:6379/1',  # Проверьте порт
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SERIALIZER': 'apps.core.cache_serializer.CompactSerializer',
+            'COMPRESSOR': 'apps.core.cache_serializer.ThresholdZStdCompressor',
             # Добавьте таймауты
             'SOCKET_CONNECT_TIMEOUT': 5,
             'SOCKET_TIMEOUT': 5,
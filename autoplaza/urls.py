@@ -5,10 +5,19 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
 
+from apps.core.views import media_file, resized_image
+
 urlpatterns = [
     # Админка
     path('admin/', admin.site.urls),
 
+    # Уменьшенные копии изображений (apps.core.image_resize)
+    path(
+        f"{settings.MEDIA_URL.lstrip('/')}r/<int:width>x<int:height>/<path:path>",
+        resized_image,
+        name='resized_image',
+    ),
+
     # Главная страница через core app
     path('', include('apps.core.urls', namespace='core')),
 
@@ -31,9 +40,14 @@ urlpatterns = [
     path('payments/', include('apps.payments.urls', namespace='payments')),
 ]
 
+# Медиа файлы без прокси и старые фото объявлений (в production остальное отдает прокси,
+# см. apps.core.media_serving)
+urlpatterns += [
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", media_file, name='media'),
+]
+
 # Статические файлы
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
     # Django Debug Toolbar